@@ -359,7 +359,9 @@ export class SheetConnector {
             // Check if the values are color names - <<< KEEPING THIS OLD LOGIC FOR NOW >>>
             // We will eventually remove this and apply formatting separately
             const firstValue = op.values[0]?.[0];
-            if (typeof firstValue === 'string' && this.getColorHex(firstValue.toLowerCase())) {
+            // Only single-cell writes can be color ops; block writes may start with any name
+            const isSingleCell = op.values.length === 1 && Array.isArray(op.values[0]) && op.values[0].length === 1;
+            if (isSingleCell && typeof firstValue === 'string' && this.getColorHex(firstValue.toLowerCase())) {
               // If it's a color name, treat it as a color operation
               const colorHex = this.getColorHex(firstValue.toLowerCase());
               if (colorHex) {
@@ -0,0 +1,129 @@
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional
+import logging
+import multiprocessing
+import os
+import threading
+
+from column_detector import detect_column_mapping, HEURISTIC_CONFIDENCE_THRESHOLD
+from metrics import TaskTimings
+from op_codec import validate_ops
+from plan_ops import PLAN_OUTPUT_MODE, perform_cap_table_calculations, build_structured_ops
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+BATCH_WORKERS = int(os.environ.get("PLAN_BATCH_WORKERS", "0")) or os.cpu_count() or 1
+BATCH_MAX_JOBS = int(os.environ.get("PLAN_BATCH_MAX_JOBS", "500"))
+
+
+# --- Worker Side (runs in a pool process; no model, no server state) ---
+def plan_batch_job(slots: Dict[str, Any], sheet_data: List[List[str]], selected_range_address: str,
+                   column_mapping: Optional[Dict[str, Any]] = None, mapping_source: Optional[str] = None,
+                   output_mode: str = PLAN_OUTPUT_MODE) -> Dict[str, Any]:
+    """
+    Plans one job without the LLM: the given mapping (cache or LLM, resolved by
+    the server) or the heuristic detector. Returns {"status": "needs_llm",
+    "confidence": ...} when the detector isn't confident enough, else the same
+    result dict as a /plan task.
+    """
+    timings = TaskTimings()
+    if column_mapping is None:
+        with timings.stage("mapping_lookup"):
+            column_mapping, confidence = detect_column_mapping(sheet_data)
+        if confidence < HEURISTIC_CONFIDENCE_THRESHOLD:
+            return {"status": "needs_llm", "confidence": confidence}
+        mapping_source = "heuristic"
+
+    with timings.stage("calculations"):
+        calculated_values = perform_cap_table_calculations(slots, sheet_data, column_mapping)
+    with timings.stage("op_build"):
+        ops = build_structured_ops(slots, sheet_data, selected_range_address, column_mapping, calculated_values, output_mode)
+    with timings.stage("validation"):
+        ops = validate_ops(ops)
+    return {
+        "status": "completed",
+        "result": {
+            "ops": ops,
+            "raw_llm_output": None,
+            "slots": slots,
+            "calculated_values": calculated_values,
+            "column_mapping": column_mapping,
+            "mapping_source": mapping_source,
+            "metrics": timings.as_dict(),  # Worker-side stages; the process's histograms aren't scraped
+        },
+    }
+
+
+def _init_worker() -> None:
+    # Pool processes only need warnings; per-job info logs would flood stderr
+    logging.basicConfig(level=logging.WARNING)
+
+
+# --- Server Side ---
+class BatchPlanner:
+    """
+    Process pool for the deterministic part of batch plans (mapping detection,
+    calculations, op building), sized to the available cores. Started on first
+    use. A worker crash fails only the jobs it held; the pool is then replaced.
+    """
+
+    def __init__(self, workers: int = BATCH_WORKERS):
+        self.workers = max(1, workers)
+        self.batches = 0
+        self.jobs = 0
+        self.failed_jobs = 0
+        self.pool_restarts = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn: the server process runs model and logging threads, which fork would copy mid-state
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                                     mp_context=multiprocessing.get_context("spawn"))
+                logger.info(f"Batch planner started {self.workers} worker process(es).")
+            return self._executor
+
+    def submit(self, *args) -> "Future[Dict[str, Any]]":
+        """Submits plan_batch_job(*args) to the pool."""
+        try:
+            return self._pool().submit(plan_batch_job, *args)
+        except BrokenProcessPool:
+            self.reset()
+            return self._pool().submit(plan_batch_job, *args)
+
+    def reset(self) -> None:
+        """Drops a broken pool (a worker died); the next submit starts a fresh one."""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+                self.pool_restarts += 1
+
+    def record_batch(self, jobs: int, failed: int) -> None:
+        with self._lock:
+            self.batches += 1
+            self.jobs += jobs
+            self.failed_jobs += failed
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "running": self._executor is not None,
+                "max_jobs": BATCH_MAX_JOBS,
+                "batches": self.batches,
+                "jobs": self.jobs,
+                "failed_jobs": self.failed_jobs,
+                "pool_restarts": self.pool_restarts,
+            }
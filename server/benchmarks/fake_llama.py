@@ -0,0 +1,109 @@
+"""
+Deterministic stand-in for llama_cpp.Llama so the server can be benchmarked
+without the GGUF model. Latency is simulated per prompt token evaluated and
+per output token generated. Tokens already in the context are skipped, like
+llama-cpp-python does, so prefix caching shows up in the timings.
+"""
+from typing import Any, Dict, Iterator, List
+import importlib.util
+import json
+import sys
+import time
+import types
+
+# Canned outputs, chosen by what the prompt asks for
+PLAN_OUTPUT = json.dumps({"column_mapping": {
+    "shareholder_name_col_idx": 0, "pre_round_investment_col_idx": 1, "pre_round_shares_col_idx": 2}})
+SLOT_OUTPUT = "{}"
+
+_BYTES_PER_TOKEN = 4
+
+
+class FakeLlama:
+    def __init__(self, prompt_ms_per_token: float = 0.05, gen_ms_per_token: float = 5.0,
+                 base_ms: float = 0.0, **kwargs):
+        self.prompt_ms_per_token = prompt_ms_per_token
+        self.gen_ms_per_token = gen_ms_per_token
+        self.base_ms = base_ms
+        self._ids: List[int] = []
+        self.calls = 0
+
+    # --- Tokens and state (enough for prefix_cache.PrefixStateCache) ---
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False) -> List[int]:
+        return [int.from_bytes(text[i:i + _BYTES_PER_TOKEN], "little")
+                for i in range(0, len(text), _BYTES_PER_TOKEN)]
+
+    @property
+    def input_ids(self) -> List[int]:
+        return self._ids
+
+    @property
+    def n_tokens(self) -> int:
+        return len(self._ids)
+
+    def reset(self) -> None:
+        self._ids = []
+
+    def eval(self, tokens: List[int]) -> None:
+        time.sleep(len(tokens) * self.prompt_ms_per_token / 1000)
+        self._ids = self._ids + list(tokens)
+
+    def save_state(self) -> List[int]:
+        return list(self._ids)
+
+    def load_state(self, state: List[int]) -> None:
+        self._ids = list(state)
+
+    # --- Completion ---
+    def _output_for(self, prompt: str) -> str:
+        return PLAN_OUTPUT if "column_mapping" in prompt else SLOT_OUTPUT
+
+    def _evaluate_prompt(self, prompt: str) -> None:
+        tokens = self.tokenize(prompt.encode("utf-8"))
+        matched = 0
+        for cached, new in zip(self._ids, tokens):
+            if cached != new:
+                break
+            matched += 1
+        self._ids = self._ids[:matched]
+        time.sleep(self.base_ms / 1000)
+        self.eval(tokens[matched:])
+
+    def create_completion(self, prompt: str = "", stream: bool = False, max_tokens: int = 16, **kwargs) -> Any:
+        self.calls += 1
+        self._evaluate_prompt(prompt)
+        text = self._output_for(prompt)
+        pieces = [text[i:i + _BYTES_PER_TOKEN] for i in range(0, len(text), _BYTES_PER_TOKEN)][:max_tokens]
+        text = "".join(pieces)
+        if stream:
+            return self._stream(pieces)
+        time.sleep(len(pieces) * self.gen_ms_per_token / 1000)
+        return {"choices": [{"text": text, "finish_reason": "stop"}]}
+
+    def _stream(self, pieces: List[str]) -> Iterator[Dict[str, Any]]:
+        for piece in pieces:
+            time.sleep(self.gen_ms_per_token / 1000)
+            yield {"choices": [{"text": piece, "finish_reason": None}]}
+
+    __call__ = create_completion
+
+
+class FakeGrammar:
+    """Accepted and ignored; the canned outputs already match the grammars."""
+
+    def __init__(self, gbnf: str):
+        self.gbnf = gbnf
+
+    @classmethod
+    def from_string(cls, gbnf: str, verbose: bool = True) -> "FakeGrammar":
+        return cls(gbnf)
+
+
+def install_llama_cpp_shim() -> None:
+    """Registers a minimal `llama_cpp` module when llama-cpp-python isn't installed."""
+    # Only checks availability; model.py imports the real package when it is installed
+    if importlib.util.find_spec("llama_cpp") is None:
+        shim = types.ModuleType("llama_cpp")
+        shim.Llama = FakeLlama
+        shim.LlamaGrammar = FakeGrammar
+        sys.modules["llama_cpp"] = shim
@@ -0,0 +1,300 @@
+"""
+Benchmarks for the cap table server, using a fake LLM (benchmarks/fake_llama.py).
+
+    cd server
+    python benchmarks/run_benchmarks.py micro --rows 10,1000,100000,1000000
+    python benchmarks/run_benchmarks.py load --concurrency 16 --requests 400
+    python benchmarks/run_benchmarks.py all --output bench.json
+
+`load` starts the app in-process on a free port with the fake model, unless
+--url points at an already running server. Results are printed as one JSON
+document (or written to --output) so runs can be compared for regressions.
+"""
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import socket
+import sys
+import threading
+import time
+
+SERVER_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SERVER_DIR))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+# Keep benchmark runs away from the on-disk session/result stores
+os.environ.setdefault("SESSION_STORE", "memory")
+os.environ.setdefault("RESULT_STORE", "memory")
+
+from fake_llama import FakeLlama, install_llama_cpp_shim  # noqa: E402
+from synthetic import generate_cap_table, opaque_header, selection_address  # noqa: E402
+
+install_llama_cpp_shim()
+
+import numpy as np  # noqa: E402
+
+import main  # noqa: E402
+from cap_table import compute_round, extract_investor_columns  # noqa: E402
+from model import inference_pool, parse_column_mapping  # noqa: E402
+from op_codec import dumps, validate_ops  # noqa: E402
+from waterfall import compute_waterfall  # noqa: E402
+
+BENCH_SLOTS = {"roundType": "Series A", "amount": 5_000_000, "preMoney": 20_000_000, "poolPct": 10}
+# Seed with a note and a SAFE converting, then a Series A with a SAFE and a pre-money pool top-up
+BENCH_EVENTS = [
+    {"type": "note", "amount": 500_000, "cap": 6_000_000, "discount": 20, "interestPct": 8},
+    {"type": "safe", "amount": 250_000, "discount": 20},
+    {"type": "priced", "roundType": "Seed", "amount": 2_000_000, "preMoney": 8_000_000, "poolPct": 10, "poolTiming": "pre"},
+    {"type": "safe", "amount": 1_000_000, "cap": 30_000_000},
+    {"type": "priced", "roundType": "Series A", "amount": 10_000_000, "preMoney": 40_000_000, "poolPct": 15},
+]
+BENCH_MAPPING = {"shareholder_name_col_idx": 0, "pre_round_investment_col_idx": 1, "pre_round_shares_col_idx": 2}
+# Free-form (LLM_GRAMMAR=0) LLM outputs in the shapes parse_column_mapping's repair paths cope with
+LLM_OUTPUT_SAMPLES = [
+    '{"column_mapping": {"shareholder_name_col_idx": 0, "pre_round_shares_col_idx": 2, "pre_round_investment_col_idx": 1}}',
+    'Here is the mapping:\n{\n  "column_mapping": {\n    "shareholder_name_col_idx": 0,\n'
+    '    "pre_round_shares_col_idx": 2,\n    "pre_round_investment_col_idx": null,\n  }\n}\nDone.',
+    '```json\n{"column_mapping": {"shareholder_name_col_idx": 1, "pre_round_shares_col_idx": 3, '
+    '"pre_round_investment_col_idx": 2}}\n```',
+]
+CHAT_MESSAGES = ["Series A", "we are raising $5M", "pre-money of 20 million", "10% pool", "not sure yet"]
+
+
+# --- Stats ---
+def summarize_ms(samples: List[float]) -> Dict[str, Any]:
+    """Latency summary in milliseconds for a list of durations in seconds."""
+    if not samples:
+        return {"count": 0}
+    ms = np.array(samples) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {"count": len(samples), "mean_ms": round(float(ms.mean()), 3), "p50_ms": round(float(p50), 3),
+            "p95_ms": round(float(p95), 3), "p99_ms": round(float(p99), 3), "max_ms": round(float(ms.max()), 3)}
+
+
+def peak_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def time_repeated(fn: Callable[[], Any], repeat: int) -> Dict[str, Any]:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return summarize_ms(samples)
+
+
+# --- Microbenchmarks ---
+def run_micro(row_counts: List[int], repeat: Optional[int]) -> Dict[str, Any]:
+    results: Dict[str, Any] = {
+        "parse_column_mapping": time_repeated(lambda: [parse_column_mapping(s, free_form=True) for s in LLM_OUTPUT_SAMPLES], 200),
+    }
+    for n_rows in row_counts:
+        sheet = generate_cap_table(n_rows, seed=n_rows)
+        address = selection_address(sheet)
+        runs = repeat or max(3, min(50, 200_000 // max(n_rows, 1)))
+        calcs = main.perform_cap_table_calculations(BENCH_SLOTS, sheet, BENCH_MAPPING)
+        ops = main.build_structured_ops(BENCH_SLOTS, sheet, address, BENCH_MAPPING, calcs)
+        columns = extract_investor_columns(sheet, BENCH_MAPPING)
+        results[f"rows_{n_rows}"] = {
+            # Float vs fixed-point share math, and what the "% Ownership" SUM adds up to in each
+            "compute_round": {precision: time_repeated(lambda p=precision: compute_round(BENCH_SLOTS, columns, p), runs)
+                              for precision in ("float", "exact")},
+            "ownership_sum": {precision: sum(compute_round(BENCH_SLOTS, columns, precision)["final_ownership_pct"].values())
+                              for precision in ("float", "exact")},
+            "compute_waterfall": time_repeated(lambda: compute_waterfall(BENCH_EVENTS, columns), runs),
+            "perform_cap_table_calculations": time_repeated(
+                lambda: main.perform_cap_table_calculations(BENCH_SLOTS, sheet, BENCH_MAPPING), runs),
+            "build_structured_ops": time_repeated(
+                lambda: main.build_structured_ops(BENCH_SLOTS, sheet, address, BENCH_MAPPING, calcs), runs),
+            "validate_and_encode_ops": time_repeated(lambda: dumps(validate_ops(ops)), runs),
+            "op_count": len(ops),
+            "result_bytes": len(dumps(ops)),
+        }
+        print(f"micro: {n_rows} rows done", file=sys.stderr)
+    return results
+
+
+# --- Load Generator ---
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_local_server(args) -> tuple:
+    """Runs the app with fake model workers on a background thread. Returns (url, server)."""
+    import uvicorn
+
+    inference_pool.llm_factory = lambda: FakeLlama(
+        prompt_ms_per_token=args.prompt_ms_per_token, gen_ms_per_token=args.gen_ms_per_token, base_ms=args.base_ms)
+    main.column_mapping_cache.path = None  # Don't touch the persisted cache
+    main.column_mapping_cache.clear()
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level=args.log_level.lower()))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    set_log_level(args.log_level)  # uvicorn reconfigures its loggers (main logs to "uvicorn") on startup
+    return f"http://127.0.0.1:{port}", server
+
+
+async def _chat_request(client, worker_idx: int, turn: int) -> int:
+    response = await client.post("/chat", json={"sessionId": f"bench-{worker_idx}",
+                                                "message": CHAT_MESSAGES[turn % len(CHAT_MESSAGES)]})
+    return response.status_code
+
+
+async def _plan_request(client, sheet: List[List[str]], poll_interval: float, timeout: float) -> int:
+    response = await client.post("/plan", json={"slots": BENCH_SLOTS, "sheetData": sheet,
+                                                "selectedRangeAddress": selection_address(sheet)})
+    if response.status_code != 202:
+        return response.status_code
+    task_id = response.json()["task_id"]
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        await asyncio.sleep(poll_interval)
+        result = await client.get(f"/plan/result/{task_id}")
+        if result.status_code != 200:
+            return result.status_code
+        status = result.json().get("status")
+        if status == "completed":
+            return 200
+        if status == "failed":
+            return 500
+    return 504
+
+
+async def run_load(url: str, args) -> Dict[str, Any]:
+    import httpx
+
+    rng = random.Random(args.seed)
+    named_sheet = generate_cap_table(args.plan_rows, seed=1)
+    counter = itertools.count()
+    samples: Dict[str, Dict[str, Any]] = {kind: {"latencies": [], "statuses": {}} for kind in ("chat", "plan")}
+
+    async def worker(worker_idx: int, client) -> None:
+        turn = 0
+        while next(counter) < args.requests:
+            kind = "chat" if rng.random() < args.chat_ratio else "plan"
+            started = time.perf_counter()
+            try:
+                if kind == "chat":
+                    status = await _chat_request(client, worker_idx, turn)
+                    turn += 1
+                else:
+                    if args.plan_mapping == "llm":
+                        # Fresh headers per request: misses the mapping cache and the heuristic detector
+                        sheet = generate_cap_table(args.plan_rows, seed=1, header=opaque_header(rng.randrange(10**9)))
+                    else:
+                        sheet = named_sheet
+                    status = await _plan_request(client, sheet, args.poll_interval, args.timeout)
+            except httpx.HTTPError:
+                status = -1
+            elapsed = time.perf_counter() - started
+            bucket = samples[kind]
+            bucket["statuses"][status] = bucket["statuses"].get(status, 0) + 1
+            if status == 200:
+                bucket["latencies"].append(elapsed)
+
+    limits = httpx.Limits(max_connections=args.concurrency)
+    started = time.perf_counter()
+    async with httpx.AsyncClient(base_url=url, timeout=args.timeout, limits=limits) as client:
+        await asyncio.gather(*(worker(i, client) for i in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+        server_stats = {}
+        for path in ("/inference/stats", "/inference/prefix-cache", "/cache/column-mapping"):
+            try:
+                server_stats[path] = (await client.get(path)).json()
+            except (httpx.HTTPError, ValueError):
+                pass
+
+    report: Dict[str, Any] = {"elapsed_s": round(elapsed, 3), "concurrency": args.concurrency,
+                              "requests": args.requests, "server_stats": server_stats}
+    for kind, bucket in samples.items():
+        ok = len(bucket["latencies"])
+        report[kind] = {
+            "ok": ok,
+            "rps": round(ok / elapsed, 2) if elapsed else 0.0,
+            "rejected_429": bucket["statuses"].get(429, 0),
+            "statuses": {str(k): v for k, v in sorted(bucket["statuses"].items())},
+            "latency": summarize_ms(bucket["latencies"]),
+        }
+    return report
+
+
+# --- CLI ---
+def set_log_level(level: str) -> None:
+    for name in ("", "uvicorn", "uvicorn.error", "uvicorn.access"):
+        logging.getLogger(name).setLevel(level)
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("suite", choices=("micro", "load", "all"))
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--log-level", default="WARNING", help="Server log level while benchmarking")
+    micro = parser.add_argument_group("micro")
+    micro.add_argument("--rows", default="10,1000,100000,1000000", help="Comma-separated cap table sizes")
+    micro.add_argument("--repeat", type=int, help="Runs per measurement (default: scaled by size)")
+    load = parser.add_argument_group("load")
+    load.add_argument("--url", help="Benchmark a running server instead of starting one in-process")
+    load.add_argument("--concurrency", type=int, default=8)
+    load.add_argument("--requests", type=int, default=200, help="Total /chat + /plan requests")
+    load.add_argument("--chat-ratio", type=float, default=0.5, help="Share of requests that are /chat")
+    load.add_argument("--plan-rows", type=int, default=500)
+    load.add_argument("--plan-mapping", choices=("llm", "heuristic"), default="llm",
+                      help="'llm' sends unrecognizable headers so every /plan calls the model")
+    load.add_argument("--poll-interval", type=float, default=0.05)
+    load.add_argument("--timeout", type=float, default=120.0)
+    load.add_argument("--seed", type=int, default=0)
+    fake = parser.add_argument_group("fake model (in-process server only)")
+    fake.add_argument("--prompt-ms-per-token", type=float, default=0.05)
+    fake.add_argument("--gen-ms-per-token", type=float, default=5.0)
+    fake.add_argument("--base-ms", type=float, default=0.0)
+    return parser.parse_args(argv)
+
+
+def main_cli(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    set_log_level(args.log_level)
+
+    report: Dict[str, Any] = {
+        "meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "python": platform.python_version(),
+                 "platform": platform.platform(), "argv": sys.argv[1:]},
+    }
+    if args.suite in ("micro", "all"):
+        report["micro"] = run_micro([int(n) for n in args.rows.split(",") if n], args.repeat)
+    if args.suite in ("load", "all"):
+        server = None
+        url = args.url
+        if url is None:
+            url, server = start_local_server(args)
+        try:
+            report["load"] = asyncio.run(run_load(url, args))
+        finally:
+            if server is not None:
+                server.should_exit = True
+    report["peak_rss_mb"] = peak_rss_mb()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n", encoding="utf-8")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,36 @@
+"""Synthetic cap table selections for benchmarks."""
+from typing import List
+import random
+
+NAMED_HEADER = ["Shareholder", "Investment ($)", "Shares"]
+
+
+def generate_cap_table(n_rows: int, seed: int = 0, header: List[str] = None) -> List[List[str]]:
+    """
+    Header plus `n_rows` holders in (name, investment, shares) layout, formatted
+    like Excel's text values: "$1,250,000" investments and plain share counts,
+    with a few blank and malformed cells.
+    """
+    rng = random.Random(seed)
+    rows = [list(header or NAMED_HEADER)]
+    for i in range(n_rows):
+        shares = rng.randint(1_000, 5_000_000)
+        investment = round(shares * rng.uniform(0.05, 2.0), -2)
+        roll = rng.random()
+        if roll < 0.01:
+            investment_cell = ""
+        elif roll < 0.015:
+            investment_cell = "n/a"
+        else:
+            investment_cell = f"${investment:,.0f}"
+        rows.append([f"Holder {i + 1}", investment_cell, str(shares)])
+    return rows
+
+
+def opaque_header(seed: int) -> List[str]:
+    """Headers that neither the mapping cache nor the heuristic detector recognize, forcing the LLM path."""
+    return [f"field_{seed}_{col}" for col in ("a", "b", "c")]
+
+
+def selection_address(sheet: List[List[str]]) -> str:
+    return f"Sheet1!A1:C{len(sheet)}"
@@ -0,0 +1,485 @@
+from dataclasses import dataclass, field, replace
+from decimal import Decimal
+from fractions import Fraction
+from typing import List, Dict, Any, Optional, Tuple
+import logging
+import math
+import os
+
+import numpy as np
+
+from sheet_columns import ColumnarSheet
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# "float": binary floating point throughout. "exact": whole shares as int64 with
+# largest-remainder rounding, exact round math, and ownership in fixed-point units
+CAP_TABLE_PRECISION = os.environ.get("CAP_TABLE_PRECISION", "float")
+# Ownership resolution in "exact" mode is 2**-40 (~1e-12). A power of two makes every
+# percentage an exact float, so Excel's SUM over the column is exactly 1
+OWNERSHIP_FRACTION_BITS = 40
+MAX_EXACT_SHARES = 2 ** 53  # Keeps the int64 long division below from overflowing
+
+# Characters stripped from numeric cells before parsing
+_SHARES_STRIP = str.maketrans("", "", ",")
+_CURRENCY_STRIP = str.maketrans("", "", "$,")
+
+
+# --- Columnar Investor Data ---
+@dataclass
+class InvestorColumns:
+    """Typed, column-oriented view of the investor rows in a sheet selection."""
+    names: List[str]
+    pre_shares: np.ndarray  # float64, one entry per investor row
+    investment: np.ndarray  # float64, one entry per investor row
+    skipped_rows: int = 0  # Rows dropped (empty or no valid name column)
+    unparsed_shares: int = 0  # Share cells that could not be parsed (treated as 0)
+    unparsed_investment: int = 0  # Investment cells that could not be parsed (treated as 0)
+    row_nums: List[int] = field(default_factory=list)  # Source sheetData row of each investor
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def copy(self) -> "InvestorColumns":
+        """Independent copy whose arrays and lists can be updated without touching this one."""
+        return replace(self, names=list(self.names), pre_shares=self.pre_shares.copy(),
+                       investment=self.investment.copy(), row_nums=list(self.row_nums))
+
+
+def _parse_numeric_column(raw: List[Any], strip_table: Dict[int, Any]) -> Tuple[np.ndarray, int]:
+    """
+    Parses a list of raw cell values into a float64 array in a single pass.
+    Missing/empty cells become 0. Unparseable cells become 0 and are counted.
+    """
+    cleaned = [
+        "0" if value is None or value == "" else str(value).translate(strip_table)
+        for value in raw
+    ]
+    try:
+        # Fast path: every cell is numeric, let NumPy convert the whole column at once
+        return np.array(cleaned, dtype=np.float64), 0
+    except (ValueError, TypeError):
+        pass
+
+    # Slow path: at least one bad cell, convert individually and count failures
+    out = np.zeros(len(cleaned), dtype=np.float64)
+    failures = 0
+    for i, text in enumerate(cleaned):
+        try:
+            out[i] = float(text)
+        except (ValueError, TypeError):
+            failures += 1
+    return out, failures
+
+
+def _column_values(rows: List[List[Any]], idx: Optional[int]) -> Optional[List[Any]]:
+    """Returns the raw values of column `idx`, using None where a row is too short."""
+    if idx is None or idx < 0:
+        return None
+    return [row[idx] if idx < len(row) else None for row in rows]
+
+
+def _columnar_numeric(sheet: ColumnarSheet, idx: Optional[int], strip_table: Dict[int, Any]) -> Tuple[np.ndarray, int]:
+    """
+    A mapped column of an uploaded columnar sheet as a fresh float64 array (re-plans
+    edit it in place), header cell first. Typed columns need no cell parsing:
+    empty cells (NaN) become 0 like "" does in the JSON path.
+    """
+    n_rows = len(sheet)
+    if idx is None or idx < 0 or idx >= sheet.n_cols:
+        return np.zeros(n_rows, dtype=np.float64), 0
+    column = sheet.columns[idx]
+    if not isinstance(column, np.ndarray):
+        return _parse_numeric_column(sheet.column_text(idx), strip_table)
+    out = np.empty(n_rows, dtype=np.float64)
+    failures = 0
+    if sheet.header is not None:
+        out[0], failed = _parse_cell(sheet.header[idx], strip_table)
+        failures = int(failed)
+    body = out[sheet.header_rows:]
+    np.copyto(body, column)
+    body[np.isnan(body)] = 0.0
+    return out, failures
+
+
+def _extract_columnar(sheet: ColumnarSheet, column_mapping: Dict) -> InvestorColumns:
+    """extract_investor_columns for a columnar upload: every row has every column."""
+    name_idx = column_mapping.get("shareholder_name_col_idx", 0)
+    if name_idx is None or not 0 <= name_idx < sheet.n_cols:
+        return InvestorColumns(names=[], pre_shares=np.zeros(0), investment=np.zeros(0), skipped_rows=len(sheet))
+
+    names = sheet.column_text(name_idx)
+    pre_shares, unparsed_shares = _columnar_numeric(sheet, column_mapping.get("pre_round_shares_col_idx"), _SHARES_STRIP)
+    investment, unparsed_investment = _columnar_numeric(sheet, column_mapping.get("pre_round_investment_col_idx"),
+                                                        _CURRENCY_STRIP)
+    return InvestorColumns(
+        names=names,
+        pre_shares=pre_shares,
+        investment=investment,
+        unparsed_shares=unparsed_shares,
+        unparsed_investment=unparsed_investment,
+        row_nums=list(range(len(sheet))),
+    )
+
+
+def extract_investor_columns(sheetData: List[List[Any]], column_mapping: Dict) -> InvestorColumns:
+    """Parses the mapped name, shares and investment columns into typed arrays."""
+    if isinstance(sheetData, ColumnarSheet):
+        return _extract_columnar(sheetData, column_mapping)
+    name_idx = column_mapping.get("shareholder_name_col_idx", 0)
+    shares_idx = column_mapping.get("pre_round_shares_col_idx")  # NO DEFAULT! Let None be None
+    inv_idx = column_mapping.get("pre_round_investment_col_idx")
+
+    # Keep only rows that are non-empty lists with a valid name column
+    row_nums, rows = [], []
+    if name_idx is not None and name_idx >= 0:
+        for row_num, row in enumerate(sheetData):
+            if isinstance(row, list) and name_idx < len(row):
+                row_nums.append(row_num)
+                rows.append(row)
+    skipped_rows = len(sheetData) - len(rows)
+
+    names = [
+        str(row[name_idx]) if row[name_idx] is not None else f"Row {row_num+1}"
+        for row_num, row in zip(row_nums, rows)
+    ]
+
+    shares_raw = _column_values(rows, shares_idx)
+    if shares_raw is None:
+        pre_shares, unparsed_shares = np.zeros(len(rows), dtype=np.float64), 0
+    else:
+        pre_shares, unparsed_shares = _parse_numeric_column(shares_raw, _SHARES_STRIP)
+
+    inv_raw = _column_values(rows, inv_idx)
+    if inv_raw is None:
+        investment, unparsed_investment = np.zeros(len(rows), dtype=np.float64), 0
+    else:
+        investment, unparsed_investment = _parse_numeric_column(inv_raw, _CURRENCY_STRIP)
+
+    return InvestorColumns(
+        names=names,
+        pre_shares=pre_shares,
+        investment=investment,
+        skipped_rows=skipped_rows,
+        unparsed_shares=unparsed_shares,
+        unparsed_investment=unparsed_investment,
+        row_nums=row_nums,
+    )
+
+
+def _parse_cell(value: Any, strip_table: Dict[int, Any]) -> Tuple[float, bool]:
+    """Single-cell version of _parse_numeric_column: (value, failed)."""
+    if value is None or value == "":
+        return 0.0, False
+    try:
+        return float(str(value).translate(strip_table)), False
+    except (ValueError, TypeError):
+        return 0.0, True
+
+
+def update_investor_rows(columns: InvestorColumns, sheetData: List[List[Any]], column_mapping: Dict,
+                         row_updates: Dict[int, List[Any]]) -> bool:
+    """
+    Applies edited rows (sheetData row index -> new cells) to `sheetData` and to
+    the parsed arrays in place, re-parsing only those rows. Returns False without
+    touching anything when an edit changes which rows are investors; the caller
+    should then re-run extract_investor_columns on the updated sheetData.
+    """
+    name_idx = column_mapping.get("shareholder_name_col_idx", 0)
+    shares_idx = column_mapping.get("pre_round_shares_col_idx")
+    inv_idx = column_mapping.get("pre_round_investment_col_idx")
+    if name_idx is None or name_idx < 0:
+        return False
+
+    position = {row_num: pos for pos, row_num in enumerate(columns.row_nums)}
+    for row_num, row in row_updates.items():
+        valid = isinstance(row, list) and name_idx < len(row)
+        if not 0 <= row_num < len(sheetData) or valid != (row_num in position):
+            return False
+
+    for row_num, row in row_updates.items():
+        old_row = sheetData[row_num]
+        sheetData[row_num] = row
+        pos = position.get(row_num)
+        if pos is None:
+            continue  # Still not an investor row
+        columns.names[pos] = str(row[name_idx]) if row[name_idx] is not None else f"Row {row_num+1}"
+        for idx, array, strip_table, counter in ((shares_idx, columns.pre_shares, _SHARES_STRIP, "unparsed_shares"),
+                                                 (inv_idx, columns.investment, _CURRENCY_STRIP, "unparsed_investment")):
+            if idx is None or idx < 0:
+                continue
+            _, old_failed = _parse_cell(old_row[idx] if idx < len(old_row) else None, strip_table)
+            array[pos], failed = _parse_cell(row[idx] if idx < len(row) else None, strip_table)
+            setattr(columns, counter, getattr(columns, counter) - old_failed + failed)
+    return True
+
+
+# --- Round Calculations ---
+def compute_round(slots: Dict, columns: InvestorColumns, precision: str = CAP_TABLE_PRECISION) -> Dict:
+    """
+    Computes post-money values, price per share, option pool and ownership for a
+    single priced round. Returns the same `calcs` dict shape the ops builder expects.
+    """
+    if precision == "exact":
+        calcs = _compute_round_exact(slots, columns)
+        if calcs is not None:
+            return calcs
+    amount = float(slots.get("amount", 0))
+    pre_money = float(slots.get("preMoney", 0))
+    pool_pct_decimal = float(slots.get("poolPct", 0)) / 100.0
+
+    total_pre_round_shares = float(columns.pre_shares.sum())
+
+    calcs: Dict[str, Any] = {}
+    calcs["post_money_valuation"] = pre_money + amount
+    calcs["price_per_share"] = pre_money / total_pre_round_shares if total_pre_round_shares > 0 else 0
+    calcs["total_new_shares_for_round"] = amount / calcs["price_per_share"] if calcs["price_per_share"] > 0 else 0
+
+    total_post_money_shares_before_pool = total_pre_round_shares + calcs["total_new_shares_for_round"]
+
+    # Option pool sized as a percentage of the post-money share count
+    if 0 < pool_pct_decimal < 1:
+        total_post_money_shares_after_pool_target = total_post_money_shares_before_pool / (1.0 - pool_pct_decimal)
+        calcs["option_pool_shares"] = total_post_money_shares_after_pool_target - total_post_money_shares_before_pool
+    else:
+        calcs["option_pool_shares"] = 0
+
+    total_post_money_shares = total_post_money_shares_before_pool + calcs["option_pool_shares"]
+    calcs["total_post_money_shares"] = total_post_money_shares
+
+    if total_post_money_shares > 0:
+        ownership = columns.pre_shares / total_post_money_shares
+        new_investor_pct = calcs["total_new_shares_for_round"] / total_post_money_shares
+        pool_pct = calcs["option_pool_shares"] / total_post_money_shares
+    else:
+        ownership = np.zeros(len(columns), dtype=np.float64)
+        new_investor_pct = 0
+        pool_pct = 0
+
+    calcs["precision"] = "float"
+    return add_holder_results(calcs, columns, columns.pre_shares.tolist(), ownership.tolist(), [
+        ("New Investors", calcs["total_new_shares_for_round"], new_investor_pct),
+        ("Option Pool", calcs["option_pool_shares"], pool_pct),
+    ])
+
+
+def add_holder_results(calcs: Dict[str, Any], columns: InvestorColumns, pre_shares_list: List[Any],
+                       ownership_list: List[float], added_holders: List[Tuple[str, Any, float]]) -> Dict[str, Any]:
+    """
+    Adds the per-holder share, ownership and investor dicts to `calcs`.
+    `added_holders` are the (name, shares, ownership) of holders the round(s)
+    created, after the sheet's investors (New Investors and Option Pool for one round).
+    """
+    # Materialize the per-holder dicts in one go (later names win on duplicates, as before)
+    investment_list = columns.investment.tolist()
+    final_share_counts = dict(zip(columns.names, pre_shares_list))
+    final_ownership_pct = dict(zip(columns.names, ownership_list))
+
+    for name, shares, pct in added_holders:
+        final_share_counts[name] = shares
+        final_ownership_pct[name] = pct
+
+    calcs["final_share_counts"] = final_share_counts
+    calcs["final_ownership_pct"] = final_ownership_pct
+    calcs["parsed_investors"] = [
+        {"name": name, "pre_shares": shares, "investment": inv}
+        for name, shares, inv in zip(columns.names, pre_shares_list, investment_list)
+    ]
+    # First and last selection row of the investors when they are one contiguous run
+    # (formula output references them), else None
+    row_nums = columns.row_nums
+    contiguous = bool(row_nums) and row_nums[-1] - row_nums[0] + 1 == len(row_nums)
+    calcs["source_rows"] = [row_nums[0], row_nums[-1]] if contiguous else None
+    return calcs
+
+
+# --- Exact (Fixed-Point) Round Calculations ---
+def _largest_remainder(floors: np.ndarray, remainders: np.ndarray, total: int) -> np.ndarray:
+    """
+    Rounds quotas to integers summing to `total`: `floors` are the rounded-down
+    quotas, `remainders` their (comparable) fractional parts. The entries with the
+    largest remainders get one more unit each. Updates `floors` in place.
+    """
+    leftover = int(total - int(floors.sum()))
+    if leftover >= len(floors):
+        floors += 1
+    elif leftover > 0:
+        # O(n) selection of the `leftover` largest remainders; no full sort needed
+        floors[np.argpartition(remainders, len(floors) - leftover)[len(floors) - leftover:]] += 1
+    return floors
+
+
+def _whole_shares(shares: np.ndarray) -> np.ndarray:
+    """Share counts as int64 whole shares. Fractional cells are rounded so the total stays round(sum)."""
+    floors = np.floor(shares)
+    if np.array_equal(floors, shares):
+        return floors.astype(np.int64)
+    return _largest_remainder(floors.astype(np.int64), shares - floors, round(float(shares.sum())))
+
+
+def _ownership_units(shares: np.ndarray, total: int) -> np.ndarray:
+    """
+    Each holder's share of `total` in units of 2**-OWNERSHIP_FRACTION_BITS, summing to
+    exactly 2**OWNERSHIP_FRACTION_BITS. floor(shares * 2**bits / total) is computed by
+    long division, shifting in as many bits per step as int64 allows (remainder < total).
+    """
+    quotient = np.zeros_like(shares)
+    remainder = shares.copy()
+    bits_left = OWNERSHIP_FRACTION_BITS
+    max_step = max(1, 62 - total.bit_length())
+    while bits_left:
+        step = min(max_step, bits_left)
+        remainder <<= step
+        quotient = (quotient << step) + remainder // total
+        remainder %= total
+        bits_left -= step
+    return _largest_remainder(quotient, remainder, 1 << OWNERSHIP_FRACTION_BITS)
+
+
+def _exact_round_values(amount: Any, pre_money: Any, pool_pct: Any, total_pre_round_shares: int) -> Optional[Dict]:
+    """
+    The round values of _compute_round_exact for `total_pre_round_shares` whole shares:
+    post-money, price, and the new, pool and total shares. None beyond int64-safe totals.
+    """
+    amount = Decimal(str(amount))
+    pre_money = Decimal(str(pre_money))
+    pool_pct_decimal = Fraction(Decimal(str(pool_pct))) / 100
+
+    if pre_money > 0 and total_pre_round_shares > 0:
+        price_per_share = pre_money / total_pre_round_shares
+        new_shares_exact = Fraction(amount) * total_pre_round_shares / Fraction(pre_money)
+    else:
+        price_per_share = Decimal(0)
+        new_shares_exact = Fraction(0)
+    before_pool = total_pre_round_shares + new_shares_exact
+    if 0 < pool_pct_decimal < 1:
+        pool_shares_exact = before_pool / (1 - pool_pct_decimal) - before_pool
+    else:
+        pool_shares_exact = Fraction(0)
+
+    total_post_money_shares = round(before_pool + pool_shares_exact)
+    if abs(total_post_money_shares) >= MAX_EXACT_SHARES or abs(total_pre_round_shares) >= MAX_EXACT_SHARES:
+        return None
+    new_shares, pool_shares = _largest_remainder(
+        np.array([math.floor(new_shares_exact), math.floor(pool_shares_exact)], dtype=np.int64),
+        np.array([float(new_shares_exact % 1), float(pool_shares_exact % 1)]),
+        total_post_money_shares - total_pre_round_shares,
+    ).tolist()
+    return {
+        "post_money_valuation": float(pre_money + amount),
+        "price_per_share": float(price_per_share),
+        "total_new_shares_for_round": new_shares,
+        "option_pool_shares": pool_shares,
+        "total_post_money_shares": total_post_money_shares,
+        "precision": "exact",
+    }
+
+
+def _compute_round_exact(slots: Dict, columns: InvestorColumns) -> Optional[Dict]:
+    """
+    compute_round with whole-share int64 counts. Currency inputs are Decimal. New and
+    pool shares come from exact rationals, and the rounded post-money total is split
+    between them by largest remainder. Ownership is fixed point, so the holder column
+    (including New Investors and Option Pool) sums to exactly 1. Returns None (float
+    path) for share totals beyond int64-safe fixed point.
+    """
+    pre_shares = _whole_shares(columns.pre_shares)
+    calcs = _exact_round_values(slots.get("amount", 0), slots.get("preMoney", 0), slots.get("poolPct", 0),
+                                int(pre_shares.sum()))
+    if calcs is None:
+        logger.warning(f"Share totals above {MAX_EXACT_SHARES} are out of range for exact mode, using float math.")
+        return None
+    total_post_money_shares = calcs["total_post_money_shares"]
+    new_shares, pool_shares = calcs["total_new_shares_for_round"], calcs["option_pool_shares"]
+
+    if total_post_money_shares > 0:
+        units = _ownership_units(np.append(pre_shares, [new_shares, pool_shares]), total_post_money_shares)
+        ownership = units / float(1 << OWNERSHIP_FRACTION_BITS)  # Exact: units < 2**53
+    else:
+        ownership = np.zeros(len(columns) + 2, dtype=np.float64)
+    ownership_list = ownership.tolist()
+    return add_holder_results(calcs, columns, pre_shares.tolist(), ownership_list[:-2], [
+        ("New Investors", calcs["total_new_shares_for_round"], ownership_list[-2]),
+        ("Option Pool", calcs["option_pool_shares"], ownership_list[-1]),
+    ])
+
+
+def log_column_summary(columns: InvestorColumns) -> None:
+    """Logs one aggregated line per parsing issue instead of one line per row."""
+    if columns.skipped_rows:
+        logger.warning(f"Skipped {columns.skipped_rows} row(s) that were empty or had no valid name column.")
+    if columns.unparsed_shares:
+        logger.warning(f"Could not parse shares in {columns.unparsed_shares} row(s), using 0.0.")
+    if columns.unparsed_investment:
+        logger.warning(f"Could not parse investment in {columns.unparsed_investment} row(s), using 0.0.")
+    logger.info(f"Parsed {len(columns)} investor rows, total pre-round shares: {float(columns.pre_shares.sum())}")
+
+
+# --- Scenario Sweeps ---
+def compute_scenarios(columns: InvestorColumns, amounts: np.ndarray, pre_moneys: np.ndarray,
+                      pool_pcts: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    compute_round for S scenarios at once. Inputs are float64 arrays of length S
+    (poolPct in percent); every output is a length-S array except "ownership",
+    which is S x N (scenario x investor). Edge cases follow compute_round.
+    """
+    pool_pct_decimal = pool_pcts / 100.0
+    total_pre_round_shares = float(columns.pre_shares.sum())
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        post_money = pre_moneys + amounts
+        price_per_share = pre_moneys / total_pre_round_shares if total_pre_round_shares > 0 else np.zeros_like(pre_moneys)
+        new_shares = np.where(price_per_share > 0, amounts / price_per_share, 0.0)
+
+        before_pool = total_pre_round_shares + new_shares
+        pool_applies = (pool_pct_decimal > 0) & (pool_pct_decimal < 1)
+        pool_shares = np.where(pool_applies, before_pool / (1.0 - pool_pct_decimal) - before_pool, 0.0)
+        total_post = before_pool + pool_shares
+
+        has_shares = total_post > 0
+        inv_total = np.where(has_shares, 1.0 / total_post, 0.0)
+    return {
+        "post_money_valuation": post_money,
+        "price_per_share": price_per_share,
+        "total_new_shares_for_round": new_shares,
+        "option_pool_shares": pool_shares,
+        "total_post_money_shares": total_post,
+        "new_investors_pct": new_shares * inv_total,
+        "option_pool_pct": pool_shares * inv_total,
+        # Outer product: one broadcast multiply for every scenario/investor pair
+        "ownership": inv_total[:, None] * columns.pre_shares[None, :],
+    }
+
+
+def compute_scenarios_exact(columns: InvestorColumns, amounts: np.ndarray, pre_moneys: np.ndarray,
+                            pool_pcts: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    compute_scenarios with exact mode's whole-share round values: the rational new,
+    pool and total shares are solved per scenario (a few scalar operations each) and
+    the per-holder ownership is one broadcast division. Ownership stays float64 here;
+    a plan's fixed-point units differ from it by at most 2**-40. Scenarios beyond
+    int64-safe totals keep compute_scenarios' float values, as a plan would.
+    """
+    results = compute_scenarios(columns, amounts, pre_moneys, pool_pcts)
+    pre_shares = _whole_shares(columns.pre_shares)
+    total_pre_round_shares = int(pre_shares.sum())
+    keys = ("post_money_valuation", "price_per_share", "total_new_shares_for_round",
+            "option_pool_shares", "total_post_money_shares")
+    exact = np.zeros(len(amounts), dtype=bool)
+    for i, (amount, pre_money, pool_pct) in enumerate(zip(amounts.tolist(), pre_moneys.tolist(), pool_pcts.tolist())):
+        values = _exact_round_values(amount, pre_money, pool_pct, total_pre_round_shares)
+        if values is None:
+            continue
+        exact[i] = True
+        for key in keys:
+            results[key][i] = values[key]
+
+    total_post = results["total_post_money_shares"]
+    inv_total = np.divide(1.0, total_post, out=np.zeros(len(amounts)), where=total_post > 0)
+    results["new_investors_pct"] = results["total_new_shares_for_round"] * inv_total
+    results["option_pool_pct"] = results["option_pool_shares"] * inv_total
+    whole_ownership = inv_total[:, None] * pre_shares.astype(np.float64)[None, :]
+    results["ownership"] = np.where(exact[:, None], whole_ownership, results["ownership"])
+    return results
@@ -0,0 +1,219 @@
+from itertools import product
+from typing import List, Dict, Any, Optional, Sequence, Tuple
+import logging
+import re
+
+from sheet_columns import ColumnarSheet
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+HEURISTIC_CONFIDENCE_THRESHOLD = 0.65  # Below this, fall back to the LLM
+INVESTMENT_MIN_SCORE = 0.5  # Investment column is optional; leave it null below this
+DETECTOR_SAMPLE_ROWS = 200  # Data rows inspected per column (sheets can be huge)
+HEADER_WEIGHT = 0.6
+CONTENT_WEIGHT = 0.4
+NO_HEADER_CAP = 0.8  # Max score for a column matched on content alone
+AMBIGUITY_MARGIN = 0.1  # Runner-up this close to the winner means the pick is a guess
+AMBIGUITY_PENALTY = 0.75
+
+ROLES = ["shareholder_name_col_idx", "pre_round_shares_col_idx", "pre_round_investment_col_idx"]
+
+# Header vocabulary per role: whole-header phrases score 1.0, single tokens 0.7
+HEADER_SYNONYMS = {
+    "shareholder_name_col_idx": {
+        "phrases": {"shareholder", "shareholder name", "stockholder", "holder", "holder name", "name",
+                    "investor", "investor name", "owner", "member", "security holder", "entity"},
+        "tokens": {"shareholder", "stockholder", "holder", "name", "investor", "owner", "member", "entity"},
+    },
+    "pre_round_shares_col_idx": {
+        "phrases": {"shares", "# shares", "share count", "number of shares", "shares held", "shares owned",
+                    "pre-round shares", "pre round shares", "fully diluted shares", "fd shares", "units"},
+        "tokens": {"shares", "share", "units", "stock", "common", "preferred", "holdings", "#"},
+    },
+    "pre_round_investment_col_idx": {
+        "phrases": {"investment", "investment ($)", "invested", "amount invested", "investment amount",
+                    "capital", "capital contributed", "contribution", "cost basis", "amount ($)", "amount"},
+        "tokens": {"investment", "invested", "capital", "contribution", "contributed", "paid", "cost",
+                   "amount", "usd", "$", "dollars"},
+    },
+}
+# Tokens that mark a numeric column as something other than shares/investment
+NUMERIC_EXCLUDE_TOKENS = {"%", "ownership", "percent", "percentage", "pct", "price", "pps", "date",
+                          "year", "id", "email", "class", "type", "series", "round"}
+
+_TOKEN_RE = re.compile(r"[a-z]+|[$%#]")
+_NUMERIC_STRIP = str.maketrans("", "", "$,% ")
+
+
+# --- Column Profiling ---
+def _normalize_header(value: Any) -> str:
+    return " ".join(str(value if value is not None else "").lower().split())
+
+
+def _parse_number(text: str) -> Optional[float]:
+    try:
+        return float(text.translate(_NUMERIC_STRIP))
+    except ValueError:
+        return None
+
+
+def _profile_column(values: List[Any]) -> Dict[str, float]:
+    """Infers the dtype and value distribution of one column's data cells."""
+    texts = [str(v).strip() for v in values if v is not None and str(v).strip() != ""]
+    n = len(texts)
+    if n == 0:
+        return {"fill": 0.0, "numeric": 0.0, "text": 0.0, "integer": 0.0, "currency": 0.0,
+                "percent": 0.0, "fraction": 0.0, "unique": 0.0}
+
+    numbers = [_parse_number(t) for t in texts]
+    numeric = [x for x in numbers if x is not None]
+    n_numeric = len(numeric)
+    return {
+        "fill": n / len(values) if values else 0.0,
+        "numeric": n_numeric / n,
+        "text": (n - n_numeric) / n,
+        "integer": sum(1 for x in numeric if x == int(x)) / n_numeric if n_numeric else 0.0,
+        "currency": sum(1 for t in texts if "$" in t) / n,
+        "percent": sum(1 for t in texts if "%" in t) / n,
+        # Values in [0, 1] with a fractional part look like ownership ratios
+        "fraction": sum(1 for x in numeric if 0 <= x <= 1 and x != int(x)) / n_numeric if n_numeric else 0.0,
+        "unique": len(set(texts)) / n,
+    }
+
+
+def _header_score(header: str, role: str) -> float:
+    if not header:
+        return 0.0
+    tokens = set(_TOKEN_RE.findall(header))
+    if role != "shareholder_name_col_idx" and tokens & NUMERIC_EXCLUDE_TOKENS:
+        return 0.0
+    synonyms = HEADER_SYNONYMS[role]
+    if header in synonyms["phrases"]:
+        return 1.0
+    if tokens & synonyms["tokens"]:
+        return 0.7
+    return 0.0
+
+
+def _content_score(profile: Dict[str, float], role: str) -> float:
+    if profile["fill"] == 0:
+        return 0.0
+    if role == "shareholder_name_col_idx":
+        score = profile["text"] * (0.5 + 0.5 * profile["unique"])
+    else:
+        # Ownership columns (percent signs or 0-1 ratios) are never shares/investment
+        not_ratio = 1.0 - max(profile["percent"], profile["fraction"])
+        if role == "pre_round_shares_col_idx":
+            score = profile["numeric"] * (0.6 + 0.4 * profile["integer"]) * (1.0 - 0.5 * profile["currency"]) * not_ratio
+        else:
+            score = profile["numeric"] * (0.5 + 0.5 * profile["currency"]) * not_ratio
+    return score * min(1.0, 0.5 + profile["fill"])
+
+
+# --- Header Detection ---
+def _split_header(rows: List[List[Any]]) -> Tuple[Optional[List[Any]], List[List[Any]]]:
+    """Treats the first row as a header if it is text where the data below is numeric."""
+    first, body = rows[0], rows[1:]
+    first_kinds = [_parse_number(str(c).strip()) is not None for c in first if str(c).strip()]
+    if not first_kinds:
+        return None, body
+    if not any(first_kinds):
+        return first, body
+    # Mixed first row: header only if some column is text here but numeric below
+    for col, cell in enumerate(first):
+        if _parse_number(str(cell).strip()) is None and str(cell).strip():
+            below = [r[col] for r in body[:DETECTOR_SAMPLE_ROWS] if col < len(r)]
+            if below and _profile_column(below)["numeric"] > 0.8:
+                return first, body
+    return None, rows
+
+
+# --- Columnar Uploads ---
+class _RowSubset(Sequence):
+    """Selected rows of a ColumnarSheet, rendered only when accessed (the detector samples a few hundred)."""
+
+    def __init__(self, sheet: ColumnarSheet, indices: List[int]):
+        self.sheet = sheet
+        self.indices = indices
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return _RowSubset(self.sheet, self.indices[idx])
+        return self.sheet[self.indices[idx]]
+
+
+# --- Detector ---
+def detect_column_mapping(sheet_data: List[List[Any]]) -> Tuple[Dict[str, Optional[int]], float]:
+    """
+    Scores every column against each role using header synonyms, inferred dtype
+    and value distribution, then picks the best distinct assignment.
+    Returns (column_mapping, confidence in [0, 1]).
+    """
+    empty_mapping = {role: None for role in ROLES}
+    if isinstance(sheet_data, ColumnarSheet):
+        # Find non-empty rows from the column arrays; only the sampled rows are rendered
+        rows = _RowSubset(sheet_data, sheet_data.nonempty_rows().tolist())
+        n_cols = sheet_data.n_cols
+    else:
+        rows = [r for r in sheet_data if isinstance(r, list) and any(str(c if c is not None else "").strip() for c in r)]
+        n_cols = max((len(r) for r in rows), default=0)
+    if not rows:
+        return empty_mapping, 0.0
+
+    header, body = _split_header(rows)
+    if len(body) > DETECTOR_SAMPLE_ROWS:
+        step = len(body) / DETECTOR_SAMPLE_ROWS
+        body = [body[int(i * step)] for i in range(DETECTOR_SAMPLE_ROWS)]
+    else:
+        body = list(body)
+
+    scores: Dict[str, List[float]] = {role: [] for role in ROLES}
+    for col in range(n_cols):
+        profile = _profile_column([r[col] if col < len(r) else None for r in body])
+        header_text = _normalize_header(header[col]) if header is not None and col < len(header) else ""
+        for role in ROLES:
+            content = _content_score(profile, role)
+            if header is None:
+                score = NO_HEADER_CAP * content
+            else:
+                header_part = _header_score(header_text, role)
+                # A matching header still needs plausible data underneath it
+                score = HEADER_WEIGHT * header_part * (0.5 + 0.5 * content) + CONTENT_WEIGHT * content
+            scores[role].append(score)
+
+    # Best distinct assignment among the top candidates for each role
+    def top(role: str, k: int = 3) -> List[int]:
+        return sorted(range(n_cols), key=lambda c: scores[role][c], reverse=True)[:k]
+
+    best, best_total = None, -1.0
+    for name_col, shares_col, inv_col in product(top(ROLES[0]), top(ROLES[1]), top(ROLES[2]) + [None]):
+        if name_col == shares_col or inv_col in (name_col, shares_col):
+            continue
+        inv_score = scores[ROLES[2]][inv_col] if inv_col is not None else 0.0
+        if inv_col is not None and inv_score < INVESTMENT_MIN_SCORE:
+            continue
+        total = scores[ROLES[0]][name_col] + scores[ROLES[1]][shares_col] + inv_score
+        if total > best_total:
+            best, best_total = (name_col, shares_col, inv_col), total
+    if best is None:
+        return empty_mapping, 0.0
+
+    mapping = dict(zip(ROLES, best))
+
+    # Confidence is driven by the required roles, discounted when a runner-up is close
+    confidence = 1.0
+    for role in ROLES[:2]:
+        chosen = mapping[role]
+        role_conf = scores[role][chosen]
+        runner_up = max((s for c, s in enumerate(scores[role]) if c not in best), default=0.0)
+        if role_conf - runner_up < AMBIGUITY_MARGIN:
+            role_conf *= AMBIGUITY_PENALTY
+        confidence = min(confidence, role_conf)
+
+    logger.info(f"Heuristic column mapping {mapping} with confidence {confidence:.2f}")
+    return mapping, round(confidence, 4)
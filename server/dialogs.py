@@ -1,21 +1,38 @@
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional
+import logging
 import uuid
 from pydantic import BaseModel
 import json
-from model import get_llm
+from model import run_completion, constrained_kwargs
+from json_grammar import slot_grammar
+from metrics import SLOT_EXTRACTIONS
+from log_config import truncate_payload
+from slot_parser import parse_slot_message
+from session_store import create_session_store
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
 
 # --- Session Management ---
-sessions: Dict[str, 'Session'] = {}
+# The chat asks for these, in order, until the round can be planned
+REQUIRED_SLOTS = ("roundType", "amount", "preMoney", "poolPct")
+# Picked up when mentioned, never asked for: "pre"/"post"-money pool (default post)
+# and the SAFEs/notes converting in the round (financing events, see waterfall.py)
+OPTIONAL_SLOTS = ("poolTiming", "convertibles")
+LIST_SLOTS = ("convertibles",) # New values are appended, not replaced
 
 class Session(BaseModel):
     session_id: str
-    slots: Dict[str, Optional[str]] = {
+    slots: Dict[str, Optional[Any]] = { # Numeric slots are stored as numbers
         "roundType": None,
         "amount": None,
         "preMoney": None,
-        "poolPct": None
+        "poolPct": None,
+        "poolTiming": None,
+        "convertibles": None
     }
     history: List[Dict[str, str]] = []
+    omitted_messages: int = 0 # History entries dropped by compaction
     last_prompted_slot: Optional[str] = None
 
     def __init__(self, **data):
@@ -23,64 +40,89 @@ class Session(BaseModel):
             data['session_id'] = str(uuid.uuid4())
         super().__init__(**data)
 
+# Idle eviction, history compaction and SQLite persistence (see session_store.py)
+session_store = create_session_store(Session)
+
 def get_or_create_session(session_id: Optional[str] = None) -> Session:
-    if session_id and session_id in sessions:
-        return sessions[session_id]
+    if session_id:
+        session = session_store.get(session_id)
+        if session is not None:
+            return session
     
-    session = Session()
-    sessions[session.session_id] = session
-    return session
+    return session_store.add(Session())
 
 # --- Prompts ---
-SLOT_EXTRACTION_PROMPT = """
+# Static instructions first, per-turn context last, so the prefix's llama.cpp
+# state can be cached and only the variable tail is evaluated (see prefix_cache.py).
+SLOT_PROMPT_PREFIX = """
 [INST] You are a JSON generation machine.
 Your ONLY task is to extract slot values from the LATEST user message and return a valid JSON object.
 Do NOT include any explanations, greetings, or conversational text.
-Your response MUST start with {{ and end with }}.
-
-The slots to extract are: roundType, amount, preMoney, poolPct.
-
-Current Slots:
-{slots}
-
-Conversation History:
-{history}
+Your response MUST start with { and end with }.
 
-Assistant's Last Question asked for slot: '{last_prompted_slot}'
-
-LATEST User Message: "{latest_message}"
+The slots to extract are: roundType, amount, preMoney, poolPct, poolTiming.
 
 INSTRUCTIONS:
-1. Analyze ONLY the LATEST user message.
-2. If the user message seems to answer the Assistant's Last Question (for slot '{last_prompted_slot}'), prioritize extracting the value for that specific slot.
+1. Analyze ONLY the LATEST user message, given at the end together with the current slots and history.
+2. If the user message seems to answer the Assistant's Last Question, prioritize extracting the value for that specific slot.
 3. Otherwise, extract any other slot values EXPLICITLY mentioned.
 4. For 'amount' and 'preMoney', extract numeric value (e.g., 5000000).
 5. For 'poolPct', extract numeric value (e.g., 10).
-6. Return ONLY the JSON object.
-7. If no new information is found, return an empty JSON object: {{}}.
+6. For 'poolTiming', extract "pre" or "post" only if the user says the pool is pre-money or post-money.
+7. Return ONLY the JSON object.
+8. If no new information is found, return an empty JSON object: {}.
 
 Example 1 (Assistant asked for 'amount', User says "$5M"):
-{{\"amount\": 5000000}}
+{"amount": 5000000}
 
 Example 2 (Assistant asked for 'preMoney', User says "20 million"):
-{{\"preMoney\": 20000000}}
+{"preMoney": 20000000}
 
 Example 3 (User says "Series A"):
-{{\"roundType\": \"Series A\"}}
+{"roundType": "Series A"}
 
 Example 4 (Assistant asked for 'amount', User says "hello"):
-{{}}
+{}
+"""
+
+SLOT_EXTRACTION_PROMPT = SLOT_PROMPT_PREFIX.replace("{", "{{").replace("}", "}}") + """
+Current Slots:
+{slots}
+
+Conversation History:
+{history}
+
+Assistant's Last Question asked for slot: '{last_prompted_slot}'
+
+LATEST User Message: "{latest_message}"
 
 Generate the JSON output based ONLY on the LATEST User Message, prioritizing the '{last_prompted_slot}' slot if relevant. [/INST]
 """
 
+# Free-form settings; with grammar sampling the token budget comes from the slot grammar
+SLOT_COMPLETION_KWARGS = {
+    "max_tokens": 200,
+    "temperature": 0.1,
+    "stop": ["```", "[/INST]"],
+    "echo": False,
+}
+
 def extract_slots_from_message(message: str, session: Session) -> Dict[str, str]:
-    """Use LLM to extract slot values from the message."""
+    """Extract slot values from the message: deterministic parser first, LLM as fallback."""
+    # Fast path: typical answers ("$5M", "Series A", "10%") never need the model
+    parsed_slots = parse_slot_message(message, session.last_prompted_slot)
+    if parsed_slots:
+        logger.debug(f"Slot parser resolved message without LLM: {parsed_slots}")
+        SLOT_EXTRACTIONS.inc(source="parser")
+        return parsed_slots
+    SLOT_EXTRACTIONS.inc(source="llm")
+
+    llm_error: Optional[Exception] = None # Set when the LLM call fails; re-raised below, not masked as {}
     try: # Outer try for the whole function
-        llm = get_llm()
-        
         # Format the prompt with current context
         history_str = "\n".join([f"{msg['role']}: {msg['message']}" for msg in session.history])
+        if session.omitted_messages:
+            history_str = f"({session.omitted_messages} earlier messages omitted)\n" + history_str
         slots_str = json.dumps(session.slots, indent=2)
         latest_message = session.history[-1]['message'] if session.history and session.history[-1]['role'] == 'user' else message
         
@@ -93,41 +135,39 @@ def extract_slots_from_message(message: str, session: Session) -> Dict[str, str]
                 latest_message=latest_message
             )
         except KeyError as fmt_ke:
-            print(f"ERROR during prompt formatting: {fmt_ke}")
-            print(f"History string: {history_str}")
-            print(f"Slots string: {slots_str}")
+            logger.error(f"Error during prompt formatting: {fmt_ke}; history: {truncate_payload(history_str)}, "
+                         f"slots: {slots_str}")
             raise # Re-raise
         except Exception as fmt_e:
-            print(f"ERROR during prompt formatting (other): {fmt_e}")
+            logger.error(f"Error during prompt formatting (other): {fmt_e}")
             raise # Re-raise
         
-        print(">>> Calling LLM for slot extraction...") # Debug print
+        logger.debug("Calling LLM for slot extraction")
         # Specific try for LLM call
         try:
-            response = llm.create_completion(
+            response = run_completion(
                 prompt=prompt,
-                max_tokens=200,
-                temperature=0.1,
-                stop=["```", "[/INST]"],
-                echo=False
+                prefix_key="slots",
+                prefix=SLOT_PROMPT_PREFIX,
+                kind="slots",
+                **constrained_kwargs(SLOT_COMPLETION_KWARGS, slot_grammar())
             )
-            print(f"<<< LLM call successful. Raw response text: {response['choices'][0]['text']}") # Debug print
+            logger.debug(f"Slot extraction LLM response: {truncate_payload(response['choices'][0]['text'])}")
         except Exception as llm_e:
-            print(f"ERROR during LLM call in extract_slots_from_message: {llm_e}")
+            logger.error(f"Error during LLM call in extract_slots_from_message: {llm_e}")
+            llm_error = llm_e
             raise # Re-raise the exception to be caught by the endpoint
 
         # Specific try for response processing and JSON parsing
         try:
-            print(">>> Processing LLM response for slots...") # Debug print
             raw_llm_text = response["choices"][0]["text"].strip()
             json_str = raw_llm_text
 
             # Attempt 1: Direct parsing (assuming LLM behaves)
             try:
                 extracted_slots_raw = json.loads(json_str)
-                print("Direct JSON parse successful.")
             except json.JSONDecodeError as e:
-                print(f"Direct JSON parse failed: {e}. Trying fallback extraction...")
+                logger.debug(f"Direct JSON parse failed: {e}. Trying fallback extraction...")
                 # Attempt 2: Fallback - Find first { and last }
                 start_brace = raw_llm_text.find('{')
                 end_brace = raw_llm_text.rfind('}')
@@ -135,26 +175,23 @@ def extract_slots_from_message(message: str, session: Session) -> Dict[str, str]
                     json_str_fallback = raw_llm_text[start_brace : end_brace + 1]
                     try:
                         extracted_slots_raw = json.loads(json_str_fallback)
-                        print("Fallback JSON extraction successful.")
                     except json.JSONDecodeError as e2:
-                        print(f"Fallback JSON parse also failed: {e2}")
-                        print(f"Original LLM Text: {raw_llm_text}")
-                        print(f"Extracted Substring: {json_str_fallback}")
+                        logger.warning(f"Fallback JSON parse also failed: {e2}; "
+                                       f"LLM text: {truncate_payload(raw_llm_text)}")
                         return {} # Return empty dict if fallback fails
                 else: # This block corresponds to the outer if
-                    print("Could not find JSON object braces in LLM response.")
-                    print(f"Original LLM Text: {raw_llm_text}")
+                    logger.warning(f"Could not find JSON object braces in LLM response: {truncate_payload(raw_llm_text)}")
                     return {} # Return empty dict if braces not found
             # End of try-except for direct parsing / fallback
             
             # Check if extracted_slots_raw was successfully assigned
             if 'extracted_slots_raw' not in locals():
-                print("Error: extracted_slots_raw not assigned after parsing attempts.")
+                logger.error("extracted_slots_raw not assigned after parsing attempts.")
                 return {}
             
             # --- Post-Parsing Logic --- 
             if not isinstance(extracted_slots_raw, dict):
-                print(f"Warning: LLM returned non-dict JSON: {json_str}") # Use original json_str for logging if needed
+                logger.warning(f"LLM returned non-dict JSON: {truncate_payload(json_str)}")
                 return {}
 
             # Clean keys (remove surrounding quotes if any)
@@ -167,24 +204,31 @@ def extract_slots_from_message(message: str, session: Session) -> Dict[str, str]
                          cleaned_key = cleaned_key[1:-1]
                 extracted_slots[cleaned_key] = v
 
-            print(f"Extracted slots after cleaning: {extracted_slots}") # Debug print
+            logger.debug(f"Extracted slots after cleaning: {extracted_slots}")
             return extracted_slots
             
         except Exception as proc_e:
-            print(f"Warning: Unexpected error processing LLM response in extract_slots: {str(proc_e)}")
+            logger.warning(f"Unexpected error processing LLM response in extract_slots: {proc_e}")
             return {}
             
     except Exception as outer_e:
-        print(f"ERROR in extract_slots_from_message function: {outer_e}")
+        logger.error(f"Error in extract_slots_from_message function: {outer_e}")
         # Ensure we don't mask the original error if it came from the LLM call
-        if 'llm_e' in locals() and outer_e is llm_e:
+        if outer_e is llm_error:
             raise
         else:
              # If it's a different error, wrap it or just return empty
-             print(f"Returning empty dict due to error: {outer_e}")
+             logger.warning(f"Returning empty dict due to error: {outer_e}")
              return {}
 
 def process_message(session: Session, message: str) -> Dict:
+    # Serialize turns per session, then compact and persist the updated session
+    with session_store.turn_lock(session.session_id):
+        response = _process_turn(session, message)
+        session_store.save(session)
+    return response
+
+def _process_turn(session: Session, message: str) -> Dict:
     # Add user message to history
     session.history.append({"role": "user", "message": message})
     
@@ -193,12 +237,17 @@ def process_message(session: Session, message: str) -> Dict:
     
     # Update session slots with any new values
     for key, value in extracted_slots.items():
-        # Ensure the key exists in the session slots before updating
-        if key in session.slots and value is not None:
+        # Only known slots (sessions saved before optional slots existed lack their keys)
+        if key not in REQUIRED_SLOTS and key not in OPTIONAL_SLOTS or value is None:
+            continue
+        if key in LIST_SLOTS:
+            if isinstance(value, list):
+                session.slots[key] = (session.slots.get(key) or []) + value
+        else:
             session.slots[key] = value
     
     # --- Determine next state --- 
-    all_slots_filled = all(session.slots.get(key) is not None for key in session.slots)
+    all_slots_filled = all(session.slots.get(key) is not None for key in REQUIRED_SLOTS)
 
     response_message = ""
     next_prompted_slot = None # Track what the next question is about
@@ -208,8 +257,7 @@ def process_message(session: Session, message: str) -> Dict:
         session.last_prompted_slot = None # Clear prompted slot when ready
     else:
         # --- Deterministic Question Logic --- 
-        slot_order = ["roundType", "amount", "preMoney", "poolPct"]
-        for slot_key in slot_order:
+        for slot_key in REQUIRED_SLOTS:
             if session.slots.get(slot_key) is None:
                 next_prompted_slot = slot_key
                 # Generate question based on the missing slot
@@ -220,17 +268,17 @@ def process_message(session: Session, message: str) -> Dict:
                 elif slot_key == "preMoney":
                     response_message = "What is the pre-money valuation? (e.g., $20M)"
                 elif slot_key == "poolPct":
-                    response_message = "What is the option pool percentage? (e.g., 10%)"
+                    response_message = "What is the option pool percentage? (e.g., 10%, or 10% pre-money pool)"
                 else:
                     # Fallback shouldn't be reached with current slots
                     response_message = "Sorry, I need more information."
-                    print(f"Warning: Fell through deterministic question logic for key: {slot_key}")
+                    logger.warning(f"Fell through deterministic question logic for key: {slot_key}")
                 break # Found the first missing slot, stop looking
         
         if not next_prompted_slot:
             # This case should ideally not happen if all_slots_filled is false,
             # but handle it defensively.
-            print("Warning: No missing slot found despite all_slots_filled being false.")
+            logger.warning("No missing slot found despite all_slots_filled being false.")
             response_message = "Something seems off. Could you please clarify your request?"
             session.last_prompted_slot = None
         else:
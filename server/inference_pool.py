@@ -0,0 +1,147 @@
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional
+import logging
+import math
+import queue
+import threading
+import time
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
+
+# Weight of the newest job when updating the average job duration
+_EWMA_ALPHA = 0.2
+
+
+class InferencePoolBusy(Exception):
+    """Raised when the request queue is full. Carries a retry hint in seconds."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Inference queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class InferencePool:
+    """
+    Fixed set of worker threads, each holding its own model instance, fed from a
+    bounded queue. llama.cpp releases the GIL while evaluating, so workers run
+    in parallel. Jobs are callables invoked as fn(llm, *args, **kwargs).
+    """
+
+    def __init__(self, llm_factory: Callable[[], Any], n_workers: int = 1, max_queue: int = 8):
+        self.llm_factory = llm_factory
+        self.n_workers = max(1, n_workers)
+        self.max_queue = max(1, max_queue)
+        self._queue: "queue.Queue" = queue.Queue(maxsize=self.max_queue)
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._busy_workers = 0
+        self._avg_job_seconds = 5.0  # Initial guess until real jobs complete
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.total_queue_wait = 0.0
+
+    # --- Lifecycle ---
+    def start(self, preload: bool = True) -> None:
+        with self._lock:
+            if self._threads:
+                return
+            for idx in range(self.n_workers):
+                thread = threading.Thread(
+                    target=self._worker_loop, args=(idx, preload), name=f"llm-worker-{idx}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+        logger.info(f"Inference pool started with {self.n_workers} worker(s), queue size {self.max_queue}.")
+
+    def shutdown(self) -> None:
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)  # Blocking put: let workers drain queued jobs first
+        for thread in threads:
+            thread.join(timeout=5)
+
+    # --- Submission ---
+    def submit(self, fn: Callable[..., Any], *args, **kwargs) -> Future:
+        """Queues a job without blocking. Raises InferencePoolBusy when the queue is full."""
+        if not self._threads:
+            self.start(preload=False)
+        future: Future = Future()
+        try:
+            self._queue.put_nowait((future, time.perf_counter(), fn, args, kwargs))
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            raise InferencePoolBusy(self.retry_after())
+        return future
+
+    def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Submits a job and blocks the calling (non event loop) thread until it finishes."""
+        return self.submit(fn, *args, **kwargs).result()
+
+    def is_saturated(self) -> bool:
+        return self._queue.full()
+
+    def retry_after(self) -> int:
+        """Estimated seconds until a queue slot frees up."""
+        backlog = self._queue.qsize() + self._busy_workers
+        return max(1, math.ceil(self._avg_job_seconds * backlog / self.n_workers))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            finished = self.completed + self.failed
+            return {
+                "workers": self.n_workers,
+                "busy_workers": self._busy_workers,
+                "queued": self._queue.qsize(),
+                "max_queue": self.max_queue,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "avg_job_seconds": round(self._avg_job_seconds, 4),
+                "avg_queue_wait_seconds": round(self.total_queue_wait / finished, 4) if finished else 0.0,
+            }
+
+    # --- Worker ---
+    def _load(self, idx: int) -> Optional[Any]:
+        try:
+            llm = self.llm_factory()
+            logger.info(f"Inference worker {idx}: model loaded.")
+            return llm
+        except Exception as e:
+            logger.error(f"Inference worker {idx}: could not load model - {e}")
+            return None
+
+    def _worker_loop(self, idx: int, preload: bool) -> None:
+        llm = self._load(idx) if preload else None
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            future, submitted_at, fn, args, kwargs = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            started = time.perf_counter()
+            with self._lock:
+                self._busy_workers += 1
+                self.total_queue_wait += started - submitted_at
+            try:
+                if llm is None:
+                    llm = self.llm_factory()  # Raise load errors to the caller
+                result = fn(llm, *args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+                ok = False
+            else:
+                future.set_result(result)
+                ok = True
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._busy_workers -= 1
+                if ok:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+                self._avg_job_seconds += _EWMA_ALPHA * (elapsed - self._avg_job_seconds)
@@ -0,0 +1,111 @@
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Tuple
+import json
+import logging
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+MAX_ENUMERATED_COLUMNS = 256  # Wider selections use a bounded digit rule instead of listing every index
+MAX_STRING_CHARS = 32  # roundType
+MAX_INT_DIGITS = 15  # Up to ~$1e15 for amount/preMoney
+MAX_FRACTION_DIGITS = 4
+
+PLAN_MAPPING_KEYS = ("shareholder_name_col_idx", "pre_round_shares_col_idx", "pre_round_investment_col_idx")
+SLOT_KEYS = ("roundType", "amount", "preMoney", "poolPct", "poolTiming")
+NUMERIC_SLOT_KEYS = ("amount", "preMoney", "poolPct")
+ENUM_SLOT_VALUES = {"poolTiming": ("pre", "post")}
+
+
+@dataclass(frozen=True)
+class JsonGrammar:
+    """A GBNF grammar plus the longest output it accepts, in characters."""
+    gbnf: str
+    max_chars: int
+
+    @property
+    def max_tokens(self) -> int:
+        # Every generated token adds at least one character, so this can never cut
+        # off a valid object; +1 leaves room for the end-of-sequence token
+        return self.max_chars + 1
+
+
+def _literal(text: str) -> str:
+    """GBNF string literal for `text`."""
+    return json.dumps(text)
+
+
+def _bounded(element: str, max_count: int, min_count: int = 1) -> str:
+    """
+    `element` repeated min_count..max_count times, nested right to left
+    (e (e (e)?)?)? so the grammar stays unambiguous while sampling.
+    """
+    optional = ""
+    for _ in range(max_count - min_count):
+        optional = f"({element} {optional})?" if optional else f"({element})?"
+    return " ".join([element] * min_count + ([optional] if optional else []))
+
+
+# --- Column Mapping ---
+@lru_cache(maxsize=64)
+def column_mapping_grammar(n_cols: int) -> JsonGrammar:
+    """
+    {"column_mapping": {...}} with exactly the three index keys, each a valid
+    0-based column index of the selection or null, in compact form.
+    """
+    n_cols = max(n_cols, 1)
+    if n_cols <= MAX_ENUMERATED_COLUMNS:
+        idx_rule = " | ".join(_literal(str(i)) for i in range(n_cols))
+    else:
+        idx_rule = _bounded("[0-9]", len(str(n_cols - 1)))
+    idx_chars = max(len(str(n_cols - 1)), len("null"))
+
+    members = ' ", " '.join(f'{_literal(json.dumps(key) + ": ")} idx' for key in PLAN_MAPPING_KEYS)
+    gbnf = "\n".join([
+        f'root ::= {_literal("{" + json.dumps("column_mapping") + ": {")} {members} {_literal("}}")}',
+        f'idx ::= {idx_rule} | "null"',
+    ])
+    max_chars = len(json.dumps({"column_mapping": {key: "x" * (idx_chars - 2) for key in PLAN_MAPPING_KEYS}}))
+    return JsonGrammar(gbnf, max_chars)
+
+
+# --- Chat Slots ---
+@lru_cache(maxsize=1)
+def slot_grammar() -> JsonGrammar:
+    """
+    A JSON object with any subset of the slots, in SLOT_KEYS order, each at most
+    once: roundType a short string, poolTiming "pre" or "post", the others numbers
+    (or null). {} is allowed.
+    """
+    rules: List[Tuple[str, str]] = []
+    # Chain from the last slot back: mK ::= member ("," rest)? | rest
+    rest = None
+    for idx in range(len(SLOT_KEYS) - 1, -1, -1):
+        key = SLOT_KEYS[idx]
+        if key in ENUM_SLOT_VALUES:
+            value = " | ".join(_literal(json.dumps(option)) for option in ENUM_SLOT_VALUES[key])
+        else:
+            value = "number" if key in NUMERIC_SLOT_KEYS else "string"
+        member = f'{_literal(json.dumps(key) + ": ")} ({value} | "null")'
+        name = f"m{idx}"
+        body = f'{member} (", " {rest})? | {rest}' if rest else member
+        rules.append((name, body))
+        rest = name
+    rules.reverse()
+
+    gbnf = "\n".join(
+        [f'root ::= "{{" ({rest})? "}}"']
+        + [f"{name} ::= {body}" for name, body in rules]
+        + [
+            f'string ::= "\\"" {_bounded("char", MAX_STRING_CHARS)} "\\""',
+            'char ::= [ !#-[\\]-~]',  # Printable ASCII except '"' and backslash: one token per char at most
+            f'number ::= {_bounded("[0-9]", MAX_INT_DIGITS)} ("." {_bounded("[0-9]", MAX_FRACTION_DIGITS)})?',
+        ]
+    )
+    longest = {key: (1.0 if key in NUMERIC_SLOT_KEYS else max(ENUM_SLOT_VALUES.get(key, ["x" * MAX_STRING_CHARS]), key=len))
+               for key in SLOT_KEYS}
+    number_chars = MAX_INT_DIGITS + 1 + MAX_FRACTION_DIGITS
+    max_chars = len(json.dumps(longest)) + len(NUMERIC_SLOT_KEYS) * (number_chars - len("1.0"))
+    return JsonGrammar(gbnf, max_chars)
@@ -0,0 +1,207 @@
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, List, Optional
+import copy
+import logging
+import os
+import queue
+import random
+import threading
+import time
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# Per-module verbosity, e.g. "model=WARNING,dialogs=DEBUG,uvicorn.access=WARNING" (main logs to "uvicorn")
+LOG_LEVELS = os.environ.get("LOG_LEVELS", "")
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))  # Records beyond this are dropped, never waited on
+# Payloads (sheet data, LLM text) are only logged at DEBUG, for a sample of calls, truncated
+LOG_PAYLOAD_SAMPLE_RATE = float(os.environ.get("LOG_PAYLOAD_SAMPLE_RATE", "0.01"))
+LOG_PAYLOAD_MAX_CHARS = int(os.environ.get("LOG_PAYLOAD_MAX_CHARS", "2000"))
+LOG_PAYLOAD_MAX_ITEMS = 5  # Leading list items (e.g. sheet rows) rendered before truncating
+# Repeats of a warning from the same call site within this window are counted instead of logged
+LOG_REPEAT_WINDOW_SECONDS = float(os.environ.get("LOG_REPEAT_WINDOW_SECONDS", "10"))
+
+# Loggers whose handlers are moved behind the queue (uvicorn's don't propagate to the root)
+QUEUED_LOGGERS = ("", "uvicorn", "uvicorn.access")
+
+
+def parse_module_levels(spec: str) -> Dict[str, str]:
+    """Parses "name=LEVEL,name=LEVEL" into a dict, skipping malformed entries."""
+    levels = {}
+    for entry in spec.split(","):
+        name, _, level = entry.partition("=")
+        name, level = name.strip(), level.strip().upper()
+        if not name or level not in logging._nameToLevel:
+            if entry.strip():
+                logger.warning(f"Ignoring LOG_LEVELS entry '{entry.strip()}'")
+            continue
+        levels[name] = level
+    return levels
+
+
+# --- Non-blocking Queue Handler ---
+class DroppingQueueHandler(QueueHandler):
+    """
+    Hands records to the listener thread without blocking the caller. When the
+    queue is full the record is dropped and counted rather than waited on.
+    """
+
+    def __init__(self, log_queue: "queue.Queue"):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Same process: pass the record through unformatted so the target
+        # handlers' own formatters (uvicorn's read record.args) still work
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class RepeatedWarningFilter(logging.Filter):
+    """
+    Lets the first WARNING record from a call site through per window and counts
+    the rest; the next record that passes reports how many were suppressed.
+    ERROR and above always pass, so every failure keeps its message and traceback.
+    """
+
+    def __init__(self, window_seconds: float = LOG_REPEAT_WINDOW_SECONDS):
+        super().__init__()
+        self.window_seconds = window_seconds
+        self._sites: Dict[tuple, List[float]] = {}  # (logger, file, line) -> [window start, suppressed]
+        self._lock = threading.Lock()
+        self.suppressed_total = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno != logging.WARNING or self.window_seconds <= 0:
+            return True
+        key = (record.name, record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            site = self._sites.get(key)
+            if site is not None and now - site[0] < self.window_seconds:
+                site[1] += 1
+                self.suppressed_total += 1
+                return False
+            suppressed = int(site[1]) if site is not None else 0
+            self._sites[key] = [now, 0]
+        if suppressed:
+            record.msg = f"{record.getMessage()} ({suppressed} similar message(s) suppressed)"
+            record.args = None
+        return True
+
+
+# --- Setup ---
+_listener: Optional[QueueListener] = None
+_queue_handler: Optional[DroppingQueueHandler] = None
+repeated_warning_filter = RepeatedWarningFilter()
+
+
+def configure_logging() -> None:
+    """
+    Applies LOG_LEVEL/LOG_LEVELS and moves the handlers of the root and uvicorn
+    loggers onto one background listener thread, so request threads only
+    enqueue records. Call after uvicorn has set up its loggers (app startup).
+    """
+    global _listener, _queue_handler
+    if _listener is not None:
+        return
+
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    if not root.handlers:
+        # Module loggers (model, cap_table, ...) propagate here
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        root.addHandler(handler)
+    for name, level in parse_module_levels(LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level)
+
+    _queue_handler = DroppingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    _queue_handler.addFilter(repeated_warning_filter)
+    targets = []
+    for name in QUEUED_LOGGERS:
+        target_logger = logging.getLogger(name)
+        handlers = [h for h in target_logger.handlers if not isinstance(h, QueueHandler)]
+        for handler in handlers:
+            target_logger.removeHandler(handler)
+        if handlers:
+            # Each logger keeps its own handlers (and formatters) behind the shared queue
+            targets.append(_LoggerHandlers(handlers))
+            target_logger.addHandler(_QueueTag(_queue_handler, targets[-1]))
+
+    _listener = QueueListener(_queue_handler.queue, *targets, respect_handler_level=False)
+    _listener.start()
+
+
+def stop_logging() -> None:
+    """Flushes queued records and stops the listener thread (app shutdown)."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def logging_stats() -> Dict[str, Any]:
+    return {
+        "queued": _queue_handler.queue.qsize() if _queue_handler else 0,
+        "dropped": _queue_handler.dropped if _queue_handler else 0,
+        "suppressed_repeats": repeated_warning_filter.suppressed_total,
+    }
+
+
+class _LoggerHandlers(logging.Handler):
+    """Listener-side fan-out to one logger's original handlers, for records tagged with it."""
+
+    def __init__(self, handlers: List[logging.Handler]):
+        super().__init__()
+        self.handlers = handlers
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "_log_target", None) is not self:
+            return False
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+        return True
+
+
+class _QueueTag(logging.Handler):
+    """Caller-side handler: tags the record with its target handlers and enqueues it."""
+
+    def __init__(self, queue_handler: DroppingQueueHandler, target: _LoggerHandlers):
+        super().__init__()
+        self.queue_handler = queue_handler
+        self.target = target
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        record = copy.copy(record)  # A record can propagate through more than one queued logger
+        record._log_target = self.target
+        return self.queue_handler.handle(record)
+
+
+# --- Payload Logging ---
+def truncate_payload(payload: Any, max_chars: int = LOG_PAYLOAD_MAX_CHARS) -> str:
+    """Bounded text for a payload: leading list items only, then cut at max_chars."""
+    if isinstance(payload, (list, tuple)) and len(payload) > LOG_PAYLOAD_MAX_ITEMS:
+        text = f"{list(payload[:LOG_PAYLOAD_MAX_ITEMS])} ... ({len(payload)} items)"
+    else:
+        text = str(payload)
+    if len(text) > max_chars:
+        text = f"{text[:max_chars]}... ({len(text)} chars)"
+    return text
+
+
+def log_payload(log: logging.Logger, label: str, payload: Any, level: int = logging.DEBUG,
+                sample_rate: float = LOG_PAYLOAD_SAMPLE_RATE) -> None:
+    """Logs a truncated payload for a random sample of calls; does no formatting when skipped."""
+    if not log.isEnabledFor(level) or random.random() >= sample_rate:
+        return
+    log.log(level, f"{label}: {truncate_payload(payload)}")
@@ -1,35 +1,89 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, ValidationError
-from typing import List, Any, Optional, Dict
-from pathlib import Path
+from typing import List, Any, Optional, Dict, Iterator, AsyncIterator, Literal
+import asyncio
 import logging
-import json
+import time
 import uuid
-from fastapi.responses import JSONResponse
-import re
+import itertools
+from fastapi.responses import JSONResponse, StreamingResponse, Response, PlainTextResponse
+from starlette.concurrency import run_in_threadpool
 
 # Import LLM functions
-from model import generate_plan_raw_text, get_llm, parse_column_mapping
-from dialogs import get_or_create_session, process_message
+from model import generate_plan_raw_text, stream_plan_raw_text, finalize_plan_output, parse_column_mapping, inference_pool, prefix_state_cache
+from model import slot_inference_pool, active_profiles, run_self_benchmarks, self_benchmark_results, SELF_BENCHMARK_ENABLED
+from inference_pool import InferencePoolBusy
+from dialogs import get_or_create_session, process_message, session_store
+from cap_table import extract_investor_columns, log_column_summary, update_investor_rows
+from plan_ops import perform_cap_table_calculations, compute_plan, iter_structured_ops, build_structured_ops
+from plan_ops import PLAN_OUTPUT_MODE, PLAN_OUTPUT_MODES
+from mapping_cache import column_mapping_cache, sheet_fingerprint
+from column_detector import detect_column_mapping, HEURISTIC_CONFIDENCE_THRESHOLD
+from result_store import create_result_store
+from op_codec import dumps, loads, validate_ops
+from replan import PlanState, PlanStateStore, diff_ops
+from scenarios import build_scenario_arrays, summarize_scenarios, sensitivity_table_op
+from metrics import PLAN_TASKS, StatsGauges, TaskTimings, registry as metrics_registry
+from log_config import configure_logging, stop_logging, logging_stats, log_payload
+from plan_dedup import PLAN_DEDUP_ENABLED, PlanDeduplicator, plan_request_key
+from batch_planner import BATCH_MAX_JOBS, BatchPlanner
+from sheet_columns import ColumnarSheet
+from sheet_upload import UnsupportedUpload, decode_json_body, decode_sheet_upload, is_columnar_upload
 
 app = FastAPI()
 
 logger = logging.getLogger("uvicorn")
 
-# --- Simple In-Memory Storage for Task Results (Replace with DB/Redis for production) ---
-task_results: Dict[str, Dict] = {}
+# --- Task Result Storage (bounded in-memory by default, RESULT_STORE=sqlite to persist) ---
+task_results = create_result_store()
+
+# --- Incremental Re-plan State (mapping, sheet and last ops of finished plans, by task_id) ---
+plan_states = PlanStateStore()
+
+# --- Identical /plan Requests (single-flight in-flight tasks + recent completed results) ---
+plan_dedup = PlanDeduplicator(task_results)
+
+# --- Batch Planning (deterministic stages on a process pool, started on first batch) ---
+batch_planner = BatchPlanner()
+
+# --- Prometheus Gauges (read from the existing stats() at scrape time) ---
+for _prefix, _help, _stats_fn, _keys in (
+    ("inference_pool", "Inference worker pool", inference_pool.stats,
+     ("workers", "busy_workers", "queued", "max_queue", "completed", "failed", "rejected")),
+    ("column_mapping_cache", "Column mapping cache", column_mapping_cache.stats, ("size", "hits", "misses", "evictions")),
+    ("prefix_cache", "LLM prompt prefix cache", prefix_state_cache.stats,
+     ("requests", "hits", "misses", "restores", "prompt_tokens", "prompt_tokens_saved")),
+    ("task_results", "Task result store", task_results.stats, ("size", "evictions")),
+    ("sessions", "Chat session store", session_store.stats, ("in_memory", "persisted", "evictions")),
+    ("plan_states", "Re-plan state store", plan_states.stats, ("size", "evictions")),
+    ("plan_dedup", "Plan request deduplication", plan_dedup.stats,
+     ("inflight", "cached_results", "inflight_hits", "cache_hits", "misses", "evictions")),
+    ("plan_batch", "Batch plan process pool", batch_planner.stats,
+     ("workers", "batches", "jobs", "failed_jobs", "pool_restarts")),
+    ("logging", "Async log queue", logging_stats, ("queued", "dropped", "suppressed_repeats")),
+):
+    metrics_registry.register(StatsGauges(_prefix, _help, _stats_fn, _keys))
 
 # --- Load LLM on startup (optional, but recommended) ---
 @app.on_event("startup")
 async def startup_event():
+    configure_logging() # After uvicorn's own logging setup, so its handlers move behind the queue too
     try:
-        get_llm() # Initialize and load the LLM
-    except FileNotFoundError as e:
-        print(f"STARTUP ERROR: {e}")
-        # You might want to prevent server startup or handle this differently
+        # Each worker thread loads its own model instance
+        inference_pool.start(preload=True)
+        slot_inference_pool.start(preload=True) # Same pool unless slots use their own profile
+        if SELF_BENCHMARK_ENABLED:
+            await run_in_threadpool(run_self_benchmarks)
     except Exception as e:
-        print(f"STARTUP ERROR: Could not load LLM - {e}")
+        logger.error(f"STARTUP ERROR: Could not start inference pool - {e}")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    inference_pool.shutdown()
+    slot_inference_pool.shutdown()
+    batch_planner.shutdown()
+    stop_logging()
 
 # --- CORS Middleware (Allow all for MVP) ---
 app.add_middleware(
@@ -46,11 +100,67 @@ app.add_middleware(
 async def root():
     return {"status": "ok", "message": "Server is running"}
 
+# Column mapping cache statistics
+@app.get("/cache/column-mapping")
+async def column_mapping_cache_stats():
+    return column_mapping_cache.stats()
+
+# Chat session store statistics
+@app.get("/sessions/stats")
+async def session_store_stats():
+    return await run_in_threadpool(session_store.stats) # Counts persisted rows in SQLite
+
+# Task result store statistics
+@app.get("/tasks/stats")
+async def task_store_stats():
+    return task_results.stats()
+
+# Plan request deduplication statistics
+@app.get("/plan/dedup/stats")
+async def plan_dedup_stats():
+    return plan_dedup.stats()
+
+# Batch planner process pool statistics
+@app.get("/plan/batch/stats")
+async def plan_batch_stats():
+    return batch_planner.stats()
+
+# Inference worker pool statistics
+@app.get("/inference/stats")
+async def inference_pool_stats():
+    return inference_pool.stats()
+
+# Model runtime profiles in use, slot pool stats and the startup self-benchmark (LLM_SELF_BENCHMARK=1)
+@app.get("/inference/profiles")
+async def inference_profiles():
+    return {
+        "profiles": active_profiles(),
+        "slot_pool": slot_inference_pool.stats() if slot_inference_pool is not inference_pool else None,
+        "self_benchmark": self_benchmark_results,
+    }
+
+@app.get("/inference/prefix-cache")
+async def prefix_cache_stats():
+    return prefix_state_cache.stats()
+
+# Prometheus scrape endpoint: plan stage and LLM timing histograms plus the stats above as gauges
+@app.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
 # Add specific OPTIONS handler for /plan endpoint
 @app.options("/plan")
 async def plan_options():
     return {"status": "ok"}
 
+@app.options("/plan/stream")
+async def plan_stream_options():
+    return {"status": "ok"}
+
+@app.options("/plan/batch")
+async def plan_batch_options():
+    return {"status": "ok"}
+
 # --- Request/Response Models ---
 class ChatRequest(BaseModel):
     sessionId: Optional[str] = None
@@ -68,8 +178,27 @@ class PlanRequest(BaseModel):
     slots: Dict[str, Any] # Expect the collected slots
     sheetData: List[List[str]] # Expect the sheet data from selected range
     selectedRangeAddress: str # Expect the address of the input range
-
-class ActionOp(BaseModel):
+    outputMode: Literal["values", "formulas"] = PLAN_OUTPUT_MODE # Computed numbers or a live formula model
+
+class BatchPlanRequest(BaseModel):
+    jobs: List[Any] # PlanRequest bodies, each with an optional "id"; validated per job so one bad job can't fail the batch
+
+class ReplanRequest(BaseModel):
+    task_id: str # A completed /plan or /plan/stream task
+    slots: Dict[str, Any] = {} # Changed slot values only
+    rows: Dict[int, List[str]] = {} # Edited rows: sheetData row index -> new cells
+
+class ScenarioRequest(BaseModel):
+    slots: Dict[str, Any] = {} # Base slots; scenarios override amount / preMoney / poolPct
+    sheetData: List[List[str]]
+    selectedRangeAddress: str
+    scenarios: List[Dict[str, Any]] = [] # Explicit slot combinations
+    grid: Dict[str, List[Any]] = {} # Cartesian product, e.g. {"preMoney": [...], "amount": [...]}
+    include_holder_ownership: bool = True # Scenario x holder ownership matrix
+    sensitivity_metric: Optional[str] = None # e.g. "price_per_share": add a table op over the two swept grid slots
+    sensitivity_target_cell: Optional[str] = None # Top-left cell of that table; default is right of the plan output
+
+class ActionOp(BaseModel): # op_codec.validate_ops applies the same schema in bulk
     id: str
     range: str
     type: str # "write" | "formula"
@@ -93,403 +222,262 @@ async def chat(request: ChatRequest):
     Handles the chat interaction and slot filling process.
     """
     try:
-        print(f"\n=== Chat Endpoint ===")
-        print(f"Request sessionId: {request.sessionId}")
-        print(f"Request message: {request.message}")
-        
-        # Get or create session
-        session = get_or_create_session(request.sessionId)
-        print(f"Using session: {session.session_id}")
-        print(f"Current slots: {session.slots}")
+        # Get or create session (may read it back from the SQLite store)
+        session = await run_in_threadpool(get_or_create_session, request.sessionId)
+        logger.debug(f"Chat turn for session {session.session_id}, current slots: {session.slots}")
+        log_payload(logger, "Chat message", request.message)
         
-        # Process the message and get response
-        response = process_message(session, request.message)
+        # Process the message off the event loop (may wait on an inference worker)
+        response = await run_in_threadpool(process_message, session, request.message)
         
-        print(f"Response sessionId: {response['sessionId']}")
-        print(f"Response slots: {response['slotsFilled']}")
-        print("=== End Chat Endpoint ===\n")
+        logger.debug(f"Chat session {response['sessionId']} slots: {response['slotsFilled']}")
         
         return response
+    except InferencePoolBusy as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
-        print(f"ERROR in chat endpoint: {e}")
+        logger.error(f"ERROR in chat endpoint: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# --- Column Mapping Resolution (cache -> heuristic; None means the LLM is needed) ---
+def lookup_column_mapping(task_id: str, sheetData: List[List[str]]):
+    """Returns (column_mapping or None, mapping_source, fingerprint) without calling the LLM."""
+    # --- Phase 3.5: Reuse a cached mapping for a known sheet layout ---
+    fingerprint = sheet_fingerprint(sheetData)
+    column_mapping = column_mapping_cache.get(fingerprint)
+    if column_mapping is not None:
+        logger.info(f"Task {task_id}: Column mapping cache hit ({fingerprint}): {column_mapping}")
+        return column_mapping, "cache", fingerprint
+
+    # --- Phase 3.75: Deterministic header/dtype detector before the LLM ---
+    column_mapping, confidence = detect_column_mapping(sheetData)
+    if confidence >= HEURISTIC_CONFIDENCE_THRESHOLD:
+        logger.info(f"Task {task_id}: Heuristic column mapping (confidence {confidence}): {column_mapping}")
+        return column_mapping, "heuristic", fingerprint
+
+    logger.info(f"Task {task_id}: Heuristic confidence {confidence} below threshold, falling back to LLM.")
+    return None, "llm", fingerprint
+
+def timed_mapping_lookup(task_id: str, sheetData: List[List[str]]):
+    """lookup_column_mapping under a fresh TaskTimings, so endpoints can resolve the mapping before queueing."""
+    timings = TaskTimings()
+    with timings.stage("mapping_lookup"):
+        mapping_lookup = lookup_column_mapping(task_id, sheetData)
+    return timings, mapping_lookup
+
+def needs_busy_response(mapping_lookup: tuple) -> bool:
+    """Backpressure only applies to plans that will queue an LLM job (no cached or heuristic mapping)."""
+    return mapping_lookup[0] is None and inference_pool.is_saturated()
+
 # --- Background Task Definition ---
-def run_plan_generation_task(task_id: str, slots: Dict[str, Any], sheetData: List[List[str]], selectedRangeAddress: str):
-    """Runs the LLM plan generation and parsing in the background."""
+def run_plan_generation_task(task_id: str, slots: Dict[str, Any], sheetData: List[List[str]], selectedRangeAddress: str,
+                             output_mode: str, timings: TaskTimings, mapping_lookup: tuple, dedup_key: Optional[str] = None):
+    """
+    Runs the LLM plan generation and parsing in the background, from the
+    endpoint's timed_mapping_lookup() result.
+    With a `dedup_key`, the task is the in-flight one for that request content
+    and its completed result is cached for identical requests.
+    """
     logger.info(f"Background task {task_id} started.")
+    column_mapping, mapping_source, fingerprint = mapping_lookup
     try:
-        # --- Phase 4: Call LLM --- 
-        logger.info(f"Task {task_id}: Calling plan generation with slots: {slots}, address: {selectedRangeAddress}")
-        raw_output = generate_plan_raw_text(slots, sheetData, selectedRangeAddress)
-        logger.info(f"Task {task_id}: LLM call completed.")
-        
-        # --- Phase 5: Parse LLM Column Mapping Result ---
-        logger.info(f"Task {task_id}: Parsing LLM column mapping result.")
-        # Use the correct function name here
-        column_mapping = parse_column_mapping(raw_output) 
-        logger.info(f"Task {task_id}: Parsed column mapping: {column_mapping}")
+        raw_output = None
+
+        if column_mapping is None:
+            # --- Phase 4: Call LLM --- 
+            logger.debug(f"Task {task_id}: Calling plan generation with slots: {slots}, address: {selectedRangeAddress}")
+            raw_output = generate_plan_raw_text(slots, sheetData, selectedRangeAddress, timings=timings)
+            logger.debug(f"Task {task_id}: LLM call completed.")
+            
+            # --- Phase 5: Parse LLM Column Mapping Result ---
+            logger.debug(f"Task {task_id}: Parsing LLM column mapping result.")
+            # Use the correct function name here
+            with timings.stage("parse_mapping"):
+                column_mapping = parse_column_mapping(raw_output) 
+            logger.info(f"Task {task_id}: Parsed column mapping: {column_mapping}")
 
         # --- Phase 5.5: Perform Deterministic Calculations --- 
-        logger.info(f"Task {task_id}: Performing deterministic calculations...")
-        calculated_values = perform_cap_table_calculations(slots, sheetData, column_mapping)
-        logger.info(f"Task {task_id}: Calculations complete: {calculated_values}")
+        logger.debug(f"Task {task_id}: Performing deterministic calculations...")
+        with timings.stage("calculations"):
+            calculated_values = perform_cap_table_calculations(slots, sheetData, column_mapping)
+        logger.info(f"Task {task_id}: Calculations complete: "
+                    f"{len(calculated_values.get('parsed_investors', []))} investors, "
+                    f"price/share={calculated_values.get('price_per_share')}")
+
+        # Only remember mappings that produced a usable calculation
+        if mapping_source == "llm" and calculated_values:
+            column_mapping_cache.put(fingerprint, column_mapping)
 
         # --- Phase 6: Build Structured ActionOps --- 
-        logger.info(f"Task {task_id}: Building structured ActionOps.")
+        logger.debug(f"Task {task_id}: Building structured ActionOps.")
         # Pass the calculation results to the builder function
-        final_ops_list = build_structured_ops(slots, sheetData, selectedRangeAddress, column_mapping, calculated_values)
-        logger.info(f"Task {task_id}: Generated {len(final_ops_list)} ActionOps.")
+        with timings.stage("op_build"):
+            final_ops_list = build_structured_ops(slots, sheetData, selectedRangeAddress, column_mapping, calculated_values,
+                                                  output_mode)
+        logger.debug(f"Task {task_id}: Generated {len(final_ops_list)} ActionOps.")
         
-        # Validate with Pydantic models
-        validated_ops = [ActionOp(**op) for op in final_ops_list]
+        # Validate the whole list against the ActionOp schema in one pass
+        with timings.stage("validation"):
+            validated_ops = validate_ops(final_ops_list)
         logger.info(f"Task {task_id}: Successfully validated {len(validated_ops)} operations.")
         
         # Store successful result - Ensure ops are included for PreviewPane
-        task_results[task_id] = {
-            "status": "completed", 
-            "result": {
-                "ops": [op.dict() for op in validated_ops],
-                "raw_llm_output": raw_output, # Keep for debugging maybe
-                "slots": slots, # Include the original slots
-                "calculated_values": calculated_values, # Include the results of perform_cap_table_calculations
-                "column_mapping": column_mapping # Include the mapping used for calculations
-            }
+        result = {
+            "ops": validated_ops,
+            "raw_llm_output": raw_output, # Keep for debugging maybe
+            "slots": slots, # Include the original slots
+            "calculated_values": calculated_values, # Include the results of perform_cap_table_calculations
+            "column_mapping": column_mapping, # Include the mapping used for calculations
+            "mapping_source": mapping_source, # "llm", "heuristic" or "cache"
         }
+        result["metrics"] = timings.as_dict() # The store stage itself only shows up in /metrics
+        with timings.stage("store"):
+            task_results[task_id] = {"status": "completed", "result": result}
+        if dedup_key is not None:
+            plan_dedup.complete(dedup_key, task_id)
+        PLAN_TASKS.inc(status="completed", mapping_source=mapping_source)
+        plan_states.put(task_id, PlanState(slots=dict(slots), sheet_data=sheetData, selected_range_address=selectedRangeAddress,
+                                           column_mapping=column_mapping, mapping_source=mapping_source, ops=validated_ops,
+                                           output_mode=output_mode))
         logger.info(f"Background task {task_id} completed successfully with calculated data.") # Updated log message
 
+    except InferencePoolBusy as e:
+        logger.warning(f"Background task {task_id} rejected: {e}")
+        PLAN_TASKS.inc(status="rejected", mapping_source=mapping_source)
+        task_results[task_id] = {"status": "failed", "error": str(e), "retry_after": e.retry_after,
+                                 "metrics": timings.as_dict()}
+        if dedup_key is not None:
+            plan_dedup.release(dedup_key, task_id)
     except Exception as e:
         logger.error(f"Background task {task_id} failed: {e}")
         import traceback
         logger.error(traceback.format_exc())
+        PLAN_TASKS.inc(status="failed", mapping_source=mapping_source)
         # Store error result
-        task_results[task_id] = {"status": "failed", "error": str(e)}
-
-# --- Helper function for deterministic calculations (Implement this) ---
-def perform_cap_table_calculations(slots: Dict, sheetData: List[List[str]], column_mapping: Dict) -> Dict:
-    """Performs cap table calculations based on slots and parsed sheet data."""
-    calcs = {}
+        task_results[task_id] = {"status": "failed", "error": str(e), "metrics": timings.as_dict()}
+        if dedup_key is not None:
+            plan_dedup.release(dedup_key, task_id)
+
+def busy_response() -> JSONResponse:
+    """429 with a Retry-After hint, used while the inference queue is full."""
+    retry_after = inference_pool.retry_after()
+    return JSONResponse(
+        status_code=429,
+        content={"status": "busy", "detail": "Inference queue is full", "retry_after": retry_after},
+        headers={"Retry-After": str(retry_after)},
+    )
+
+async def read_plan_request(http_request: Request) -> PlanRequest:
+    """
+    Parses a /plan body: the PlanRequest JSON, or a columnar upload (MessagePack or
+    Arrow IPC, see sheet_upload.py) whose sheetData stays a ColumnarSheet. Either
+    may be gzip or zstd compressed (Content-Encoding).
+    """
+    body = await http_request.body()
+    content_type = http_request.headers.get("content-type", "application/json")
+    content_encoding = http_request.headers.get("content-encoding", "")
     try:
-        logger.info("Starting calculations...")
-        # Extract column indices with defaults
-        name_idx = column_mapping.get("shareholder_name_col_idx", 0)
-        shares_idx = column_mapping.get("pre_round_shares_col_idx") # NO DEFAULT! Let None be None
-        inv_idx = column_mapping.get("pre_round_investment_col_idx")
-
-        # Log the indices being used
-        logger.info(f"Using column mapping: Name={name_idx}, Shares={shares_idx}, Investment={inv_idx}")
-
-        # Extract slots values (handle potential None)
-        amount = float(slots.get("amount", 0))
-        pre_money = float(slots.get("preMoney", 0))
-        pool_pct_decimal = float(slots.get("poolPct", 0)) / 100.0
-
-        # 1. Sum pre-round shares from sheetData (with improved robustness)
-        total_pre_round_shares = 0.0 # Use float
-        parsed_investors = [] # Store parsed data for reuse
-        # Add row number for logging
-        for row_num, row in enumerate(sheetData):
-            # Check if row is valid list
-            if not row or not isinstance(row, list) or len(row) == 0:
-                logger.warning(f"Skipping invalid row {row_num+1} (not a non-empty list): {row}")
-                continue
-
-            # --- Safer Index Checking --- 
-            # Check name index validity
-            if name_idx is None or not (0 <= name_idx < len(row)):
-                 logger.warning(f"Skipping row {row_num+1} due to invalid name_idx={name_idx} for row length {len(row)}: {row}")
-                 continue # Cannot proceed without a name
-                 
-            # Check shares index validity (only if shares_idx is not None)
-            if shares_idx is not None and not (0 <= shares_idx < len(row)):
-                 logger.warning(f"Invalid shares_idx={shares_idx} for row length {len(row)} in row {row_num+1}, will treat shares as 0: {row}")
-                 # Don't skip row, just assume 0 shares if index is bad but provided
-                 current_shares_idx = None # Override index for this row
-            else:
-                 current_shares_idx = shares_idx # Use the valid index (or None)
-                 
-            # Check investment index validity (only if inv_idx is not None)
-            if inv_idx is not None and not (0 <= inv_idx < len(row)):
-                 logger.warning(f"Invalid inv_idx={inv_idx} for row length {len(row)} in row {row_num+1}, will treat investment as 0: {row}")
-                 current_inv_idx = None # Override index for this row
-            else:
-                 current_inv_idx = inv_idx # Use the valid index (or None)
-            # ---------------------------
-
-            try:
-                # Access name safely
-                name_val = row[name_idx]
-                name = str(name_val) if name_val is not None else f"Row {row_num+1}" # Default name
-
-                # Access and parse shares safely
-                shares = 0.0
-                if current_shares_idx is not None: # Use the potentially overridden index
-                     shares_val = row[current_shares_idx]
-                     if shares_val is not None and shares_val != "":
-                         try:
-                             shares = float(str(shares_val).replace(',','')) # Handle commas
-                         except (ValueError, TypeError):
-                              logger.warning(f"Could not parse shares '{shares_val}' in row {row_num+1}, using 0.0: {row}")
-                
-                total_pre_round_shares += shares
-
-                # Access and parse investment safely
-                inv = 0.0
-                if current_inv_idx is not None: # Use the potentially overridden index
-                    inv_val = row[current_inv_idx]
-                    if inv_val is not None and inv_val != "":
-                        try:
-                            # Handle currency symbols, commas etc.
-                            inv_str = re.sub(r'[$,]', '', str(inv_val))
-                            inv = float(inv_str)
-                        except (ValueError, TypeError):
-                             logger.warning(f"Could not parse investment '{inv_val}' in row {row_num+1}, using 0.0: {row}")
-
-                parsed_investors.append({"name": name, "pre_shares": shares, "investment": inv})
-                # Log successful parse? Maybe too verbose.
-                # logger.info(f"Successfully parsed row {row_num+1}: Name='{name}', Shares={shares}, Investment={inv}")
-                
-            except Exception as e: # Catch any other unexpected error during row processing
-                logger.error(f"Unexpected error processing row {row_num+1}: {row} - {e}", exc_info=True)
-                continue # Skip row on unexpected error
-
-        logger.info(f"Total pre-round shares calculated: {total_pre_round_shares}")
-        logger.info(f"Parsed investors list: {parsed_investors}") # Log the list *after* the loop
-
-        # 2. Calculate core round values
-        calcs["post_money_valuation"] = pre_money + amount
-        calcs["price_per_share"] = pre_money / total_pre_round_shares if total_pre_round_shares > 0 else 0
-        calcs["total_new_shares_for_round"] = amount / calcs["price_per_share"] if calcs["price_per_share"] > 0 else 0
-        
-        total_post_money_shares_before_pool = total_pre_round_shares + calcs["total_new_shares_for_round"]
-        
-        # 3. Calculate option pool shares (using post-money formula)
-        if pool_pct_decimal > 0 and pool_pct_decimal < 1:
-             total_post_money_shares_after_pool_target = total_post_money_shares_before_pool / (1.0 - pool_pct_decimal)
-             calcs["option_pool_shares"] = total_post_money_shares_after_pool_target - total_post_money_shares_before_pool
-        else:
-             calcs["option_pool_shares"] = 0
-             total_post_money_shares_after_pool_target = total_post_money_shares_before_pool
-
-        total_post_money_shares_after_pool = total_post_money_shares_before_pool + calcs["option_pool_shares"]
-        calcs["total_post_money_shares"] = total_post_money_shares_after_pool # Store total for convenience
-
-        # 4. Calculate final share counts and ownership percentages
-        final_share_counts = {}
-        final_ownership_pct = {}
-
-        for inv in parsed_investors:
-             name = inv["name"]
-             final_share_counts[name] = inv["pre_shares"] # Start with pre-round shares
-             final_ownership_pct[name] = (inv["pre_shares"] / total_post_money_shares_after_pool) if total_post_money_shares_after_pool > 0 else 0
-
-        final_share_counts["New Investors"] = calcs["total_new_shares_for_round"]
-        final_ownership_pct["New Investors"] = (calcs["total_new_shares_for_round"] / total_post_money_shares_after_pool) if total_post_money_shares_after_pool > 0 else 0
-
-        final_share_counts["Option Pool"] = calcs["option_pool_shares"]
-        final_ownership_pct["Option Pool"] = (calcs["option_pool_shares"] / total_post_money_shares_after_pool) if total_post_money_shares_after_pool > 0 else 0
-        
-        calcs["final_share_counts"] = final_share_counts
-        calcs["final_ownership_pct"] = final_ownership_pct
-        calcs["parsed_investors"] = parsed_investors # Pass this along too
-
-        logger.info("Calculations finished successfully.")
-        
-    except Exception as e:
-        logger.error(f"Error during deterministic calculations: {e}", exc_info=True)
-        # Return empty or partial dictionary on error?
-        return {} # Return empty for now
-        
-    return calcs
-
-# --- Helper function to build ops (Update signature) ---
-def build_structured_ops(slots: Dict, sheetData: List[List[str]], selectedRangeAddress: str, column_mapping: Dict, calculated_values: Dict) -> List[Dict]:
-    """Deterministically builds the ActionOp list for the structured output."""
-    ops = []
-    op_id_counter = 1
-
-    # Get column indices (with defaults if mapping is incomplete/missing)
-    name_idx = column_mapping.get("shareholder_name_col_idx", 0) # Default to 0
-    shares_idx = column_mapping.get("pre_round_shares_col_idx", 1) # Default to 1
-    inv_idx = column_mapping.get("pre_round_investment_col_idx") # Default to None
-    logger.info(f"Using column mapping: Name={name_idx}, Shares={shares_idx}, Investment={inv_idx}")
-
-    def get_op_id():
-        nonlocal op_id_counter
-        op_id = f"op-{op_id_counter}"
-        op_id_counter += 1
-        return op_id
-        
-    # Helper to convert column letter to number (A=1)
-    def col_to_num(col_str):
-        num = 0
-        for char in col_str:
-            num = num * 26 + (ord(char.upper()) - ord('A')) + 1
-        return num
-
-    # Helper to convert column number to letter (1=A)
-    def num_to_col(n):
-        string = ""
-        while n > 0:
-            n, remainder = divmod(n - 1, 26)
-            string = chr(65 + remainder) + string
-        return string
-
+        if is_columnar_upload(content_type):
+            slots, sheet, address, output_mode = await run_in_threadpool(decode_sheet_upload, body, content_type, content_encoding)
+            if output_mode is not None and output_mode not in PLAN_OUTPUT_MODES:
+                raise ValueError(f"outputMode must be one of {', '.join(PLAN_OUTPUT_MODES)}, got {output_mode!r}")
+            # Already validated by the decoder; model_construct() skips re-checking every cell
+            return PlanRequest.model_construct(slots=slots, sheetData=sheet, selectedRangeAddress=address,
+                                               outputMode=output_mode or PLAN_OUTPUT_MODE)
+        data = await run_in_threadpool(decode_json_body, body, content_encoding)
+        if not isinstance(data, dict):
+            raise ValueError("Request body must be a JSON object")
+        return PlanRequest(**data)
+    except UnsupportedUpload as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    except ValidationError:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def acquire_plan_dedup(task_id: str, request: PlanRequest) -> tuple:
+    """
+    plan_dedup.acquire() for the request's content key. Returns (dedup_key, outcome, found);
+    with dedup off the key is None and the outcome "new". A new task is marked processing
+    before the next await, so requests attaching to it find it when they poll.
+    """
+    if not PLAN_DEDUP_ENABLED:
+        return None, "new", task_id
+    dedup_key = await run_in_threadpool(plan_request_key, request.slots, request.sheetData, request.selectedRangeAddress,
+                                       request.outputMode)
+    outcome, found = plan_dedup.acquire(dedup_key, task_id)
+    if outcome == "new":
+        task_results[task_id] = {"status": "processing"}
+    return dedup_key, outcome, found
+
+def serve_cached_plan(task_id: str, request: PlanRequest, source_task_id: str, encoded: bytes) -> Dict[str, Any]:
+    """Stores a recent identical plan's result (encoded, from the result store) as task `task_id` and returns it."""
+    logger.info(f"Serving cached plan result of task {source_task_id} as task {task_id}")
+    stored = {**loads(encoded), "deduplicated_from": source_task_id}
+    task_results[task_id] = stored
+    result = stored["result"]
+    # Fresh re-plan state: re-plans mutate it, so tasks never share one
+    plan_states.put(task_id, PlanState(slots=dict(request.slots), sheet_data=request.sheetData,
+                                       selected_range_address=request.selectedRangeAddress,
+                                       column_mapping=result["column_mapping"],
+                                       mapping_source=result["mapping_source"], ops=result["ops"],
+                                       output_mode=request.outputMode))
+    return stored
+
+async def prepare_plan_task(task_id: str, request: PlanRequest, dedup_key: Optional[str]) -> tuple:
+    """
+    Resolves the column mapping and applies backpressure. Returns (busy response, None, None)
+    when the inference queue is full, else (None, timings, mapping_lookup) with the task
+    marked processing. Rejections and errors release the dedup key and leave a failed
+    result for requests that attached to the task.
+    """
     try:
-        # --- 1. Parse Address & Calculate Output Start --- 
-        logger.info(f"Parsing address: {selectedRangeAddress}")
-        # Remove sheet name if present (e.g., "Sheet1!A1:B4" -> "A1:B4")
-        address_part = selectedRangeAddress.split('!')[-1]
-        # Basic regex for A1 or A1:B4 formats
-        match = re.match(r"([A-Z]+)(\d+)(?::([A-Z]+)(\d+))?", address_part)
-        if not match:
-            raise ValueError(f"Could not parse address part: {address_part}")
-        
-        start_col_str, start_row_str, end_col_str, end_row_str = match.groups()
-        start_row = int(start_row_str)
-        end_col_str = end_col_str or start_col_str # Handle single cell selection
-        
-        end_col_num = col_to_num(end_col_str)
-        output_start_col_num = end_col_num + 2 # Start 2 columns right
-        output_start_col_letter = num_to_col(output_start_col_num)
-        output_start_row = start_row
-        current_row = output_start_row
-        
-        logger.info(f"Input ends at col {end_col_str}({end_col_num}). Output starts at col {output_start_col_letter}({output_start_col_num}), row {output_start_row}")
-
-        # --- 2. Generate Ops for Round Inputs --- 
-        input_col1 = output_start_col_letter
-        input_col2 = num_to_col(output_start_col_num + 1)
-        
-        ops.append({"id": get_op_id(), "range": f"{input_col1}{current_row}", "type": "write", "values": [["Round Inputs"]], "note": "Header"})
-        current_row += 1
-        ops.append({"id": get_op_id(), "range": f"{input_col1}{current_row}", "type": "write", "values": [["Round Type"]], "note": "Input Label"})
-        ops.append({"id": get_op_id(), "range": f"{input_col2}{current_row}", "type": "write", "values": [[str(slots.get('roundType', ''))]], "note": "Input Value"})
-        current_row += 1
-        ops.append({"id": get_op_id(), "range": f"{input_col1}{current_row}", "type": "write", "values": [["Amount ($M)"]], "note": "Input Label"})
-        ops.append({"id": get_op_id(), "range": f"{input_col2}{current_row}", "type": "write", "values": [[slots.get('amount') / 1000000 if slots.get('amount') else None]], "note": "Input Value ($M)"})
-        current_row += 1
-        ops.append({"id": get_op_id(), "range": f"{input_col1}{current_row}", "type": "write", "values": [["Pre-Money ($M)"]], "note": "Input Label"})
-        ops.append({"id": get_op_id(), "range": f"{input_col2}{current_row}", "type": "write", "values": [[slots.get('preMoney') / 1000000 if slots.get('preMoney') else None]], "note": "Input Value ($M)"})
-        current_row += 1
-        ops.append({"id": get_op_id(), "range": f"{input_col1}{current_row}", "type": "write", "values": [["Pool Pct (%)"]], "note": "Input Label"})
-        ops.append({"id": get_op_id(), "range": f"{input_col2}{current_row}", "type": "write", "values": [[slots.get('poolPct')]], "note": "Input Value (%)"})
-        current_row += 2 # Skip a row
-
-        # --- 3. Generate Ops for Calculations --- 
-        calc_col1 = output_start_col_letter
-        calc_col2 = num_to_col(output_start_col_num + 1)
-        
-        ops.append({"id": get_op_id(), "range": f"{calc_col1}{current_row}", "type": "write", "values": [["Calculations"]], "note": "Header"})
-        current_row += 1
-        ops.append({"id": get_op_id(), "range": f"{calc_col1}{current_row}", "type": "write", "values": [["Post-Money ($M)"]], "note": "Calc Label"})
-        # Use calculated value from LLM, convert to $M
-        pmv = calculated_values.get("post_money_valuation")
-        pmv_m = pmv / 1000000 if pmv else None
-        ops.append({"id": get_op_id(), "range": f"{calc_col2}{current_row}", "type": "write", "values": [[pmv_m]], "note": "Calc Value ($M)"})
-        current_row += 1
-        ops.append({"id": get_op_id(), "range": f"{calc_col1}{current_row}", "type": "write", "values": [["Price per Share"]], "note": "Calc Label"})
-        # Use calculated value from LLM
-        pps = calculated_values.get("price_per_share")
-        ops.append({"id": get_op_id(), "range": f"{calc_col2}{current_row}", "type": "write", "values": [[pps]], "note": "Calc Value"})
-        current_row += 2 # Skip a row
-        
-        # --- 4. Generate Ops for Cap Table Headers --- 
-        cap_table_start_row = current_row
-        header_col1 = output_start_col_letter
-        header_col2 = num_to_col(output_start_col_num + 1)
-        header_col3 = num_to_col(output_start_col_num + 2)
-        header_col4 = num_to_col(output_start_col_num + 3)
-        
-        ops.append({"id": get_op_id(), "range": f"{header_col1}{current_row}", "type": "write", "values": [["Post-Money Cap Table"]], "note": "Header"})
-        current_row += 1
-        ops.append({"id": get_op_id(), "range": f"{header_col1}{current_row}:{header_col4}{current_row}", # Merge header range? LLM needs to know merge or just write
-                      "type": "write", "values": [["Shareholder", "Investment ($)", "Shares", "% Ownership"]], "note": "Table Headers"})
-        current_row += 1
-
-        # --- 5. Generate Ops for Cap Table Data --- 
-        share_counts = calculated_values.get("final_share_counts", {})
-        ownership_pct = calculated_values.get("final_ownership_pct", {})
-        # Get parsed investors list (which contains pre-round info needed)
-        parsed_investors = calculated_values.get("parsed_investors", []) 
-
-        # Write rows for existing investors
-        for investor_data in parsed_investors:
-            name = investor_data["name"]
-            # Use pre-round investment parsed from sheet
-            investment = investor_data["investment"] 
-            final_shares = share_counts.get(name)
-            final_pct = ownership_pct.get(name)
-            
-            ops.append({"id": get_op_id(), "range": f"{header_col1}{current_row}", "type": "write", "values": [[name]]})
-            ops.append({"id": get_op_id(), "range": f"{header_col2}{current_row}", "type": "write", "values": [[investment]]})
-            ops.append({"id": get_op_id(), "range": f"{header_col3}{current_row}", "type": "write", "values": [[final_shares]]})
-            # Write percentage as a number, Excel can format it
-            ops.append({"id": get_op_id(), "range": f"{header_col4}{current_row}", "type": "write", "values": [[final_pct]], "note": "Ownership Pct"})
-            current_row += 1
-
-        # Write row for New Investors
-        new_inv_shares = share_counts.get("New Investors")
-        new_inv_pct = ownership_pct.get("New Investors")
-        ops.append({"id": get_op_id(), "range": f"{header_col1}{current_row}", "type": "write", "values": [["New Investors"]]})
-        # Use investment amount from slots
-        ops.append({"id": get_op_id(), "range": f"{header_col2}{current_row}", "type": "write", "values": [[float(slots.get('amount', 0))]]})
-        ops.append({"id": get_op_id(), "range": f"{header_col3}{current_row}", "type": "write", "values": [[new_inv_shares]]})
-        ops.append({"id": get_op_id(), "range": f"{header_col4}{current_row}", "type": "write", "values": [[new_inv_pct]], "note": "Ownership Pct"})
-        current_row += 1
-
-        # Write row for Option Pool
-        pool_shares = share_counts.get("Option Pool")
-        pool_pct = ownership_pct.get("Option Pool")
-        ops.append({"id": get_op_id(), "range": f"{header_col1}{current_row}", "type": "write", "values": [["Option Pool"]]})
-        # Option pool has no explicit investment amount
-        ops.append({"id": get_op_id(), "range": f"{header_col2}{current_row}", "type": "write", "values": [[None]]}) # Or 0?
-        ops.append({"id": get_op_id(), "range": f"{header_col3}{current_row}", "type": "write", "values": [[pool_shares]]})
-        ops.append({"id": get_op_id(), "range": f"{header_col4}{current_row}", "type": "write", "values": [[pool_pct]], "note": "Ownership Pct"})
-        current_row += 1
-
-        # --- 6. Generate Ops for Totals --- 
-        total_row = current_row
-        ops.append({"id": get_op_id(), "range": f"{header_col1}{total_row}", "type": "write", "values": [["Total"]], "note": "Total Label"})
-        # Sum Investment
-        ops.append({"id": get_op_id(), "range": f"{header_col2}{total_row}", "type": "formula", 
-                      "formula": f"=SUM({header_col2}{cap_table_start_row+2}:{header_col2}{total_row-1})", 
-                      "note": "Sum Investment"})
-        # Sum Shares
-        ops.append({"id": get_op_id(), "range": f"{header_col3}{total_row}", "type": "formula", 
-                      "formula": f"=SUM({header_col3}{cap_table_start_row+2}:{header_col3}{total_row-1})", 
-                      "note": "Sum Shares"})
-        # Sum Percentage
-        ops.append({"id": get_op_id(), "range": f"{header_col4}{total_row}", "type": "formula", 
-                      "formula": f"=SUM({header_col4}{cap_table_start_row+2}:{header_col4}{total_row-1})", 
-                      "note": "Sum Percentage"})
-
-        logger.info(f"Finished generating {len(ops)} operations.")
-
+        # Backpressure: refuse new LLM work while the inference queue is full
+        timings, mapping_lookup = await run_in_threadpool(timed_mapping_lookup, task_id, request.sheetData)
+        if needs_busy_response(mapping_lookup):
+            if dedup_key is not None:
+                task_results[task_id] = {"status": "failed", "error": "Inference queue is full",
+                                         "retry_after": inference_pool.retry_after()}
+                plan_dedup.release(dedup_key, task_id)
+            return busy_response(), None, None
     except Exception as e:
-         logger.error(f"Error during structured op generation: {e}", exc_info=True)
-         # Return empty list or raise specific error?
-         ops = [] # Return empty on error for now
-         
-    return ops
+        if dedup_key is not None:
+            task_results[task_id] = {"status": "failed", "error": str(e)}
+            plan_dedup.release(dedup_key, task_id)
+        raise
+    # Initialize task status
+    task_results[task_id] = {"status": "processing"}
+    return None, timings, mapping_lookup
 
 @app.post("/plan")
-async def plan_endpoint(request: PlanRequest, background_tasks: BackgroundTasks): # Inject BackgroundTasks
-    logger.info("=== Plan Endpoint Hit ===")
+async def plan_endpoint(http_request: Request, background_tasks: BackgroundTasks): # Inject BackgroundTasks
+    logger.debug("=== Plan Endpoint Hit ===")
     try:
-        # Log the received sheet data for debugging
-        logger.info(f"Received sheet data for plan generation:")
-        logger.info(json.dumps(request.sheetData, indent=2))
+        request = await read_plan_request(http_request)
+        # Log a sample of the received sheet data for debugging (DEBUG only, truncated)
+        logger.info(f"Received sheet data for plan generation: {len(request.sheetData)} rows"
+                    f"{' (columnar upload)' if isinstance(request.sheetData, ColumnarSheet) else ''}")
+        log_payload(logger, "Sheet data", request.sheetData)
 
         # Generate a task ID
         task_id = str(uuid.uuid4())
-        logger.info(f"Generated task ID: {task_id}")
-
-        # Initialize task status
-        task_results[task_id] = {"status": "processing"}
-
+        logger.debug(f"Generated task ID: {task_id}")
+
+        # Identical requests share one task while it runs and reuse its result for a while after
+        dedup_key, outcome, found = await acquire_plan_dedup(task_id, request)
+        if outcome == "inflight":
+            logger.info(f"Identical plan request attached to in-flight task {found}")
+            return JSONResponse(status_code=202, content={"status": "processing", "task_id": found, "deduplicated": "inflight"})
+        if outcome == "cached":
+            await run_in_threadpool(serve_cached_plan, task_id, request, *found)
+            return JSONResponse(status_code=202, content={"status": "completed", "task_id": task_id, "deduplicated": "cache"})
+
+        busy, timings, mapping_lookup = await prepare_plan_task(task_id, request, dedup_key)
+        if busy is not None:
+            return busy
         # Add the long-running job to background tasks
-        background_tasks.add_task(run_plan_generation_task, task_id, request.slots, request.sheetData, request.selectedRangeAddress)
+        background_tasks.add_task(run_plan_generation_task, task_id, request.slots, request.sheetData, request.selectedRangeAddress,
+                                  request.outputMode, timings, mapping_lookup, dedup_key)
 
         # Return 202 Accepted with the task ID
         return JSONResponse(
@@ -497,6 +485,8 @@ async def plan_endpoint(request: PlanRequest, background_tasks: BackgroundTasks)
             content={"status": "processing", "task_id": task_id}
         )
 
+    except HTTPException: # Unreadable body (read_plan_request)
+        raise
     except ValidationError as e: # Catch Pydantic validation errors specifically
         logger.error(f"Validation Error for /plan request: {e.errors()}")
         raise HTTPException(
@@ -521,23 +511,421 @@ async def plan_endpoint(request: PlanRequest, background_tasks: BackgroundTasks)
 # --- Result Retrieval Endpoint ---
 @app.get("/plan/result/{task_id}")
 async def get_plan_result(task_id: str):
-    logger.info(f"Polling for result of task_id: {task_id}")
-    result = task_results.get(task_id)
-    if not result:
+    logger.debug(f"Polling for result of task_id: {task_id}")
+    # JSON bytes encoded once when the result was stored; finished results are evicted shortly after delivery
+    encoded = task_results.fetch_encoded(task_id)
+    if not encoded:
         logger.warning(f"Task ID {task_id} not found.")
         raise HTTPException(status_code=404, detail="Task ID not found")
     
-    logger.info(f"Returning status for task {task_id}: {result.get('status')}")
-    if result["status"] == "completed":
-        # Clear result after retrieval? Optional.
-        # task_results.pop(task_id, None)
-        pass # Keep result for potential re-polling or inspection
-    elif result["status"] == "failed":
-        # Clear result after retrieval? Optional.
-        # task_results.pop(task_id, None)
-        pass # Keep result for potential re-polling or inspection
-        
-    return result
+    logger.debug(f"Returning result for task {task_id} ({len(encoded)} bytes)")
+    # Completed/failed results stay for FETCHED_GRACE_SECONDS so a re-poll still succeeds
+    return Response(content=encoded, media_type="application/json")
+
+# --- Streaming Plan Endpoint (Server-Sent Events) ---
+STREAM_OPS_BATCH_SIZE = 200  # Ops per "ops" event
+
+def _sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {dumps(data).decode('utf-8')}\n\n"
+
+def _sse_ops(ops: List[Dict[str, Any]]) -> Iterator[str]:
+    for i in range(0, len(ops), STREAM_OPS_BATCH_SIZE):
+        yield _sse("ops", {"ops": ops[i:i + STREAM_OPS_BATCH_SIZE]})
+
+def stream_plan_events(task_id: str, slots: Dict[str, Any], sheetData: List[List[str]], selectedRangeAddress: str,
+                       output_mode: str, timings: TaskTimings, mapping_lookup: tuple,
+                       dedup_key: Optional[str] = None) -> Iterator[str]:
+    """
+    Runs the plan pipeline and yields SSE events as each stage finishes:
+    accepted -> llm_delta* -> mapping -> calculations -> ops* -> done (or error).
+    Starlette iterates this sync generator in its threadpool, so it never blocks the event loop.
+    With a `dedup_key`, the stream is the in-flight task for identical /plan requests.
+    """
+    column_mapping, mapping_source, fingerprint = mapping_lookup
+    finished = False
+    try:
+        yield _sse("accepted", {"task_id": task_id})
+        raw_output = None
+        if column_mapping is None:
+            # Stream the LLM stage token by token
+            pieces = []
+            for piece in stream_plan_raw_text(slots, sheetData, selectedRangeAddress, timings=timings):
+                pieces.append(piece)
+                yield _sse("llm_delta", {"text": piece})
+            with timings.stage("parse_mapping"):
+                raw_output = finalize_plan_output("".join(pieces))
+                column_mapping = parse_column_mapping(raw_output)
+        yield _sse("mapping", {"column_mapping": column_mapping, "mapping_source": mapping_source})
+
+        with timings.stage("calculations"):
+            calculated_values = perform_cap_table_calculations(slots, sheetData, column_mapping)
+        if mapping_source == "llm" and calculated_values:
+            column_mapping_cache.put(fingerprint, column_mapping)
+        yield _sse("calculations", {"calculated_values": calculated_values})
+
+        # Emit ops in batches as the builder produces them (the stage includes sending them)
+        all_ops, batch = [], []
+        with timings.stage("op_stream"):
+            for op in iter_structured_ops(slots, sheetData, selectedRangeAddress, column_mapping, calculated_values, output_mode):
+                batch.append(op)
+                if len(batch) >= STREAM_OPS_BATCH_SIZE:
+                    batch = validate_ops(batch)
+                    yield _sse("ops", {"ops": batch})
+                    all_ops.extend(batch)
+                    batch = []
+            if batch:
+                batch = validate_ops(batch)
+                yield _sse("ops", {"ops": batch})
+                all_ops.extend(batch)
+
+        # Keep the result retrievable through /plan/result as well
+        metrics = timings.as_dict()
+        with timings.stage("store"):
+            stored = {
+                "status": "completed",
+                "result": {
+                    "ops": all_ops,
+                    "raw_llm_output": raw_output,
+                    "slots": slots,
+                    "calculated_values": calculated_values,
+                    "column_mapping": column_mapping,
+                    "mapping_source": mapping_source,
+                    "metrics": metrics
+                }
+            }
+            task_results[task_id] = stored
+        if dedup_key is not None:
+            plan_dedup.complete(dedup_key, task_id)
+        finished = True
+        PLAN_TASKS.inc(status="completed", mapping_source=mapping_source)
+        plan_states.put(task_id, PlanState(slots=dict(slots), sheet_data=sheetData, selected_range_address=selectedRangeAddress,
+                                           column_mapping=column_mapping, mapping_source=mapping_source, ops=all_ops,
+                                           output_mode=output_mode))
+        yield _sse("done", {"task_id": task_id, "op_count": len(all_ops), "metrics": metrics})
+
+    except InferencePoolBusy as e:
+        PLAN_TASKS.inc(status="rejected", mapping_source=mapping_source)
+        task_results[task_id] = {"status": "failed", "error": str(e), "retry_after": e.retry_after}
+        finished = True
+        yield _sse("error", {"error": str(e), "retry_after": e.retry_after})
+    except Exception as e:
+        logger.error(f"Streaming task {task_id} failed: {e}", exc_info=True)
+        PLAN_TASKS.inc(status="failed", mapping_source=mapping_source)
+        task_results[task_id] = {"status": "failed", "error": str(e)}
+        finished = True
+        yield _sse("error", {"error": str(e)})
+    finally:
+        if not finished:
+            # The client disconnected mid-stream (GeneratorExit at a yield): don't leave pollers on "processing"
+            logger.info(f"Streaming task {task_id} cancelled: client disconnected.")
+            PLAN_TASKS.inc(status="cancelled", mapping_source=mapping_source)
+            task_results[task_id] = {"status": "failed", "error": "Plan stream closed before the plan finished"}
+        if dedup_key is not None:
+            plan_dedup.release(dedup_key, task_id) # No-op once complete() ended the in-flight entry
+
+STREAM_FOLLOW_POLL_SECONDS = 0.25
+
+def replay_plan_events(task_id: str, stored: Optional[Dict[str, Any]]) -> Iterator[str]:
+    """The events of a finished plan (no llm_delta), from its task result."""
+    yield _sse("accepted", {"task_id": task_id})
+    if stored is None or stored.get("status") != "completed":
+        stored = stored or {"error": "Task result expired"}
+        yield _sse("error", {key: stored[key] for key in ("error", "retry_after") if key in stored})
+        return
+    result = stored["result"]
+    yield _sse("mapping", {"column_mapping": result["column_mapping"], "mapping_source": result["mapping_source"]})
+    yield _sse("calculations", {"calculated_values": result["calculated_values"]})
+    yield from _sse_ops(result["ops"])
+    yield _sse("done", {"task_id": task_id, "op_count": len(result["ops"]), "metrics": result.get("metrics", {})})
+
+def follow_plan_events(task_id: str) -> Iterator[str]:
+    """Waits for an identical in-flight plan task, then replays its result."""
+    stored = task_results.get(task_id)
+    while stored is not None and stored.get("status") not in ("completed", "failed"):
+        time.sleep(STREAM_FOLLOW_POLL_SECONDS)
+        stored = task_results.get(task_id)
+    yield from replay_plan_events(task_id, stored)
+
+def _event_stream(events: Iterator[str]) -> StreamingResponse:
+    return StreamingResponse(events, media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/plan/stream")
+async def plan_stream_endpoint(request: PlanRequest):
+    """
+    Same pipeline as /plan, but streams stage events instead of requiring /plan/result
+    polling. Shares /plan's deduplication: an identical in-flight or recent plan is
+    replayed (without llm_delta events) instead of running the LLM again.
+    """
+    task_id = str(uuid.uuid4())
+    dedup_key, outcome, found = await acquire_plan_dedup(task_id, request)
+    if outcome == "inflight":
+        logger.info(f"Identical plan stream following in-flight task {found}")
+        return _event_stream(follow_plan_events(found))
+    if outcome == "cached":
+        stored = await run_in_threadpool(serve_cached_plan, task_id, request, *found)
+        return _event_stream(replay_plan_events(task_id, stored))
+
+    busy, timings, mapping_lookup = await prepare_plan_task(task_id, request, dedup_key)
+    if busy is not None:
+        return busy
+    return _event_stream(stream_plan_events(task_id, request.slots, request.sheetData, request.selectedRangeAddress,
+                                            request.outputMode, timings, mapping_lookup, dedup_key))
+
+# --- Batch Planning Endpoint (Server-Sent Events) ---
+BATCH_LLM_RETRIES = 3  # Busy-pool retries for one batch LLM mapping before its jobs fail
+
+async def resolve_batch_llm_mapping(args: tuple, llm_gate: asyncio.Semaphore) -> tuple:
+    """
+    Asks the LLM for one sheet layout's column mapping, holding a slot of `llm_gate`
+    so a batch never queues more prompts than the pool has workers. A pool that is
+    still busy (other requests) is waited out and retried. Returns (mapping, raw output).
+    """
+    async with llm_gate:
+        for attempt in range(BATCH_LLM_RETRIES + 1):
+            try:
+                raw_output = await run_in_threadpool(generate_plan_raw_text, *args)
+                break
+            except InferencePoolBusy as e:
+                if attempt == BATCH_LLM_RETRIES:
+                    raise
+                logger.info(f"Inference pool busy, retrying batch LLM mapping in {e.retry_after}s.")
+                await asyncio.sleep(e.retry_after)
+    return parse_column_mapping(raw_output), raw_output
+
+async def run_batch_job(request: PlanRequest, llm_mappings: Dict[str, "asyncio.Task"],
+                        llm_gate: asyncio.Semaphore) -> Dict[str, Any]:
+    """
+    Plans one batch job on the process pool: cached mapping or the worker's heuristic
+    detector, and only when that isn't confident, an LLM mapping from the inference pool.
+    Jobs with the same sheet fingerprint share one LLM mapping through `llm_mappings`.
+    """
+    fingerprint = sheet_fingerprint(request.sheetData)
+    column_mapping = column_mapping_cache.get(fingerprint)
+    args = (request.slots, request.sheetData, request.selectedRangeAddress)
+    outcome = await asyncio.wrap_future(batch_planner.submit(*args, column_mapping, "cache" if column_mapping else None,
+                                                             request.outputMode))
+    if outcome["status"] != "needs_llm":
+        return outcome
+
+    shared = llm_mappings.get(fingerprint)
+    if shared is None: # First job of this layout asks the LLM; the rest of its group awaits the same answer
+        shared = llm_mappings[fingerprint] = asyncio.ensure_future(resolve_batch_llm_mapping(args, llm_gate))
+    column_mapping, raw_output = await asyncio.shield(shared) # One cancelled job mustn't cancel its group's call
+    outcome = await asyncio.wrap_future(batch_planner.submit(*args, column_mapping, "llm", request.outputMode))
+    outcome["result"]["raw_llm_output"] = raw_output
+    if outcome["result"]["calculated_values"]: # Only remember mappings that produced a usable calculation
+        await run_in_threadpool(column_mapping_cache.put, fingerprint, column_mapping)
+    return outcome
+
+async def batch_plan_events(jobs: List[Any]) -> AsyncIterator[str]:
+    """
+    Yields accepted -> job* (in completion order) -> done. Each job is also stored
+    as its own task (/plan/result, /plan/replan). A failed job is reported in its
+    event and counted; the rest of the batch carries on.
+    """
+    started = time.perf_counter()
+    running: Dict["asyncio.Task", tuple] = {}
+    llm_mappings: Dict[str, "asyncio.Task"] = {}
+    llm_gate = asyncio.Semaphore(inference_pool.n_workers)
+    failures = []
+    for index, job in enumerate(jobs):
+        job_id = str(job.get("id", index)) if isinstance(job, dict) else str(index)
+        try:
+            request = PlanRequest(**{k: v for k, v in job.items() if k != "id"})
+        except (AttributeError, TypeError, ValidationError) as e:
+            failures.append(_sse("job", {"index": index, "id": job_id, "status": "failed", "error": f"Invalid job: {e}"}))
+            continue
+        task_id = str(uuid.uuid4())
+        task_results[task_id] = {"status": "processing"}
+        running[asyncio.ensure_future(run_batch_job(request, llm_mappings, llm_gate))] = (index, job_id, task_id, request)
+
+    yield _sse("accepted", {"jobs": len(jobs), "workers": batch_planner.workers})
+    for event in failures:
+        yield event
+    completed, failed, total_rows, total_ops = 0, len(failures), 0, 0
+    mapping_sources: Dict[str, int] = {}
+    try:
+        while running:
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                index, job_id, task_id, request = running.pop(task)
+                event = {"index": index, "id": job_id, "task_id": task_id,
+                         "elapsed_ms": round((time.perf_counter() - started) * 1000, 3)}
+                try:
+                    result = task.result()["result"]
+                except Exception as e:
+                    logger.warning(f"Batch job {job_id} (task {task_id}) failed: {e}")
+                    failed += 1
+                    error = {"status": "failed", "error": str(e) or type(e).__name__}
+                    if isinstance(e, InferencePoolBusy):
+                        error["retry_after"] = e.retry_after
+                    task_results[task_id] = error
+                    PLAN_TASKS.inc(status="rejected" if isinstance(e, InferencePoolBusy) else "failed", mapping_source=None)
+                    yield _sse("job", {**event, **error})
+                    continue
+                completed += 1
+                total_rows += len(request.sheetData)
+                total_ops += len(result["ops"])
+                mapping_source = result["mapping_source"]
+                mapping_sources[mapping_source] = mapping_sources.get(mapping_source, 0) + 1
+                task_results[task_id] = {"status": "completed", "result": result}
+                PLAN_TASKS.inc(status="completed", mapping_source=mapping_source)
+                plan_states.put(task_id, PlanState(slots=dict(request.slots), sheet_data=request.sheetData,
+                                                   selected_range_address=request.selectedRangeAddress,
+                                                   column_mapping=result["column_mapping"],
+                                                   mapping_source=mapping_source, ops=result["ops"],
+                                                   output_mode=request.outputMode))
+                yield _sse("job", {**event, "status": "completed", "result": result})
+    finally:
+        for task in itertools.chain(running, llm_mappings.values()): # Client went away: don't plan jobs nobody will read
+            task.cancel()
+        batch_planner.record_batch(len(jobs), failed + len(running))
+
+    elapsed = time.perf_counter() - started
+    summary = {
+        "jobs": len(jobs),
+        "completed": completed,
+        "failed": failed,
+        "mapping_sources": mapping_sources,
+        "elapsed_ms": round(elapsed * 1000, 3),
+        "jobs_per_second": round(len(jobs) / elapsed, 3) if elapsed else None,
+        "rows_per_second": round(total_rows / elapsed, 1) if elapsed else None,
+        "ops": total_ops,
+        "workers": batch_planner.workers,
+    }
+    logger.info(f"Batch of {len(jobs)} plan jobs finished: {completed} completed, {failed} failed, "
+                f"{summary['jobs_per_second']} jobs/s.")
+    yield _sse("done", summary)
+
+@app.post("/plan/batch")
+async def plan_batch_endpoint(request: BatchPlanRequest):
+    """Plans many (slots, sheetData, selectedRangeAddress) jobs in parallel and streams each result as it finishes."""
+    if len(request.jobs) > BATCH_MAX_JOBS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_JOBS} jobs per batch")
+    return StreamingResponse(
+        batch_plan_events(request.jobs),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# --- Incremental Re-plan Endpoint ---
+def run_replan(state: PlanState, slot_changes: Dict[str, Any], row_updates: Dict[int, List[str]]) -> Dict[str, Any]:
+    """
+    Recomputes a finished plan after a slot or row delta, reusing its column mapping
+    and parsed investor arrays (no LLM call), and returns only the changed ops.
+    """
+    with state.lock: # Deltas on one plan apply in order
+        bad_rows = [idx for idx in row_updates if not 0 <= idx < len(state.sheet_data)]
+        if bad_rows:
+            raise ValueError(f"Row indices out of range for this plan: {bad_rows}")
+        # Work on copies and keep them only once the plan computes, so a rejected change can't leak into later re-plans
+        slots = {**state.slots, **slot_changes}
+        sheet_data, columns = state.sheet_data, state.columns
+
+        if row_updates:
+            # Edited rows replace cells: a columnar upload switches to plain rows (once per plan)
+            sheet_data = sheet_data.to_rows() if isinstance(sheet_data, ColumnarSheet) else list(sheet_data)
+        if columns is not None and row_updates:
+            columns = columns.copy()
+        if columns is not None and update_investor_rows(columns, sheet_data, state.column_mapping, row_updates):
+            logger.info(f"Re-plan: updated {len(row_updates)} row(s) in place.")
+        else:
+            # First re-plan of this task, or an edit that adds/removes investor rows: parse the selection once
+            for idx, row in row_updates.items():
+                sheet_data[idx] = row
+            columns = extract_investor_columns(sheet_data, state.column_mapping)
+            log_column_summary(columns)
+
+        calculated_values = compute_plan(slots, columns)
+        ops = validate_ops(list(iter_structured_ops(slots, sheet_data, state.selected_range_address,
+                                                    state.column_mapping, calculated_values, state.output_mode)))
+        op_ids = itertools.count(1)
+        changed_ops = diff_ops(state.ops, ops, lambda: f"op-{next(op_ids)}")
+        state.slots, state.sheet_data, state.columns, state.ops = slots, sheet_data, columns, ops
+
+    logger.info(f"Re-plan: {len(changed_ops)} of {len(ops)} ops changed.")
+    return {
+        "status": "completed",
+        "ops": changed_ops,
+        "total_ops": len(ops),
+        "slots": state.slots,
+        "calculated_values": {key: calculated_values[key] for key in (
+            "post_money_valuation", "price_per_share", "total_new_shares_for_round",
+            "option_pool_shares", "total_post_money_shares")},
+        "column_mapping": state.column_mapping,
+        "mapping_source": state.mapping_source,
+    }
+
+@app.post("/plan/replan")
+async def replan_endpoint(request: ReplanRequest):
+    """Applies changed slots and/or edited rows to a finished plan and returns only the ops whose cells changed."""
+    state = plan_states.get(request.task_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="No plan state for this task ID; submit a full /plan")
+    try:
+        result = await run_in_threadpool(run_replan, state, request.slots, request.rows)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    result["task_id"] = request.task_id
+    return Response(content=dumps(result), media_type="application/json")
+
+@app.options("/plan/replan")
+async def replan_options():
+    return {"status": "ok"}
+
+@app.get("/plan/states/stats")
+async def plan_state_stats():
+    return plan_states.stats()
+
+# --- Scenario Sweep Endpoint ---
+def run_scenarios(task_id: str, request: ScenarioRequest) -> Dict[str, Any]:
+    """Resolves the column mapping once (LLM only if needed) and computes every scenario in one array pass."""
+    arrays = build_scenario_arrays(request.slots, request.scenarios, request.grid) # Validate before any LLM call
+
+    column_mapping, mapping_source, fingerprint = lookup_column_mapping(task_id, request.sheetData)
+    if column_mapping is None:
+        raw_output = generate_plan_raw_text(request.slots, request.sheetData, request.selectedRangeAddress)
+        try:
+            column_mapping = parse_column_mapping(raw_output)
+        except (ValueError, TypeError) as e:
+            raise RuntimeError(f"Failed to parse column mapping from LLM: {e}")
+
+    columns = extract_investor_columns(request.sheetData, column_mapping)
+    log_column_summary(columns)
+    if mapping_source == "llm" and len(columns):
+        column_mapping_cache.put(fingerprint, column_mapping)
+
+    body, results = summarize_scenarios(columns, arrays, request.slots, request.include_holder_ownership)
+    body["ops"] = []
+    if request.sensitivity_metric:
+        op_ids = itertools.count(1)
+        body["ops"] = validate_ops([sensitivity_table_op(request.grid, results, len(request.scenarios),
+                                                         request.sensitivity_metric, request.selectedRangeAddress,
+                                                         lambda: f"op-{next(op_ids)}", request.sensitivity_target_cell)])
+    body.update({"status": "completed", "column_mapping": column_mapping, "mapping_source": mapping_source})
+    logger.info(f"Scenarios {task_id}: {body['scenario_count']} scenarios x {len(columns)} holders computed.")
+    return body
+
+@app.post("/plan/scenarios")
+async def plan_scenarios_endpoint(request: ScenarioRequest):
+    """Computes many slot combinations for one sheet in a single request."""
+    task_id = str(uuid.uuid4())
+    try:
+        body = await run_in_threadpool(run_scenarios, task_id, request)
+    except InferencePoolBusy:
+        return busy_response()
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        logger.error(f"Scenarios {task_id} failed: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+    body["task_id"] = task_id
+    return Response(content=dumps(body), media_type="application/json")
+
+@app.options("/plan/scenarios")
+async def plan_scenarios_options():
+    return {"status": "ok"}
 
 # --- Main Execution (for development) ---
 if __name__ == "__main__":
@@ -0,0 +1,153 @@
+from collections import OrderedDict
+from itertools import islice
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+import hashlib
+import json
+import logging
+import os
+import threading
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+CACHE_DIR = Path(__file__).parent / "cache"
+MAPPING_CACHE_PATH = CACHE_DIR / "column_mappings.json"
+MAPPING_CACHE_MAX_ENTRIES = 512
+FINGERPRINT_SAMPLE_ROWS = 5  # Data rows inspected to describe the column shape
+
+_NUMERIC_STRIP = str.maketrans("", "", "$,%")
+
+
+# --- Sheet Fingerprinting ---
+def _cell_kind(value: Any) -> str:
+    """Classifies a cell as 'e'mpty, 'n'umeric or 't'ext."""
+    if value is None:
+        return "e"
+    text = str(value).strip()
+    if not text:
+        return "e"
+    try:
+        float(text.translate(_NUMERIC_STRIP))
+        return "n"
+    except ValueError:
+        return "t"
+
+
+def sheet_fingerprint(sheet_data: List[List[Any]]) -> Optional[str]:
+    """
+    Builds a stable key for a sheet layout from its normalized header row and
+    column shape (column count plus the dominant kind of each column).
+    Returns None if the sheet has no non-empty rows.
+    """
+    # Only the header and the first few data rows matter: stop scanning there
+    rows = list(islice((row for row in sheet_data if isinstance(row, list) and any(_cell_kind(c) != "e" for c in row)),
+                       1 + FINGERPRINT_SAMPLE_ROWS))
+    if not rows:
+        return None
+
+    header = [" ".join(str(c if c is not None else "").lower().split()) for c in rows[0]]
+    sample = rows[1:1 + FINGERPRINT_SAMPLE_ROWS]
+    n_cols = max(len(row) for row in rows[:1 + FINGERPRINT_SAMPLE_ROWS])
+
+    shape = []
+    for col in range(n_cols):
+        kinds = [_cell_kind(row[col]) if col < len(row) else "e" for row in sample]
+        non_empty = [k for k in kinds if k != "e"]
+        if not non_empty:
+            shape.append("e")
+        else:
+            # Majority vote; ties resolve towards text, the safer layout assumption
+            shape.append("n" if non_empty.count("n") * 2 > len(non_empty) else "t")
+
+    key_source = json.dumps({"header": header, "n_cols": n_cols, "shape": shape}, separators=(",", ":"))
+    return hashlib.sha1(key_source.encode("utf-8")).hexdigest()
+
+
+# --- LRU Cache ---
+class ColumnMappingCache:
+    """
+    Persistent LRU cache of column mappings keyed by sheet fingerprint.
+    Thread safe: plan tasks run on the threadpool.
+    """
+
+    def __init__(self, path: Optional[Path] = MAPPING_CACHE_PATH, max_entries: int = MAPPING_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._load()
+
+    def get(self, fingerprint: Optional[str]) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            if fingerprint is None or fingerprint not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(fingerprint)
+            self.hits += 1
+            return dict(self._entries[fingerprint])
+
+    def put(self, fingerprint: Optional[str], mapping: Dict[str, Any]) -> None:
+        if fingerprint is None:
+            return
+        with self._lock:
+            self._entries[fingerprint] = dict(mapping)
+            self._entries.move_to_end(fingerprint)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._save()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._save()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    # --- Persistence ---
+    def _load(self) -> None:
+        if self.path is None or not self.path.exists():
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+            # File is written least-recently-used first
+            for fingerprint, mapping in stored.get("entries", []):
+                self._entries[fingerprint] = mapping
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            logger.info(f"Loaded {len(self._entries)} cached column mappings from {self.path}")
+        except (OSError, ValueError, TypeError) as e:
+            logger.warning(f"Ignoring unreadable column mapping cache at {self.path}: {e}")
+            self._entries.clear()
+
+    def _save(self) -> None:
+        if self.path is None:
+            return
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"entries": list(self._entries.items())}, f)
+            os.replace(tmp_path, self.path)  # Atomic swap so a crash never leaves a torn file
+        except OSError as e:
+            logger.warning(f"Could not persist column mapping cache to {self.path}: {e}")
+
+
+# Shared instance used by the plan pipeline
+column_mapping_cache = ColumnMappingCache()
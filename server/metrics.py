@@ -0,0 +1,179 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+import logging
+import threading
+import time
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# Seconds; covers fast deterministic stages (sub-ms) up to slow LLM calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _label_str(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{value}"' for name, value in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt(value: float) -> str:
+    return repr(float(value)) if value not in (float("inf"), float("-inf")) else ("+Inf" if value > 0 else "-Inf")
+
+
+# --- Metric Types (Prometheus text exposition format) ---
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name, self.help, self.labelnames = name, help_text, labelnames
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_str(self.labelnames, key)} {_fmt(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name, self.help, self.labelnames = name, help_text, labelnames
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (+Inf last), sum, count]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][idx] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += n
+                    le = _label_str(self.labelnames, key, f'le="{_fmt(bound)}"')
+                    lines.append(f"{self.name}_bucket{le} {cumulative}")
+                labels = _label_str(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {_fmt(total)}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[Any] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# --- Server Metrics ---
+PLAN_STAGE_SECONDS = registry.register(Histogram(
+    "plan_stage_seconds", "Time spent in each plan pipeline stage.", ("stage",)))
+PLAN_TASKS = registry.register(Counter(
+    "plan_tasks_total", "Finished plan tasks by status and column mapping source.", ("status", "mapping_source")))
+LLM_QUEUE_WAIT_SECONDS = registry.register(Histogram(
+    "llm_queue_wait_seconds", "Time LLM jobs waited for an inference worker.", ("kind",)))
+LLM_PROMPT_EVAL_SECONDS = registry.register(Histogram(
+    "llm_prompt_eval_seconds", "Prompt evaluation time (time to first token).", ("kind",)))
+LLM_GENERATION_SECONDS = registry.register(Histogram(
+    "llm_generation_seconds", "Token generation time after the first token.", ("kind",)))
+LLM_PROMPT_TOKENS = registry.register(Counter(
+    "llm_prompt_tokens_total", "Prompt tokens sent to the LLM.", ("kind",)))
+LLM_PROMPT_TOKENS_SAVED = registry.register(Counter(
+    "llm_prompt_tokens_saved_total", "Prompt tokens served from the prefix KV cache.", ("kind",)))
+LLM_COMPLETION_TOKENS = registry.register(Counter(
+    "llm_completion_tokens_total", "Tokens generated by the LLM.", ("kind",)))
+SLOT_EXTRACTIONS = registry.register(Counter(
+    "chat_slot_extractions_total", "Chat slot extractions by source (parser or llm).", ("source",)))
+
+
+def record_llm_call(kind: str, stats: Dict[str, Any]) -> None:
+    LLM_QUEUE_WAIT_SECONDS.observe(stats["queue_wait_ms"] / 1000, kind=kind)
+    LLM_PROMPT_EVAL_SECONDS.observe(stats["prompt_eval_ms"] / 1000, kind=kind)
+    LLM_GENERATION_SECONDS.observe(stats["generation_ms"] / 1000, kind=kind)
+    LLM_PROMPT_TOKENS.inc(stats["prompt_tokens"], kind=kind)
+    LLM_PROMPT_TOKENS_SAVED.inc(stats["prompt_tokens_saved"], kind=kind)
+    LLM_COMPLETION_TOKENS.inc(stats["completion_tokens"], kind=kind)
+
+
+class StatsGauges:
+    """Exposes numeric fields of an existing stats() dict as `<prefix>_<key>` gauges, reading it once per scrape."""
+
+    def __init__(self, prefix: str, help_text: str, stats_fn: Callable[[], Dict[str, Any]], keys: Tuple[str, ...]):
+        self.prefix, self.help, self.stats_fn, self.keys = prefix, help_text, stats_fn, keys
+
+    def render(self) -> List[str]:
+        try:
+            stats = self.stats_fn()
+        except Exception as e:
+            logger.warning(f"Metrics {self.prefix}_* collection failed: {e}")
+            return []
+        lines = []
+        for key in self.keys:
+            value = stats.get(key)
+            if isinstance(value, (int, float)):
+                name = f"{self.prefix}_{key}"
+                lines += [f"# HELP {name} {self.help}: {key}.", f"# TYPE {name} gauge", f"{name} {_fmt(value)}"]
+        return lines
+
+
+# --- Per-Task Timings ---
+class TaskTimings:
+    """
+    Per-task stage timings and LLM call stats. Stages also feed the
+    plan_stage_seconds histogram; as_dict() is attached to the task result.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.llm: Optional[Dict[str, Any]] = None
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.stages[name] = self.stages.get(name, 0.0) + elapsed
+            PLAN_STAGE_SECONDS.observe(elapsed, stage=name)
+
+    def as_dict(self) -> Dict[str, Any]:
+        result = {
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 3),
+            "stages_ms": {name: round(seconds * 1000, 3) for name, seconds in self.stages.items()},
+        }
+        if self.llm is not None:
+            result["llm"] = self.llm
+        return result
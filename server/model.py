@@ -1,33 +1,60 @@
 import json
+import os
+import queue
 import re  # For finding JSON block
-from pathlib import Path
 from llama_cpp import Llama
-from typing import List, Dict, Any  # Added Dict, Any
+from typing import List, Dict, Any, Iterator, Optional  # Added Dict, Any
 import logging # Import logging
+import time
+from inference_pool import InferencePool
+from metrics import TaskTimings, record_llm_call
+from log_config import truncate_payload
+from json_grammar import JsonGrammar, column_mapping_grammar
+
+try:
+    from llama_cpp import LlamaGrammar
+except ImportError:  # llama-cpp-python builds without grammar support
+    LlamaGrammar = None
+try:
+    from llama_cpp.llama_speculative import LlamaPromptLookupDecoding
+except ImportError:
+    LlamaPromptLookupDecoding = None
+from prefix_cache import PrefixStateCache
+from sheet_encoder import encode_sheet
+from sheet_columns import ColumnarSheet
+from model_profiles import ModelProfile, resolve_profile
 
 # Get a logger for this module
 logger = logging.getLogger(__name__) 
 
 # --- Configuration ---
-MODEL_DIR = Path(__file__).parent / "models"
-# Make sure you download the model and place it here
-MODEL_PATH = MODEL_DIR / "codellama-7b-instruct.Q4_K_M.gguf"
-N_GPU_LAYERS = -1  # Offload as many layers as possible to Metal GPU
-N_CTX = 2048  # Context window size
+# Runtime profile (GGUF file, n_ctx, threads, batch, mmap/mlock): LLM_PROFILE plus LLM_* overrides.
+# Make sure you download the profile's model and place it in models/ (see model_profiles.py)
+MODEL_PROFILE = resolve_profile("LLM_")
+# Chat slot extraction can run a smaller/faster model: LLM_SLOT_PROFILE plus LLM_SLOT_* overrides.
+# Unset, it shares the plan model's workers.
+SLOT_MODEL_PROFILE = resolve_profile("LLM_SLOT_", base=MODEL_PROFILE)
+# Each worker holds its own model/context, so memory scales with this
+N_INFERENCE_WORKERS = int(os.environ.get("LLM_WORKERS", "1"))
+N_SLOT_INFERENCE_WORKERS = int(os.environ.get("LLM_SLOT_WORKERS", "1"))  # Only with a separate slot profile
+INFERENCE_QUEUE_SIZE = int(os.environ.get("LLM_QUEUE_SIZE", "8"))  # Pending jobs before 429
+# Measure prompt eval and generation tokens/sec of each profile when the workers start
+SELF_BENCHMARK_ENABLED = os.environ.get("LLM_SELF_BENCHMARK", "0") != "0"
+# Keep llama.cpp state for static prompt prefixes (costs KV memory per template per worker)
+PREFIX_CACHE_ENABLED = os.environ.get("LLM_PREFIX_CACHE", "1") != "0"
+# Constrain the JSON calls with a GBNF grammar and a schema-derived token budget
+# (LLM_GRAMMAR=0 falls back to free-form output and the repair paths below)
+GRAMMAR_ENABLED = os.environ.get("LLM_GRAMMAR", "1") != "0"
+# Speculative decoding drafted from the prompt (JSON keys and header names repeat it); 0 disables
+PROMPT_LOOKUP_TOKENS = int(os.environ.get("LLM_PROMPT_LOOKUP_TOKENS", "0"))
 
 # --- Prompt Template (Initial Version for P4/P5) ---
-# This will be refined in Phase 5
-PROMPT_TEMPLATE = """
+# The static instructions come first and the per-request sheet data last, so the
+# prefix's llama.cpp state can be cached and only the variable tail is evaluated.
+PROMPT_PREFIX = """
 [INST] You are an Excel assistant analyzing sheet data.
 
-Input Range Address: {selectedRangeAddress}
-
-Sheet Data:
-```json
-{sheet_data}
-```
-
-Task: Analyze the Sheet Data headers (if any) and content to identify the columns containing essential pre-round cap table information. Determine the 0-based column index for:
+Task: Analyze the Sheet Data headers (if any) and content given at the end of this message to identify the columns containing essential pre-round cap table information. Determine the 0-based column index for:
 - "shareholder_name_col_idx"
 - "pre_round_shares_col_idx"
 - "pre_round_investment_col_idx" (use null if not clearly identifiable)
@@ -36,17 +63,25 @@ Provide the output as a single, valid JSON object containing ONLY the "column_ma
 
 IMPORTANT RULES:
 1. Carefully analyze the Sheet Data headers and structure to determine the correct column indices.
-2. If a column isn't present or clearly identifiable, use null for its index.
-3. Return ONLY the valid JSON object below. Do not include explanations, notes, or markdown formatting like ```json.
+2. The Sheet Data is a summary: one line per column (c0, c1, ... are the 0-based column indices) with its header, type and stats, followed by sample rows.
+3. If a column isn't present or clearly identifiable, use null for its index.
+4. Return ONLY the valid JSON object below. Do not include explanations, notes, or markdown formatting like ```json.
 
 Example Output Format:
-{{
-  "column_mapping": {{
+{
+  "column_mapping": {
     "shareholder_name_col_idx": 0,
     "pre_round_shares_col_idx": 2,
     "pre_round_investment_col_idx": 1
-  }}
-}}
+  }
+}
+"""
+
+PROMPT_TEMPLATE = PROMPT_PREFIX.replace("{", "{{").replace("}", "}}") + """
+Input Range Address: {selectedRangeAddress}
+
+Sheet Data:
+{sheet_data}
 [/INST]
 """
 
@@ -56,66 +91,250 @@ MAX_TOKENS = 2048
 TEMPERATURE = 0.2
 
 # --- LLM Loading ---
-llm = None
-
-
-def get_llm():
-    global llm
-    if llm is None:
-        if not MODEL_PATH.exists():
-            raise FileNotFoundError(
-                f"Model file not found at {MODEL_PATH}. Please download the model."
-            )
-        print(f"Loading model from {MODEL_PATH}...")
-        llm = Llama(
-            model_path=str(MODEL_PATH),
-            n_ctx=N_CTX,
-            n_gpu_layers=N_GPU_LAYERS,  # Comment out or set to 0 if no GPU acceleration
-            verbose=True,  # Set to False for less output
+def load_llm(profile: ModelProfile = MODEL_PROFILE) -> Llama:
+    """Loads a fresh model instance (each inference worker owns one)."""
+    if not profile.model_path.exists():
+        raise FileNotFoundError(
+            f"Model file not found at {profile.model_path} (profile '{profile.name}'). Please download the model."
         )
-        print("Model loaded successfully.")
-    return llm
+    logger.info(f"Loading model from {profile.model_path} with profile '{profile.name}'...")
+    extra = {}
+    if PROMPT_LOOKUP_TOKENS > 0 and LlamaPromptLookupDecoding is not None:
+        extra["draft_model"] = LlamaPromptLookupDecoding(num_pred_tokens=PROMPT_LOOKUP_TOKENS)
+    instance = Llama(
+        **profile.llama_kwargs(),
+        verbose=True,  # Set to False for less output
+        **extra,
+    )
+    logger.info("Model loaded successfully.")
+    return instance
+
+
+# --- Inference Pools ---
+inference_pool = InferencePool(load_llm, n_workers=N_INFERENCE_WORKERS, max_queue=INFERENCE_QUEUE_SIZE)
+if SLOT_MODEL_PROFILE == MODEL_PROFILE:
+    slot_inference_pool = inference_pool
+else:
+    slot_inference_pool = InferencePool(lambda: load_llm(SLOT_MODEL_PROFILE), n_workers=N_SLOT_INFERENCE_WORKERS,
+                                        max_queue=INFERENCE_QUEUE_SIZE)
+
+
+def pool_for(kind: str) -> InferencePool:
+    """The worker pool that serves completions of this kind."""
+    return slot_inference_pool if kind == "slots" else inference_pool
+
+
+def active_profiles() -> Dict[str, Dict[str, Any]]:
+    """Profiles in use, by completion kind ("plan", and "slots" when it runs its own model)."""
+    profiles = {"plan": MODEL_PROFILE.as_dict()}
+    if slot_inference_pool is not inference_pool:
+        profiles["slots"] = SLOT_MODEL_PROFILE.as_dict()
+    return profiles
+
+
+_STREAM_END = object()  # Sentinel closing a streamed completion
+
+
+prefix_state_cache = PrefixStateCache()
+
+
+def _prepare_prefix(worker_llm: Llama, prefix_key: Optional[str], prefix: Optional[str], prompt: str) -> Optional[Dict[str, Any]]:
+    """Restores the cached KV state for a template prefix on this worker (runs on the worker thread)."""
+    if not PREFIX_CACHE_ENABLED or not prefix_key or not prefix or not prompt.startswith(prefix):
+        return None
+    info = prefix_state_cache.prepare(worker_llm, prefix_key, prefix, prompt)
+    logger.debug(f"Prefix cache '{prefix_key}': hit={info['prefix_hit']}, "
+                f"prompt tokens={info['prompt_tokens']}, saved={info['prompt_tokens_saved']}")
+    return info
+
+
+def _timed_completion(worker_llm: Llama, submitted: float, kind: str, prefix_key: Optional[str],
+                      prefix: Optional[str], kwargs: Dict[str, Any], on_piece=None) -> Dict[str, Any]:
+    """
+    Runs one completion on the worker thread, streaming internally so prompt
+    evaluation (time to first token) and generation can be timed separately.
+    Returns a create_completion-shaped response plus "usage" and "timings".
+    """
+    started = time.perf_counter()
+    prompt = kwargs.get("prompt", "")
+    info = _prepare_prefix(worker_llm, prefix_key, prefix, prompt)
+    kwargs = {key: value for key, value in kwargs.items() if key != "stream"}
+    if isinstance(kwargs.get("grammar"), str):
+        # Compiled per call: a LlamaGrammar carries sampling state, so workers can't share one
+        kwargs["grammar"] = LlamaGrammar.from_string(kwargs["grammar"], verbose=False)
+
+    text_pieces = []
+    finish_reason = None
+    first_token_at = None
+    for chunk in worker_llm.create_completion(stream=True, **kwargs):
+        if first_token_at is None:
+            first_token_at = time.perf_counter()
+        choice = chunk["choices"][0]
+        text_pieces.append(choice["text"])
+        finish_reason = choice.get("finish_reason") or finish_reason
+        if on_piece is not None:
+            on_piece(choice["text"])
+    finished = time.perf_counter()
+    first_token_at = first_token_at or finished
+
+    if info is not None:
+        prompt_tokens, tokens_saved = info["prompt_tokens"], info["prompt_tokens_saved"]
+    else:
+        prompt_tokens, tokens_saved = len(worker_llm.tokenize(prompt.encode("utf-8"))), 0
+    completion_tokens = len(text_pieces)  # llama.cpp streams one token per chunk
+    generation_s = finished - first_token_at
+    timings = {
+        "kind": kind,
+        "queue_wait_ms": round((started - submitted) * 1000, 3),
+        "prompt_eval_ms": round((first_token_at - started) * 1000, 3),
+        "generation_ms": round(generation_s * 1000, 3),
+        "prompt_tokens": prompt_tokens,
+        "prompt_tokens_saved": tokens_saved,
+        "completion_tokens": completion_tokens,
+        "tokens_per_second": round(completion_tokens / generation_s, 2) if generation_s > 0 else None,
+    }
+    record_llm_call(kind, timings)
+
+    response = {
+        "choices": [{"text": "".join(text_pieces), "finish_reason": finish_reason}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                  "total_tokens": prompt_tokens + completion_tokens},
+        "timings": timings,
+    }
+    if info is not None:
+        response["prefix_cache"] = info
+    return response
+
+
+def run_completion(prefix_key: Optional[str] = None, prefix: Optional[str] = None, kind: str = "completion",
+                   timings: Optional[TaskTimings] = None, **kwargs) -> Dict[str, Any]:
+    """
+    Runs create_completion on an inference worker and waits for the result.
+    Call from a worker/threadpool thread, never directly on the event loop.
+    Raises InferencePoolBusy when the queue is full.
+    When `prefix` (the static start of the prompt) is given, its cached state is reused
+    and the response carries a "prefix_cache" entry with the tokens saved.
+    Queue wait, prompt eval and generation times are recorded under `kind` and,
+    when `timings` is given, attached to it.
+    """
+    submitted = time.perf_counter()
+    response = pool_for(kind).run(lambda worker_llm: _timed_completion(
+        worker_llm, submitted, kind, prefix_key, prefix, kwargs))
+    if timings is not None:
+        timings.llm = response["timings"]
+    return response
+
+
+def stream_completion(prefix_key: Optional[str] = None, prefix: Optional[str] = None, kind: str = "completion",
+                      timings: Optional[TaskTimings] = None, **kwargs) -> Iterator[str]:
+    """
+    Streams create_completion(stream=True) text pieces from an inference worker.
+    The worker pushes pieces through a queue so the caller can consume them on its own thread.
+    """
+    pieces: "queue.Queue" = queue.Queue()
+    submitted = time.perf_counter()
+
+    def job(worker_llm):
+        return _timed_completion(worker_llm, submitted, kind, prefix_key, prefix, kwargs, on_piece=pieces.put)
+
+    future = pool_for(kind).submit(job)
+    # Fires on success and on failure (including model load errors before the job runs)
+    future.add_done_callback(lambda _: pieces.put(_STREAM_END))
+    while True:
+        piece = pieces.get()
+        if piece is _STREAM_END:
+            break
+        yield piece
+    response = future.result()  # Re-raise any worker error
+    if timings is not None:
+        timings.llm = response["timings"]
+
+
+# --- Startup Self-Benchmark ---
+SELF_BENCHMARK_PROMPT = "[INST] Count from 1 to 200, separated by commas. [/INST]"
+SELF_BENCHMARK_TOKENS = 64
+self_benchmark_results: Dict[str, Dict[str, Any]] = {}
+
+
+def run_self_benchmarks() -> Dict[str, Dict[str, Any]]:
+    """
+    Times one fixed completion on each active profile's workers and records
+    prompt eval and generation tokens/sec. Call from a threadpool thread.
+    """
+    pools = {"plan": (inference_pool, MODEL_PROFILE)}
+    if slot_inference_pool is not inference_pool:
+        pools["slots"] = (slot_inference_pool, SLOT_MODEL_PROFILE)
+    for kind, (pool, profile) in pools.items():
+        submitted = time.perf_counter()
+        response = pool.run(lambda worker_llm: _timed_completion(
+            worker_llm, submitted, "self_benchmark", None, None,
+            {"prompt": SELF_BENCHMARK_PROMPT, "max_tokens": SELF_BENCHMARK_TOKENS, "temperature": 0.0}))
+        timings = response["timings"]
+        prompt_s = timings["prompt_eval_ms"] / 1000
+        result = {
+            "profile": profile.name,
+            "prompt_tokens": timings["prompt_tokens"],
+            "prompt_tokens_per_second": round(timings["prompt_tokens"] / prompt_s, 2) if prompt_s > 0 else None,
+            "completion_tokens": timings["completion_tokens"],
+            "generation_tokens_per_second": timings["tokens_per_second"],
+        }
+        self_benchmark_results[kind] = result
+        logger.info(f"Self-benchmark '{profile.name}' ({kind}): prompt {result['prompt_tokens_per_second']} tok/s, "
+                    f"generation {result['generation_tokens_per_second']} tok/s")
+    return self_benchmark_results
 
 
 # --- Inference Function (P4 - Raw Text Output) ---
-def generate_plan_raw_text(slots: Dict[str, Any], sheet_data: List[List[str]], selectedRangeAddress: str) -> str:
-    client = get_llm()
-
-    # Simple JSON conversion for the sheet data
-    MAX_SHEET_CHARS = 1500  # Increased slightly
-    sheet_json = json.dumps(sheet_data)
-    if len(sheet_json) > MAX_SHEET_CHARS:
-        print(
-            f"Warning: Sheet data truncated from {len(sheet_json)} to {MAX_SHEET_CHARS} characters."
-        )
-        sheet_json = sheet_json[:MAX_SHEET_CHARS] + "..."
+def build_plan_prompt(slots: Dict[str, Any], sheet_data: List[List[str]], selectedRangeAddress: str) -> str:
+    # Header, column profiles and sample rows, bounded by a token budget
+    sheet_summary = encode_sheet(sheet_data)
 
     slots_json = json.dumps(slots)
 
     # Pass address to the prompt format
-    full_prompt = PROMPT_TEMPLATE.format(
-        sheet_data=sheet_json, 
+    return PROMPT_TEMPLATE.format(
+        sheet_data=sheet_summary, 
         slots=slots_json, 
         selectedRangeAddress=selectedRangeAddress # Address is for context, not direct use by LLM now
     )
 
-    # DEBUG: Log the full prompt using INFO level for visibility
-    # print(f"Full prompt being sent to LLM:\n{full_prompt}")
 
-    print("\n--- Sending Calculation Prompt to LLM ---") # Updated log message
-
-    response = client.create_completion(
-        prompt=full_prompt,
-        max_tokens=MAX_TOKENS,
-        temperature=TEMPERATURE,
-        stop=[
-            "```",
-            "[/INST]",
-        ],
-        echo=False,
-    )
+# Shared generation settings for the column mapping call
+PLAN_COMPLETION_KWARGS = {
+    "max_tokens": MAX_TOKENS,
+    "temperature": TEMPERATURE,
+    "stop": [
+        "```",
+        "[/INST]",
+    ],
+    "echo": False,
+}
+
+
+def grammar_constrained() -> bool:
+    """Whether the JSON calls sample under a grammar: LLM_GRAMMAR isn't "0" and llama-cpp supports it."""
+    return GRAMMAR_ENABLED and LlamaGrammar is not None
+
+
+def constrained_kwargs(base: Dict[str, Any], grammar: JsonGrammar) -> Dict[str, Any]:
+    """Adds the grammar and its token budget to completion kwargs when grammar sampling is available."""
+    if not grammar_constrained():
+        return base
+    return {**base, "grammar": grammar.gbnf, "max_tokens": grammar.max_tokens}
+
 
-    raw_output = response["choices"][0]["text"].strip()
+def plan_completion_kwargs(sheet_data: List[List[str]]) -> Dict[str, Any]:
+    # Column indices in the grammar are limited to the selection's width
+    if isinstance(sheet_data, ColumnarSheet):
+        n_cols = sheet_data.n_cols  # Every row has every column; don't render rows to count them
+    else:
+        n_cols = max((len(row) for row in sheet_data if isinstance(row, list)), default=0)
+    return constrained_kwargs(PLAN_COMPLETION_KWARGS, column_mapping_grammar(n_cols))
+
+
+def finalize_plan_output(raw_output: str) -> str:
+    """Trims/closes the raw completion text so it ends with a JSON object."""
+    raw_output = raw_output.strip()
     
     # Keep the existing logic that tries to ensure it ends with '}' just in case
     if not raw_output.endswith("}"):
@@ -141,22 +360,88 @@ def generate_plan_raw_text(slots: Dict[str, Any], sheet_data: List[List[str]], s
             raw_output = "{}"
 
 
-    print(f"\n--- LLM Raw Calculation Output ---\n{raw_output}\n----------------------\n") # Updated log message
+    logger.debug(f"LLM raw column mapping output: {truncate_payload(raw_output)}")
     return raw_output
 
 
+def generate_plan_raw_text(slots: Dict[str, Any], sheet_data: List[List[str]], selectedRangeAddress: str,
+                           timings: Optional[TaskTimings] = None) -> str:
+    timings = timings or TaskTimings()
+    with timings.stage("prompt_build"):
+        full_prompt = build_plan_prompt(slots, sheet_data, selectedRangeAddress)
+
+    # DEBUG: Log the full prompt using INFO level for visibility
+    # print(f"Full prompt being sent to LLM:\n{full_prompt}")
+
+    logger.debug("Sending column mapping prompt to LLM")
+
+    with timings.stage("llm"):
+        response = run_completion(prompt=full_prompt, prefix_key="plan", prefix=PROMPT_PREFIX, kind="plan",
+                                  timings=timings, **plan_completion_kwargs(sheet_data))
+    return finalize_plan_output(response["choices"][0]["text"])
+
+
+def stream_plan_raw_text(slots: Dict[str, Any], sheet_data: List[List[str]], selectedRangeAddress: str,
+                         timings: Optional[TaskTimings] = None) -> Iterator[str]:
+    """Streaming variant of generate_plan_raw_text: yields raw text pieces as they are generated."""
+    timings = timings or TaskTimings()
+    with timings.stage("prompt_build"):
+        full_prompt = build_plan_prompt(slots, sheet_data, selectedRangeAddress)
+    logger.debug("Streaming column mapping prompt to LLM")
+    with timings.stage("llm"):
+        yield from stream_completion(prompt=full_prompt, prefix_key="plan", prefix=PROMPT_PREFIX, kind="plan",
+                                     timings=timings, **plan_completion_kwargs(sheet_data))
+
+
 # --- Phase 5: JSON Parsing (Update to parse only column mapping) ---
 # Rename function
-def parse_column_mapping(raw_text: str) -> Dict[str, Any]:
+def parse_column_mapping(raw_text: str, free_form: Optional[bool] = None) -> Dict[str, Any]:
     """
     Parses the JSON object containing column mapping from the LLM.
-    Attempts to fix common JSON formatting issues and find the JSON block.
+    Grammar-constrained output must parse as is; invalid JSON there is an error.
+    Only free-form output (LLM_GRAMMAR=0, or `free_form=True`) goes through the
+    repair paths: finding the JSON block and fixing common formatting issues.
     """
+    if free_form is None:
+        free_form = not grammar_constrained()
+    json_str = _repair_json_block(raw_text) if free_form else raw_text
+
+    try:
+        # Attempt to load the (possibly repaired) JSON object
+        parsed_data = json.loads(json_str)
+        if not isinstance(parsed_data, dict):
+            raise TypeError("Parsed JSON is not a dictionary.")
+
+        # Validate structure
+        if "column_mapping" not in parsed_data or not isinstance(parsed_data["column_mapping"], dict):
+            logger.error(f"LLM did not return expected 'column_mapping' dictionary: {parsed_data}")
+            raise ValueError("LLM output missing or invalid 'column_mapping' key/structure.")
+            
+        mapping = parsed_data["column_mapping"]
+
+        logger.debug(f"Successfully parsed LLM column mapping: {mapping}")
+        return mapping # Return only the inner mapping dict
+        
+    except json.JSONDecodeError as e:
+        if not free_form:
+            logger.error(f"Grammar-constrained column mapping is not valid JSON: {e}; "
+                         f"output: {truncate_payload(json_str)}")
+            raise ValueError(f"Grammar-constrained LLM output was not valid JSON: {e}")
+        logger.error(f"Failed to decode JSON column mapping from extracted block: {e}; "
+                     f"attempted: {truncate_payload(json_str)}")
+        raise ValueError(f"LLM output block contained invalid JSON after fixing attempts: {e}")
+    except TypeError as e:
+        logger.error(f"Parsed JSON logic error: {e}")
+        raise ValueError(f"LLM did not return a valid JSON dictionary for column mapping: {e}")
+
+
+def _repair_json_block(raw_text: str) -> str:
+    """Extracts the JSON object from free-form output and fixes common formatting issues."""
     def fix_json_string(json_str: str) -> str:
         # Basic JSON string cleaning
         json_str = json_str.strip()
         # Ensure proper string quotes (basic)
-        json_str = re.sub(r"'(.*?)'", r'""', json_str)
+        json_str = re.sub(r"'(.*?)'", r'""', json_str)
         # Remove any trailing commas before closing brackets/braces
         json_str = re.sub(r',(\s*[}\]])', r'\1', json_str)
         return json_str
@@ -166,47 +451,16 @@ def parse_column_mapping(raw_text: str) -> Dict[str, Any]:
     end_index = raw_text.rfind('}')
 
     if start_index == -1 or end_index == -1 or end_index < start_index:
-        logger.error(f"Could not find JSON block starting with {{ and ending with }} in LLM output: {raw_text}")
+        logger.error(f"Could not find JSON block starting with {{ and ending with }} in LLM output: {truncate_payload(raw_text)}")
         raise ValueError("Could not find JSON object block in LLM output.")
         
     # Extract the potential JSON string
     json_str = raw_text[start_index : end_index + 1]
-    logger.info(f"Extracted potential JSON block: {json_str}")
+    logger.debug(f"Extracted potential JSON block: {truncate_payload(json_str)}")
     # -------------------------
 
     # Fix common JSON formatting issues AFTER extraction
-    json_str = fix_json_string(json_str)
-
-    try:
-        # Attempt to load the potentially fixed JSON object
-        parsed_data = json.loads(json_str)
-        if not isinstance(parsed_data, dict):
-            raise TypeError("Parsed JSON is not a dictionary.")
-
-        # Validate structure
-        if "column_mapping" not in parsed_data or not isinstance(parsed_data["column_mapping"], dict):
-            logger.error(f"LLM did not return expected 'column_mapping' dictionary: {parsed_data}")
-            raise ValueError("LLM output missing or invalid 'column_mapping' key/structure.")
-            
-        mapping = parsed_data["column_mapping"]
-        map_keys = ["shareholder_name_col_idx", "pre_round_shares_col_idx", "pre_round_investment_col_idx"]
-        # Check if *all* expected keys are present (optional, depending on strictness)
-        # if not all(key in mapping for key in map_keys):
-        #      logger.warning(f"LLM output missing some expected column_mapping keys: {mapping}")
-             # Allow partial results for now
-
-        print(f"Successfully parsed LLM column mapping: {mapping}")
-        return mapping # Return only the inner mapping dict
-        
-    except json.JSONDecodeError as e:
-        print(f"ERROR: Failed to decode JSON column mapping from extracted block: {e}")
-        print("--- Faulty JSON String Attempted ---:")
-        print(json_str)
-        print("-----------------------------------")
-        raise ValueError(f"LLM output block contained invalid JSON after fixing attempts: {e}")
-    except TypeError as e:
-        print(f"ERROR: Parsed JSON logic error: {e}")
-        raise ValueError(f"LLM did not return a valid JSON dictionary for column mapping: {e}")
+    return fix_json_string(json_str)
 
 
 # TODO P5: Add function to parse raw_output into ActionOp list
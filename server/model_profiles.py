@@ -0,0 +1,123 @@
+from dataclasses import asdict, dataclass, fields, replace
+from pathlib import Path
+from typing import Any, Dict, Optional
+import json
+import logging
+import os
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+MODEL_DIR = Path(__file__).parent / "models"
+DEFAULT_MODEL_FILE = "codellama-7b-instruct.Q4_K_M.gguf"
+# Optional JSON file of extra/overriding profiles: {"name": {"n_ctx": 4096, ...}, ...}
+PROFILES_FILE = os.environ.get("LLM_PROFILES_FILE")
+
+
+def _physical_cores() -> int:
+    # llama.cpp runs best on physical cores; assume 2-way SMT when we can't tell
+    return max(1, (os.cpu_count() or 2) // 2)
+
+
+@dataclass(frozen=True)
+class ModelProfile:
+    """llama.cpp runtime settings plus the GGUF file to load (relative to models/ or absolute)."""
+    name: str
+    model_file: str = DEFAULT_MODEL_FILE
+    n_ctx: int = 2048
+    n_gpu_layers: int = -1  # -1 offloads every layer (Metal/CUDA), 0 is CPU only
+    n_threads: Optional[int] = None  # None lets llama.cpp pick
+    n_batch: int = 512  # Prompt tokens evaluated per batch
+    use_mmap: bool = True
+    use_mlock: bool = False  # Pin the weights in RAM (needs a high enough memlock ulimit)
+
+    @property
+    def model_path(self) -> Path:
+        path = Path(self.model_file)
+        return path if path.is_absolute() else MODEL_DIR / path
+
+    def llama_kwargs(self) -> Dict[str, Any]:
+        """Keyword arguments for llama_cpp.Llama."""
+        kwargs = {
+            "model_path": str(self.model_path),
+            "n_ctx": self.n_ctx,
+            "n_gpu_layers": self.n_gpu_layers,
+            "n_batch": self.n_batch,
+            "use_mmap": self.use_mmap,
+            "use_mlock": self.use_mlock,
+        }
+        if self.n_threads is not None:
+            kwargs["n_threads"] = self.n_threads
+            kwargs["n_threads_batch"] = self.n_threads
+        return kwargs
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {**asdict(self), "model_path": str(self.model_path)}
+
+
+# --- Built-in Profiles ---
+PROFILES: Dict[str, ModelProfile] = {
+    # Apple Silicon dev machines: everything on the Metal GPU
+    "default": ModelProfile("default"),
+    # CPU-only Linux hosts: no offload, one thread per physical core, bigger prompt batches
+    "cpu": ModelProfile("cpu", n_gpu_layers=0, n_threads=_physical_cores(), n_batch=1024),
+    # Q4_0 has the fastest CPU matmul kernels, at a small quality cost versus Q4_K_M
+    "cpu-q4_0": ModelProfile("cpu-q4_0", model_file="codellama-7b-instruct.Q4_0.gguf", n_gpu_layers=0,
+                             n_threads=_physical_cores(), n_batch=1024),
+    # Chat slot prompts are short: a smaller context frees KV memory for more workers
+    "cpu-slots": ModelProfile("cpu-slots", n_ctx=1024, n_gpu_layers=0, n_threads=_physical_cores(), n_batch=512),
+}
+
+
+def _load_profiles_file(path: Optional[str]) -> Dict[str, ModelProfile]:
+    if not path:
+        return {}
+    try:
+        raw = json.loads(Path(path).read_text(encoding="utf-8"))
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not read model profiles from {path}: {e}")
+        return {}
+    known = {f.name for f in fields(ModelProfile)}
+    profiles = {}
+    for name, settings in raw.items():
+        unknown = set(settings) - known
+        if unknown:
+            logger.warning(f"Ignoring unknown settings {sorted(unknown)} in model profile '{name}'")
+        base = PROFILES.get(name, ModelProfile(name))
+        profiles[name] = replace(base, **{k: v for k, v in settings.items() if k in known and k != "name"})
+    return profiles
+
+
+PROFILES.update(_load_profiles_file(PROFILES_FILE))
+
+# Per-setting environment overrides, applied on top of the selected profile
+_ENV_OVERRIDES = {
+    "MODEL_PATH": ("model_file", str),
+    "N_CTX": ("n_ctx", int),
+    "N_GPU_LAYERS": ("n_gpu_layers", int),
+    "N_THREADS": ("n_threads", int),
+    "N_BATCH": ("n_batch", int),
+    "MMAP": ("use_mmap", lambda v: v != "0"),
+    "MLOCK": ("use_mlock", lambda v: v != "0"),
+}
+
+
+def resolve_profile(env_prefix: str = "LLM_", base: Optional[ModelProfile] = None) -> ModelProfile:
+    """
+    Picks the profile named by <env_prefix>PROFILE (LLM_PROFILE, LLM_SLOT_PROFILE),
+    or `base` (else "default") when unset, then applies the <env_prefix>N_CTX,
+    <env_prefix>MODEL_PATH, ... overrides.
+    """
+    fallback = base or PROFILES["default"]
+    name = os.environ.get(f"{env_prefix}PROFILE")
+    profile = fallback if name is None else PROFILES.get(name)
+    if profile is None:
+        logger.warning(f"Unknown model profile '{name}', using '{fallback.name}'. Known: {', '.join(PROFILES)}")
+        profile = fallback
+    overrides = {}
+    for suffix, (field_name, convert) in _ENV_OVERRIDES.items():
+        value = os.environ.get(f"{env_prefix}{suffix}")
+        if value is not None:
+            overrides[field_name] = convert(value)
+    return replace(profile, **overrides) if overrides else profile
@@ -0,0 +1,58 @@
+from typing import Any, Dict, List
+import json
+import logging
+
+try:
+    import orjson
+except ImportError:  # Fall back to the stdlib encoder
+    orjson = None
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
+
+# --- ActionOp Schema (mirrors main.ActionOp) ---
+OP_FIELDS = ("id", "range", "type", "values", "formula", "note")
+
+
+# --- JSON ---
+def dumps(obj: Any) -> bytes:
+    """Encodes to compact UTF-8 JSON bytes (orjson when installed)."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, separators=(",", ":"), default=_json_default).encode("utf-8")
+
+
+def _json_default(obj: Any) -> Any:
+    if hasattr(obj, "tolist"):  # NumPy arrays and scalars
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def loads(data: Any) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+# --- Bulk Validation ---
+def validate_ops(ops: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Validates a whole op list in one pass, with the same rules as the ActionOp
+    model, and returns plain dicts shaped like ActionOp.dict() (every field
+    present, None when unset). Raises ValueError naming the first bad op.
+    """
+    validated = []
+    for i, op in enumerate(ops):
+        if not isinstance(op, dict):
+            raise ValueError(f"op {i}: expected an object, got {type(op).__name__}")
+        for key in ("id", "range", "type"):
+            if not isinstance(op.get(key), str):
+                raise ValueError(f"op {i}: '{key}' must be a string")
+        values = op.get("values")
+        if values is not None and (not isinstance(values, list) or not all(isinstance(row, list) for row in values)):
+            raise ValueError(f"op {i} ({op['id']}): 'values' must be a 2D list")
+        for key in ("formula", "note"):
+            if op.get(key) is not None and not isinstance(op[key], str):
+                raise ValueError(f"op {i} ({op['id']}): '{key}' must be a string")
+        validated.append({key: op.get(key) for key in OP_FIELDS})
+    return validated
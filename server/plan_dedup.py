@@ -0,0 +1,130 @@
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from op_codec import dumps
+from result_store import ResultStore
+from sheet_columns import ColumnarSheet
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+PLAN_DEDUP_ENABLED = os.environ.get("PLAN_DEDUP", "1") != "0"
+# Completed plans are served again for identical requests within this window
+PLAN_RESULT_CACHE_TTL_SECONDS = float(os.environ.get("PLAN_RESULT_CACHE_TTL", "300"))
+PLAN_RESULT_CACHE_MAX_ENTRIES = 1000  # Entries only point at results in the task result store
+
+
+def plan_request_key(slots: Dict[str, Any], sheet_data: List[List[Any]], selected_range_address: str,
+                     output_mode: str) -> str:
+    """Content hash of a /plan request: identical slots, sheet, selection and output mode give the same key."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(json.dumps(slots, sort_keys=True, default=str).encode("utf-8"))
+    digest.update(b"\x00")
+    digest.update(selected_range_address.encode("utf-8"))
+    digest.update(b"\x00")
+    digest.update(output_mode.encode("utf-8"))
+    digest.update(b"\x00")
+    # Columnar uploads are keyed by their decoded body, so they never match a JSON request of the same sheet
+    digest.update(sheet_data.digest if isinstance(sheet_data, ColumnarSheet) else dumps(sheet_data))
+    return digest.hexdigest()
+
+
+class PlanDeduplicator:
+    """
+    Single-flight registry for plan tasks plus an index of their completed
+    results, both keyed by plan_request_key(). The results themselves stay in
+    the task result store (encoded once); the index only maps a key to the task
+    that produced it. Thread safe: tasks finish on the threadpool.
+    """
+
+    def __init__(self, result_store: ResultStore, max_entries: int = PLAN_RESULT_CACHE_MAX_ENTRIES,
+                 ttl_seconds: float = PLAN_RESULT_CACHE_TTL_SECONDS):
+        self.result_store = result_store
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.inflight_hits = 0
+        self.cache_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._inflight: Dict[str, str] = {}  # key -> task_id
+        # key -> (expires_at, completed task_id); oldest first
+        self._results: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str, task_id: str) -> Tuple[str, Any]:
+        """
+        Returns ("inflight", existing task_id) when an identical plan is running,
+        ("cached", (source task_id, encoded task result)) when one finished recently
+        and its result is still in the store, or ("new", task_id) after registering
+        `task_id` as the in-flight task for `key`.
+        """
+        with self._lock:
+            existing = self._inflight.get(key)
+            if existing is not None:
+                self.inflight_hits += 1
+                return "inflight", existing
+            entry = self._results.get(key)
+            if entry is not None:
+                encoded = self._stored_result(entry)
+                if encoded is not None:
+                    self._results.move_to_end(key)
+                    self.cache_hits += 1
+                    return "cached", (entry[1], encoded)
+                del self._results[key]
+                self.evictions += 1
+            self._inflight[key] = task_id
+            self.misses += 1
+            return "new", task_id
+
+    def _stored_result(self, entry: Tuple[float, str]) -> Optional[bytes]:
+        if entry[0] <= time.monotonic():
+            return None
+        # Without marking it delivered: the task's own poller still has to fetch it
+        return self.result_store.peek_encoded(entry[1])
+
+    def complete(self, key: str, task_id: str) -> None:
+        """Ends the in-flight task, whose completed result is in the result store, and indexes it."""
+        with self._lock:
+            if self._inflight.get(key) == task_id:
+                del self._inflight[key]
+            if self.ttl_seconds <= 0:
+                return
+            self._results.pop(key, None)
+            self._results[key] = (time.monotonic() + self.ttl_seconds, task_id)
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+                self.evictions += 1
+
+    def release(self, key: str, task_id: str) -> None:
+        """Ends the in-flight task without caching (failed or rejected)."""
+        with self._lock:
+            if self._inflight.get(key) == task_id:
+                del self._inflight[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._inflight.clear()
+            self._results.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.inflight_hits + self.cache_hits + self.misses
+            return {
+                "enabled": PLAN_DEDUP_ENABLED,
+                "inflight": len(self._inflight),
+                "cached_results": len(self._results),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "inflight_hits": self.inflight_hits,
+                "cache_hits": self.cache_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.inflight_hits + self.cache_hits) / total, 3) if total else 0.0,
+                "evictions": self.evictions,
+            }
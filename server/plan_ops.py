@@ -0,0 +1,289 @@
+from typing import Dict, Iterator, List, Optional
+import logging
+import os
+import re
+
+from cap_table import CAP_TABLE_PRECISION, InvestorColumns, extract_investor_columns, compute_round, log_column_summary
+from sheet_address import col_to_num, num_to_col
+from waterfall import compute_waterfall, events_from_slots, uses_waterfall
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
+
+# --- Helper function for deterministic calculations (Implement this) ---
+def perform_cap_table_calculations(slots: Dict, sheetData: List[List[str]], column_mapping: Dict) -> Dict:
+    """Performs cap table calculations based on slots and parsed sheet data."""
+    try:
+        logger.debug("Starting calculations...")
+        logger.debug(f"Using column mapping: Name={column_mapping.get('shareholder_name_col_idx', 0)}, "
+                    f"Shares={column_mapping.get('pre_round_shares_col_idx')}, "
+                    f"Investment={column_mapping.get('pre_round_investment_col_idx')}")
+
+        # 1. Parse the mapped columns into typed arrays in one pass
+        columns = extract_investor_columns(sheetData, column_mapping)
+        log_column_summary(columns)
+
+        # 2-4. Round values, option pool and ownership as array operations
+        calcs = compute_plan(slots, columns)
+
+        logger.debug("Calculations finished successfully.")
+
+    except Exception as e:
+        logger.error(f"Error during deterministic calculations: {e}", exc_info=True)
+        # Return empty or partial dictionary on error?
+        return {} # Return empty for now
+        
+    return calcs
+
+def compute_plan(slots: Dict, columns: InvestorColumns) -> Dict:
+    """
+    compute_round for one post-money round, else the financing-event waterfall the slots
+    describe. The waterfall is float-only: its plans report "precision": "float" even
+    when CAP_TABLE_PRECISION is "exact".
+    """
+    if uses_waterfall(slots):
+        if CAP_TABLE_PRECISION == "exact":
+            logger.warning("SAFEs, notes and pre-money pools are computed in float precision, not exact.")
+        return compute_waterfall(events_from_slots(slots), columns)
+    return compute_round(slots, columns)
+
+# --- Helper function to build ops (yields ops so they can be streamed) ---
+OPS_MAX_ROWS_PER_WRITE = 2000  # Cap table rows per write op
+# One SUM per totals column by default; PLAN_SPILL_TOTALS=1 writes them as one spilled
+# BYCOL formula instead (Excel 365 only, #NAME? in Excel 2016/2019)
+SPILL_TOTALS = os.environ.get("PLAN_SPILL_TOTALS", "0") == "1"
+# Plan output starts two columns right of the selection and is at most this wide (the
+# waterfall's Rounds block; the cap table is 4). Other outputs go to the right of it
+PLAN_OUTPUT_COLUMNS = 7
+# "values" writes computed numbers; "formulas" writes a live model (slot input cells,
+# formulas over the source range, one spilled array per cap table column) that Excel
+# recalculates on what-if edits without another plan request
+PLAN_OUTPUT_MODES = ("values", "formulas")
+PLAN_OUTPUT_MODE = os.environ.get("PLAN_OUTPUT_MODE", "values")  # Default; a plan request can pick its own
+
+
+def _abs(col_num: int, row: int) -> str:
+    return f"${num_to_col(col_num)}${row}"
+
+
+def _source_column(sheet_prefix: str, start_col_num: int, start_row: int, idx: Optional[int],
+                   source_rows: List[int]) -> Optional[str]:
+    """Absolute reference to the investor rows of column `idx` in the selection, None if unmapped."""
+    if idx is None or idx < 0:
+        return None
+    col = start_col_num + idx
+    return f"{sheet_prefix}{_abs(col, start_row + source_rows[0])}:{_abs(col, start_row + source_rows[1])}"
+
+def iter_structured_ops(slots: Dict, sheetData: List[List[str]], selectedRangeAddress: str, column_mapping: Dict, calculated_values: Dict,
+                        output_mode: str = PLAN_OUTPUT_MODE) -> Iterator[Dict]:
+    """Deterministically yields the ActionOps for the structured output, in apply order."""
+    op_id_counter = 1
+
+    # Get column indices (with defaults if mapping is incomplete/missing)
+    name_idx = column_mapping.get("shareholder_name_col_idx", 0) # Default to 0
+    shares_idx = column_mapping.get("pre_round_shares_col_idx", 1) # Default to 1
+    inv_idx = column_mapping.get("pre_round_investment_col_idx") # Default to None
+    logger.debug(f"Using column mapping: Name={name_idx}, Shares={shares_idx}, Investment={inv_idx}")
+
+    def get_op_id():
+        nonlocal op_id_counter
+        op_id = f"op-{op_id_counter}"
+        op_id_counter += 1
+        return op_id
+        
+    # --- 1. Parse Address & Calculate Output Start --- 
+    logger.debug(f"Parsing address: {selectedRangeAddress}")
+    # Remove sheet name if present (e.g., "Sheet1!A1:B4" -> "A1:B4")
+    address_part = selectedRangeAddress.split('!')[-1]
+    # Basic regex for A1 or A1:B4 formats
+    match = re.match(r"([A-Z]+)(\d+)(?::([A-Z]+)(\d+))?", address_part)
+    if not match:
+        raise ValueError(f"Could not parse address part: {address_part}")
+    
+    start_col_str, start_row_str, end_col_str, end_row_str = match.groups()
+    start_row = int(start_row_str)
+    end_col_str = end_col_str or start_col_str # Handle single cell selection
+    
+    end_col_num = col_to_num(end_col_str)
+    output_start_col_num = end_col_num + 2 # Start 2 columns right
+    output_start_col_letter = num_to_col(output_start_col_num)
+    output_start_row = start_row
+    current_row = output_start_row
+    
+    logger.debug(f"Input ends at col {end_col_str}({end_col_num}). Output starts at col {output_start_col_letter}({output_start_col_num}), row {output_start_row}")
+
+    # Each contiguous block is written by one rectangular op
+    def write_block(col_num, row, values, note):
+        end_col = num_to_col(col_num + len(values[0]) - 1)
+        return {"id": get_op_id(), "range": f"{num_to_col(col_num)}{row}:{end_col}{row + len(values) - 1}",
+                "type": "write", "values": values, "note": note}
+
+    # --- 2. Generate Ops for Round Inputs --- 
+    yield write_block(output_start_col_num, current_row, [
+        ["Round Inputs", None],
+        ["Round Type", str(slots.get('roundType', ''))],
+        ["Amount ($M)", slots.get('amount') / 1000000 if slots.get('amount') else None],
+        ["Pre-Money ($M)", slots.get('preMoney') / 1000000 if slots.get('preMoney') else None],
+        ["Pool Pct (%)", slots.get('poolPct')],
+    ], "Round Inputs")
+    current_row += 6 # 5 rows, then skip a row
+
+    # --- 3. Generate Ops for Calculations --- 
+    # The formula model needs the investors to be one contiguous run of source rows
+    source_rows = calculated_values.get("source_rows")
+    rounds = calculated_values.get("rounds")
+    use_formulas = output_mode == "formulas" and bool(source_rows) and not rounds
+    if output_mode == "formulas" and rounds:
+        logger.warning("The formula model covers a single round, writing values for the financing events.")
+    elif output_mode == "formulas" and not use_formulas:
+        logger.warning("Investor rows are not contiguous in the selection, writing values instead of formulas.")
+
+    if use_formulas:
+        value_col = output_start_col_num + 1
+        inputs_row = output_start_row  # Round Inputs block: amount, pre-money, pool % on rows +2..+4
+        amount, pre_money, pool = (_abs(value_col, inputs_row + offset) for offset in (2, 3, 4))
+        sheet_prefix = selectedRangeAddress.split('!')[0] + "!" if "!" in selectedRangeAddress else ""
+        source = {key: _source_column(sheet_prefix, col_to_num(start_col_str), start_row, column_mapping.get(key), source_rows)
+                  for key in ("shareholder_name_col_idx", "pre_round_shares_col_idx", "pre_round_investment_col_idx")}
+        shares_source = source["pre_round_shares_col_idx"]
+        pre_total = f"SUM({shares_source})" if shares_source else "0"
+        pps, new_shares, pool_shares, total_shares = (_abs(value_col, current_row + offset) for offset in (2, 3, 4, 5))
+        yield write_block(output_start_col_num, current_row, [
+            ["Calculations", None],
+            ["Post-Money ($M)", None],
+            ["Price per Share", None],
+            ["New Shares", None],
+            ["Option Pool Shares", None],
+            ["Total Post-Money Shares", None],
+        ], "Calculations")
+        for offset, formula, note in (
+            (1, f"={pre_money}+{amount}", "Post-Money Formula"),
+            (2, f"=IF({pre_total}>0,{pre_money}*1000000/{pre_total},0)", "Price per Share Formula"),
+            (3, f"=IF({pps}>0,{amount}*1000000/{pps},0)", "New Shares Formula"),
+            (4, f"=IF(AND({pool}>0,{pool}<100),({pre_total}+{new_shares})/(1-{pool}/100)-({pre_total}+{new_shares}),0)",
+             "Option Pool Formula"),
+            (5, f"={pre_total}+{new_shares}+{pool_shares}", "Total Shares Formula"),
+        ):
+            yield {"id": get_op_id(), "range": f"{num_to_col(value_col)}{current_row + offset}", "type": "formula",
+                   "formula": formula, "note": note}
+        current_row += 7 # 6 rows, then skip a row
+    else:
+        pmv = calculated_values.get("post_money_valuation")
+        pmv_m = pmv / 1000000 if pmv else None
+        pps = calculated_values.get("price_per_share")
+        yield write_block(output_start_col_num, current_row, [
+            ["Calculations", None],
+            ["Post-Money ($M)", pmv_m],
+            ["Price per Share", pps],
+        ], "Calculations")
+        current_row += 4 # 3 rows, then skip a row
+
+        if rounds:
+            # One row per priced round of the waterfall, conversions included in its shares
+            yield write_block(output_start_col_num, current_row, [
+                ["Round", "Amount ($M)", "Pre-Money ($M)", "Price per Share", "New Shares", "Conversion Shares", "Pool Increase"],
+            ] + [
+                [r["roundType"], r["amount"] / 1000000, r["pre_money_valuation"] / 1000000, r["price_per_share"],
+                 r["new_shares"], r["conversion_shares"], r["pool_increase"]]
+                for r in rounds
+            ], "Rounds")
+            current_row += len(rounds) + 2 # Header and rounds, then skip a row
+    
+    # --- 4. Generate Ops for Cap Table Headers --- 
+    cap_table_start_row = current_row
+    header_col1 = output_start_col_letter
+    header_col2 = num_to_col(output_start_col_num + 1)
+    header_col4 = num_to_col(output_start_col_num + 3)
+    
+    yield write_block(output_start_col_num, current_row, [
+        ["Post-Money Cap Table", None, None, None],
+        ["Shareholder", "Investment ($)", "Shares", "% Ownership"],
+    ], "Header")
+    current_row += 2
+
+    # --- 5. Generate Ops for Cap Table Data --- 
+    share_counts = calculated_values.get("final_share_counts", {})
+    ownership_pct = calculated_values.get("final_ownership_pct", {})
+    # Get parsed investors list (which contains pre-round info needed)
+    parsed_investors = calculated_values.get("parsed_investors", []) 
+
+    if use_formulas:
+        # One spilled array per column over the source rows, then New Investors and Option Pool
+        n_holders = source_rows[1] - source_rows[0] + 1
+        zeros = f"=SEQUENCE({n_holders},1,0,0)"
+        shares_col = num_to_col(output_start_col_num + 2)
+        shares_cell = f"{shares_col}{current_row}"
+        investment_source = source["pre_round_investment_col_idx"]
+        for col_num, formula, note in (
+            (output_start_col_num, f"={source['shareholder_name_col_idx']}&\"\"", "Shareholder Names"),
+            (output_start_col_num + 1,
+             f"=IF(ISNUMBER({investment_source}),{investment_source},0)" if investment_source else zeros, "Investments"),
+            (output_start_col_num + 2,
+             f"=IF(ISNUMBER({shares_source}),{shares_source},0)" if shares_source else zeros, "Pre-Round Shares"),
+            (output_start_col_num + 3, f"={shares_cell}#/{total_shares}", "Ownership"),
+        ):
+            yield {"id": get_op_id(), "range": f"{num_to_col(col_num)}{current_row}", "type": "formula",
+                   "formula": formula, "note": note}
+        current_row += n_holders
+
+        for label, investment, shares, note in (("New Investors", f"={amount}*1000000", f"={new_shares}", "New Investors"),
+                                                ("Option Pool", None, f"={pool_shares}", "Option Pool")):
+            yield write_block(output_start_col_num, current_row, [[label]], note)
+            for col_num, formula in ((output_start_col_num + 1, investment), (output_start_col_num + 2, shares),
+                                     (output_start_col_num + 3, f"={shares_col}{current_row}/{total_shares}")):
+                if formula is not None:
+                    yield {"id": get_op_id(), "range": f"{num_to_col(col_num)}{current_row}", "type": "formula",
+                           "formula": formula, "note": f"{note} Formula"}
+            current_row += 1
+    else:
+        # One row per existing investor (pre-round investment parsed from sheet), then
+        # New Investors (amount from slots) and the Option Pool (no investment)
+        body = [
+            [inv["name"], inv["investment"], share_counts.get(inv["name"]), ownership_pct.get(inv["name"])]
+            for inv in parsed_investors
+        ]
+        if "added_holders" in calculated_values:
+            # Waterfall: converted SAFEs/notes and each round's investors, then the pool
+            body.extend([holder["name"], holder["investment"], holder["shares"], holder["ownership"]]
+                        for holder in calculated_values["added_holders"])
+        else:
+            body.append(["New Investors", float(slots.get('amount', 0)),
+                         share_counts.get("New Investors"), ownership_pct.get("New Investors")])
+            body.append(["Option Pool", None, share_counts.get("Option Pool"), ownership_pct.get("Option Pool")])
+
+        # Split very long tables so each op stays well under the add-in's request payload limit
+        for offset in range(0, len(body), OPS_MAX_ROWS_PER_WRITE):
+            chunk = body[offset:offset + OPS_MAX_ROWS_PER_WRITE]
+            yield write_block(output_start_col_num, current_row, chunk, "Cap Table Rows")
+            current_row += len(chunk)
+
+    # --- 6. Generate Ops for Totals --- 
+    total_row = current_row
+    first_data_row = cap_table_start_row + 2
+    yield {"id": get_op_id(), "range": f"{header_col1}{total_row}", "type": "write", "values": [["Total"]], "note": "Total Label"}
+    if SPILL_TOTALS:
+        # One dynamic array formula spills the Investment, Shares and % sums across the row
+        yield {"id": get_op_id(), "range": f"{header_col2}{total_row}", "type": "formula",
+               "formula": f"=BYCOL({header_col2}{first_data_row}:{header_col4}{total_row-1},LAMBDA(col,SUM(col)))",
+               "note": "Column Totals"}
+    else:
+        for col_num, note in ((output_start_col_num + 1, "Sum Investment"), (output_start_col_num + 2, "Sum Shares"),
+                              (output_start_col_num + 3, "Sum Percentage")):
+            col = num_to_col(col_num)
+            yield {"id": get_op_id(), "range": f"{col}{total_row}", "type": "formula",
+                   "formula": f"=SUM({col}{first_data_row}:{col}{total_row-1})", "note": note}
+
+
+# --- Helper function to build ops (Update signature) ---
+def build_structured_ops(slots: Dict, sheetData: List[List[str]], selectedRangeAddress: str, column_mapping: Dict, calculated_values: Dict,
+                         output_mode: str = PLAN_OUTPUT_MODE) -> List[Dict]:
+    """Deterministically builds the ActionOp list for the structured output."""
+    try:
+        ops = list(iter_structured_ops(slots, sheetData, selectedRangeAddress, column_mapping, calculated_values, output_mode))
+        logger.info(f"Finished generating {len(ops)} operations.")
+    except Exception as e:
+         logger.error(f"Error during structured op generation: {e}", exc_info=True)
+         # Return empty list or raise specific error?
+         ops = [] # Return empty on error for now
+         
+    return ops
@@ -0,0 +1,90 @@
+from typing import Any, Dict, List
+import logging
+import threading
+import weakref
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
+
+
+def _common_prefix_len(a: List[int], b: List[int]) -> int:
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+class PrefixStateCache:
+    """
+    Keeps llama.cpp state (KV cache) for the static prefix of each prompt
+    template, per model instance. Before a completion, the worker's context is
+    restored to the template prefix so create_completion only evaluates the
+    variable tail: llama-cpp-python skips tokens that match the tokens already
+    in the context.
+
+    Each saved state holds the KV cache for the prefix tokens, so memory grows
+    with (templates x workers x prefix length).
+    """
+
+    def __init__(self):
+        # llm -> {prefix_key: (prefix_tokens, LlamaState)}
+        self._states: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hits = 0  # Prefix already in context or restored from a saved state
+        self.misses = 0  # Prefix evaluated from scratch and saved
+        self.restores = 0
+        self.prompt_tokens = 0
+        self.tokens_saved = 0
+
+    def prepare(self, llm: Any, prefix_key: str, prefix: str, prompt: str) -> Dict[str, Any]:
+        """
+        Puts `llm` in a state whose context starts with the prefix tokens.
+        Must be called on the worker thread that owns `llm`. Returns per-request stats.
+        """
+        prompt_tokens = llm.tokenize(prompt.encode("utf-8"), special=True)
+        states = self._states.setdefault(llm, {})
+        entry = states.get(prefix_key)
+
+        if entry is None:
+            prefix_tokens = llm.tokenize(prefix.encode("utf-8"), special=True)
+            llm.reset()
+            llm.eval(prefix_tokens)
+            states[prefix_key] = (prefix_tokens, llm.save_state())
+            hit, saved = False, 0
+        else:
+            prefix_tokens, state = entry
+            current = list(llm.input_ids[:llm.n_tokens])
+            if _common_prefix_len(current, prefix_tokens) < len(prefix_tokens):
+                # Another template ran on this worker since; swap our prefix back in
+                llm.load_state(state)
+                with self._lock:
+                    self.restores += 1
+            hit = True
+            saved = _common_prefix_len(prefix_tokens, prompt_tokens)
+
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += len(prompt_tokens)
+            self.tokens_saved += saved
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return {"prefix_key": prefix_key, "prefix_hit": hit,
+                "prompt_tokens": len(prompt_tokens), "prompt_tokens_saved": saved}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "hits": self.hits,
+                "misses": self.misses,
+                "restores": self.restores,
+                "hit_rate": self.hits / self.requests if self.requests else 0.0,
+                "prompt_tokens": self.prompt_tokens,
+                "prompt_tokens_saved": self.tokens_saved,
+                "avg_tokens_saved_per_request": self.tokens_saved / self.requests if self.requests else 0.0,
+            }
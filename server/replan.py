@@ -0,0 +1,164 @@
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import logging
+import threading
+import time
+
+from cap_table import InvestorColumns
+from plan_ops import PLAN_OUTPUT_MODE
+from sheet_address import block_range, top_left
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+PLAN_STATE_MAX_ENTRIES = 64  # States hold the sheet and parsed arrays, so keep few
+PLAN_STATE_TTL_SECONDS = 60 * 60
+
+# --- Plan State ---
+@dataclass
+class PlanState:
+    """What a finished plan needs to be recomputed from a delta, without the LLM."""
+    slots: Dict[str, Any]
+    sheet_data: List[List[Any]]
+    selected_range_address: str
+    column_mapping: Dict[str, Any]
+    mapping_source: str
+    ops: List[Dict[str, Any]]  # Last ops sent to the add-in, diffed against on the next re-plan
+    columns: Optional[InvestorColumns] = None  # Parsed on the first re-plan, then updated in place
+    output_mode: str = PLAN_OUTPUT_MODE  # The plan request's outputMode; re-plans keep it
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+
+class PlanStateStore:
+    """In-memory LRU of PlanStates keyed by task_id, with a TTL since the last use."""
+
+    def __init__(self, max_entries: int = PLAN_STATE_MAX_ENTRIES, ttl_seconds: float = PLAN_STATE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.evictions = {"ttl": 0, "size": 0}
+        # task_id -> (last_used, state); least recently used first
+        self._states: "OrderedDict[str, Tuple[float, PlanState]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, task_id: str, state: PlanState) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._states[task_id] = (now, state)
+            self._states.move_to_end(task_id)
+            self._evict(now)
+
+    def get(self, task_id: str) -> Optional[PlanState]:
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            entry = self._states.get(task_id)
+            if entry is None:
+                return None
+            self._states[task_id] = (now, entry[1])
+            self._states.move_to_end(task_id)
+            return entry[1]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "size": len(self._states),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "evictions": dict(self.evictions),
+            }
+
+    def _evict(self, now: float) -> None:
+        while self._states:
+            task_id, (last_used, _) = next(iter(self._states.items()))
+            if now - last_used <= self.ttl_seconds:
+                break
+            self._states.popitem(last=False)
+            self.evictions["ttl"] += 1
+        while len(self._states) > self.max_entries:
+            self._states.popitem(last=False)
+            self.evictions["size"] += 1
+
+
+# --- Op Diffing ---
+def _index_ops(ops: List[Dict[str, Any]]):
+    """Splits ops into per-row writes {(row, col): values_row} and formulas {range: formula}."""
+    rows: Dict[Tuple[int, int], List[Any]] = {}
+    formulas: Dict[str, str] = {}
+    for op in ops:
+        if op["type"] == "formula":
+            formulas[op["range"]] = op["formula"]
+        elif op.get("values"):
+            col, row = top_left(op["range"])
+            for offset, values in enumerate(op["values"]):
+                rows[(row + offset, col)] = values
+    return rows, formulas
+
+
+def diff_ops(old_ops: List[Dict[str, Any]], new_ops: List[Dict[str, Any]],
+             get_op_id: Callable[[], str]) -> List[Dict[str, Any]]:
+    """
+    Returns the ops that turn the output of `old_ops` into that of `new_ops`:
+    changed rows of each write block (runs of adjacent changed rows are kept
+    as one rectangular write), changed formulas, and blank writes for cells
+    the new plan no longer covers.
+    """
+    old_rows, old_formulas = _index_ops(old_ops)
+    new_rows, new_formulas = _index_ops(new_ops)
+    new_cells = {(row, col + i) for (row, col), values in new_rows.items()
+                 for i, value in enumerate(values) if value is not None}
+    new_cells.update(top_left(address)[::-1] for address in new_formulas)
+    changed: List[Dict[str, Any]] = []
+
+    def emit(col: int, row: int, values: List[List[Any]], note: Optional[str]):
+        changed.append({"id": get_op_id(), "range": block_range(col, row, len(values), len(values[0])),
+                        "type": "write", "values": values, "note": note})
+
+    for op in new_ops:
+        if op["type"] == "formula":
+            if old_formulas.get(op["range"]) != op["formula"]:
+                changed.append(dict(op, id=get_op_id()))
+            continue
+        if not op.get("values"):
+            continue
+        col, row = top_left(op["range"])
+        run_start, run = None, []
+        for offset, values in enumerate(op["values"]):
+            if old_rows.get((row + offset, col)) != values:
+                if not run:
+                    run_start = row + offset
+                run.append(values)
+            elif run:
+                emit(col, run_start, run, op.get("note"))
+                run = []
+        if run:
+            emit(col, run_start, run, op.get("note"))
+
+    # Cells only the old plan wrote (e.g. the table shrank): blank them out. None cells
+    # are skipped by the add-in, so they neither need clearing nor count as covered.
+    old_cells = {(row, col + i) for (row, col), values in old_rows.items()
+                 for i, value in enumerate(values) if value is not None}
+    old_cells.update(top_left(address)[::-1] for address in old_formulas)
+    # Stale cells are cleared as rectangles: runs of adjacent columns per row, and runs of
+    # adjacent rows with the same column span, so a shrunken table costs one op per block
+    segments: List[Tuple[int, int, int]] = []  # (row, first col, width)
+    for row, col in sorted(old_cells - new_cells):
+        if segments and segments[-1][0] == row and segments[-1][1] + segments[-1][2] == col:
+            segments[-1] = (row, segments[-1][1], segments[-1][2] + 1)
+        else:
+            segments.append((row, col, 1))
+    open_blocks: Dict[Tuple[int, int], Tuple[int, int]] = {}  # (first col, width) -> (first row, last row)
+    blocks: List[Tuple[int, int, int, int]] = []
+    for row, col, width in segments:
+        block = open_blocks.get((col, width))
+        if block is not None and block[1] == row - 1:
+            open_blocks[(col, width)] = (block[0], row)
+        else:
+            if block is not None:
+                blocks.append((block[0], col, block[1] - block[0] + 1, width))
+            open_blocks[(col, width)] = (row, row)
+    blocks.extend((first, col, last - first + 1, width) for (col, width), (first, last) in open_blocks.items())
+    for row, col, height, width in sorted(blocks):
+        emit(col, row, [[""] * width for _ in range(height)], "Clear")
+    return changed
@@ -0,0 +1,265 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import heapq
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from op_codec import dumps, loads
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+RESULT_STORE_BACKEND = os.environ.get("RESULT_STORE", "memory")  # "memory" or "sqlite"
+RESULT_STORE_PATH = Path(__file__).parent / "cache" / "task_results.sqlite3"
+RESULT_MAX_ENTRIES = 1000
+RESULT_TTL_SECONDS = 60 * 60  # Unfetched results expire after an hour
+# Finished results are dropped this long after the first fetch. A short grace
+# instead of immediate removal lets the add-in re-poll after a dropped response.
+FETCHED_GRACE_SECONDS = 30
+
+TERMINAL_STATUSES = ("completed", "failed")
+
+
+class ResultStore(ABC):
+    """
+    Interface for task result storage. Supports the dict-style access the plan
+    endpoints use (store[task_id] = {...}, store.get(task_id)) plus fetch(),
+    which marks a finished result as delivered so it can be evicted.
+    """
+
+    def __init__(self, max_entries: int = RESULT_MAX_ENTRIES, ttl_seconds: float = RESULT_TTL_SECONDS,
+                 fetched_grace_seconds: float = FETCHED_GRACE_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.fetched_grace_seconds = fetched_grace_seconds
+        self.evictions = {"ttl": 0, "size": 0, "fetched": 0}
+        self._lock = threading.Lock()
+
+    def __setitem__(self, task_id: str, value: Dict[str, Any]) -> None:
+        self.put(task_id, value)
+
+    @abstractmethod
+    def put(self, task_id: str, value: Dict[str, Any]) -> None:
+        ...
+
+    @abstractmethod
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    def fetch(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """Returns the result and, if it is finished, schedules it for removal."""
+        encoded = self.fetch_encoded(task_id)
+        return loads(encoded) if encoded is not None else None
+
+    @abstractmethod
+    def fetch_encoded(self, task_id: str) -> Optional[bytes]:
+        """Like fetch(), but returns the JSON bytes encoded once at put() time."""
+
+    @abstractmethod
+    def peek_encoded(self, task_id: str) -> Optional[bytes]:
+        """The stored JSON bytes, without marking a finished result as delivered."""
+
+    @abstractmethod
+    def __len__(self) -> int:
+        ...
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": type(self).__name__,
+            "size": len(self),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "evictions": dict(self.evictions),
+        }
+
+
+class InMemoryResultStore(ResultStore):
+    """
+    Dict with TTL, size-cap and fetch-based eviction. Only the encoded payload
+    is kept (results are served as bytes); get() decodes it. Expiry times sit in
+    a heap, so a write only looks at the entries that are due. The size cap
+    counts finished results only: a task still processing is never evicted by size.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # task_id -> (expires_at, fetched, status, encoded)
+        self._entries: Dict[str, tuple] = {}
+        # (expires_at, task_id), soonest first; entries whose expiry changed since are skipped
+        self._expiry_heap: List[Tuple[float, str]] = []
+        # Finished (completed or failed) task_ids, oldest first: the size cap's eviction order
+        self._finished: "OrderedDict[str, None]" = OrderedDict()
+
+    def put(self, task_id: str, value: Dict[str, Any]) -> None:
+        now = time.monotonic()
+        encoded = dumps(value)
+        status = value.get("status")
+        with self._lock:
+            self._set(task_id, (now + self.ttl_seconds, False, status, encoded))
+            self._finished.pop(task_id, None)
+            if status in TERMINAL_STATUSES:
+                self._finished[task_id] = None
+            self._evict(now)
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(task_id)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                self._remove(task_id, "fetched" if entry[1] else "ttl")
+                return None
+            encoded = entry[3]
+        return loads(encoded)
+
+    def fetch_encoded(self, task_id: str) -> Optional[bytes]:
+        entry = self._fetch_entry(task_id)
+        return entry[3] if entry is not None else None
+
+    def peek_encoded(self, task_id: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(task_id)
+            return entry[3] if entry is not None and entry[0] > time.monotonic() else None
+
+    def _fetch_entry(self, task_id: str) -> Optional[tuple]:
+        with self._lock:
+            entry = self._entries.get(task_id)
+            now = time.monotonic()
+            if entry is None:
+                return None
+            expires_at, fetched, status, encoded = entry
+            if expires_at <= now:
+                self._remove(task_id, "fetched" if fetched else "ttl")
+                return None
+            if status in TERMINAL_STATUSES and not fetched:
+                if self.fetched_grace_seconds <= 0:
+                    self._remove(task_id, "fetched")
+                else:
+                    self._set(task_id, (min(expires_at, now + self.fetched_grace_seconds), True, status, encoded))
+            return entry
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _set(self, task_id: str, entry: tuple) -> None:
+        self._entries[task_id] = entry
+        heapq.heappush(self._expiry_heap, (entry[0], task_id))
+        if len(self._expiry_heap) > 2 * len(self._entries) + 64:
+            # Drop the stale heap items left by re-puts and fetches
+            self._expiry_heap = [(entry[0], tid) for tid, entry in self._entries.items()]
+            heapq.heapify(self._expiry_heap)
+
+    def _remove(self, task_id: str, reason: str) -> None:
+        self._finished.pop(task_id, None)
+        if self._entries.pop(task_id, None) is not None:
+            self.evictions[reason] += 1
+
+    def _evict(self, now: float) -> None:
+        heap = self._expiry_heap
+        while heap and heap[0][0] <= now:
+            expires_at, tid = heapq.heappop(heap)
+            entry = self._entries.get(tid)
+            if entry is not None and entry[0] == expires_at:
+                self._remove(tid, "fetched" if entry[1] else "ttl")
+        while len(self._finished) > self.max_entries:
+            tid, _ = self._finished.popitem(last=False)
+            self._entries.pop(tid, None)
+            self.evictions["size"] += 1
+
+
+class SQLiteResultStore(ResultStore):
+    """
+    SQLite-backed store: results survive restarts and stay out of process memory.
+    Payloads are stored as encoded JSON and served without re-encoding.
+    """
+
+    def __init__(self, path: Path = RESULT_STORE_PATH, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS task_results ("
+            " task_id TEXT PRIMARY KEY, created REAL NOT NULL, expires REAL NOT NULL,"
+            " fetched INTEGER NOT NULL DEFAULT 0, payload BLOB NOT NULL, status TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS task_results_expires ON task_results (expires)")
+        with self._lock:
+            self._evict(time.time())
+
+    def put(self, task_id: str, value: Dict[str, Any]) -> None:
+        now = time.time()
+        payload = dumps(value)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO task_results (task_id, created, expires, fetched, payload, status)"
+                " VALUES (?, ?, ?, 0, ?, ?)",
+                (task_id, now, now + self.ttl_seconds, payload, value.get("status")),
+            )
+            self._evict(now)
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload FROM task_results WHERE task_id = ? AND expires > ?", (task_id, time.time())
+            ).fetchone()
+        return loads(row[0]) if row else None
+
+    def peek_encoded(self, task_id: str) -> Optional[bytes]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload FROM task_results WHERE task_id = ? AND expires > ?", (task_id, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def fetch_encoded(self, task_id: str) -> Optional[bytes]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload, fetched, expires, status FROM task_results WHERE task_id = ? AND expires > ?",
+                (task_id, now),
+            ).fetchone()
+            if row is None:
+                return None
+            payload = row[0]
+            if row[3] in TERMINAL_STATUSES and not row[1]:
+                if self.fetched_grace_seconds <= 0:
+                    self._conn.execute("DELETE FROM task_results WHERE task_id = ?", (task_id,))
+                    self.evictions["fetched"] += 1
+                else:
+                    self._conn.execute(
+                        "UPDATE task_results SET fetched = 1, expires = ? WHERE task_id = ?",
+                        (min(row[2], now + self.fetched_grace_seconds), task_id),
+                    )
+        return payload
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM task_results").fetchone()[0]
+
+    def _evict(self, now: float) -> None:
+        for fetched, reason in ((1, "fetched"), (0, "ttl")):
+            cur = self._conn.execute("DELETE FROM task_results WHERE expires <= ? AND fetched = ?", (now, fetched))
+            self.evictions[reason] += cur.rowcount
+        cur = self._conn.execute(
+            "DELETE FROM task_results WHERE task_id IN ("
+            " SELECT task_id FROM task_results WHERE status IN (?, ?) ORDER BY created DESC LIMIT -1 OFFSET ?)",
+            (*TERMINAL_STATUSES, self.max_entries),
+        )
+        self.evictions["size"] += cur.rowcount
+
+
+def create_result_store(backend: str = RESULT_STORE_BACKEND) -> ResultStore:
+    if backend == "sqlite":
+        logger.info(f"Using SQLite task result store at {RESULT_STORE_PATH}")
+        return SQLiteResultStore()
+    if backend != "memory":
+        logger.warning(f"Unknown RESULT_STORE '{backend}', using in-memory store.")
+    return InMemoryResultStore()
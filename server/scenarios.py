@@ -0,0 +1,140 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import itertools
+import logging
+
+import numpy as np
+
+from cap_table import CAP_TABLE_PRECISION, InvestorColumns, compute_scenarios, compute_scenarios_exact
+from plan_ops import PLAN_OUTPUT_COLUMNS
+from sheet_address import block_range, bottom_right, top_left
+from waterfall import compute_waterfall_scenarios, uses_waterfall
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+SWEEP_SLOTS = ("amount", "preMoney", "poolPct")  # Numeric slots a scenario can vary
+MAX_SCENARIOS = 100_000
+MAX_OWNERSHIP_CELLS = 2_000_000  # scenarios x holders returned in holder_ownership
+SENSITIVITY_METRICS = ("post_money_valuation", "price_per_share", "total_new_shares_for_round",
+                       "option_pool_shares", "total_post_money_shares", "new_investors_pct", "option_pool_pct")
+
+
+def _as_float(slot: str, value: Any) -> float:
+    try:
+        return float(value if value is not None else 0)
+    except (TypeError, ValueError):
+        raise ValueError(f"Scenario value for '{slot}' is not a number: {value!r}")
+
+
+def build_scenario_arrays(base_slots: Dict[str, Any], scenarios: List[Dict[str, Any]],
+                          grid: Dict[str, List[Any]]) -> Dict[str, np.ndarray]:
+    """
+    Expands explicit scenarios plus the cartesian product of `grid` into one
+    float64 array per sweep slot. Slots a scenario leaves out come from
+    `base_slots`. With neither scenarios nor grid, the base slots are the only scenario.
+    """
+    unknown = [slot for slot in itertools.chain(grid, *scenarios) if slot not in SWEEP_SLOTS]
+    if unknown:
+        raise ValueError(f"Only {', '.join(SWEEP_SLOTS)} can vary between scenarios, got: {sorted(set(unknown))}")
+    if base_slots.get("rounds"):
+        raise ValueError("Scenarios vary the round slots; an explicit 'rounds' event list can't be swept")
+
+    base = {slot: _as_float(slot, base_slots.get(slot)) for slot in SWEEP_SLOTS}
+    n_grid = int(np.prod([len(values) for values in grid.values()])) if grid else 0
+    total = len(scenarios) + n_grid
+    if total == 0:
+        scenarios, total = [{}], 1
+    if total > MAX_SCENARIOS:
+        raise ValueError(f"{total} scenarios requested, the limit is {MAX_SCENARIOS}")
+
+    arrays = {}
+    for slot in SWEEP_SLOTS:
+        explicit = [_as_float(slot, s[slot]) if slot in s else base[slot] for s in scenarios]
+        arrays[slot] = np.array(explicit, dtype=np.float64)
+
+    if grid:
+        # Cartesian product in row-major order of the grid keys (first key varies slowest)
+        axes = [np.array([_as_float(slot, v) for v in values], dtype=np.float64) for slot, values in grid.items()]
+        mesh = np.meshgrid(*axes, indexing="ij")
+        for slot in SWEEP_SLOTS:
+            if slot in grid:
+                swept = mesh[list(grid).index(slot)].ravel()
+            else:
+                swept = np.full(n_grid, base[slot])
+            arrays[slot] = np.concatenate([arrays[slot], swept])
+    return arrays
+
+
+def summarize_scenarios(columns: InvestorColumns, arrays: Dict[str, np.ndarray], base_slots: Dict[str, Any],
+                        include_holder_ownership: bool) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+    """
+    Runs the scenario computation and shapes the response body. Also returns the raw
+    result arrays. Each scenario follows the dispatch a plan of its slots would:
+    the waterfall solver for SAFEs, notes or a pre-money pool, else the single
+    round in float or exact precision.
+    """
+    sweep = (arrays["amount"], arrays["preMoney"], arrays["poolPct"])
+    if uses_waterfall(base_slots):
+        if CAP_TABLE_PRECISION == "exact":
+            logger.warning("SAFEs, notes and pre-money pools are swept in float precision, not exact.")
+        results = compute_waterfall_scenarios(base_slots, columns, *sweep)
+    elif CAP_TABLE_PRECISION == "exact":
+        results = compute_scenarios_exact(columns, *sweep)
+    else:
+        results = compute_scenarios(columns, *sweep)
+    n_scenarios = len(arrays["amount"])
+
+    # Per-scenario summaries, built column-wise then zipped into rows
+    fields = {slot: arrays[slot].tolist() for slot in SWEEP_SLOTS}
+    fields.update({metric: results[metric].tolist() for metric in SENSITIVITY_METRICS})
+    names = list(fields)
+    summaries = [dict(zip(names, row), index=i) for i, row in enumerate(zip(*fields.values()))]
+
+    body: Dict[str, Any] = {
+        "scenario_count": n_scenarios,
+        "roundType": base_slots.get("roundType"),
+        "holders": columns.names,
+        "scenarios": summaries,
+    }
+    if include_holder_ownership:
+        if n_scenarios * len(columns) > MAX_OWNERSHIP_CELLS:
+            raise ValueError(f"{n_scenarios} scenarios x {len(columns)} holders is too many ownership values to return "
+                             f"(limit {MAX_OWNERSHIP_CELLS}); set include_holder_ownership to false")
+        body["holder_ownership"] = results["ownership"]  # scenario x holder, aligned with "holders"
+    return body, results
+
+
+def sensitivity_table_op(grid: Dict[str, List[Any]], results: Dict[str, np.ndarray], n_explicit: int,
+                         metric: str, selectedRangeAddress: str, get_op_id: Callable[[], str],
+                         target_cell: Optional[str] = None) -> Dict[str, Any]:
+    """
+    One write op laying out `metric` over the two swept grid slots (first key down
+    the rows, second across the columns). Its top-left cell is `target_cell`, else
+    one column right of where a plan of the same selection writes its output.
+    The op's id comes from `get_op_id`, so it can join other ops in one list.
+    """
+    if metric not in SENSITIVITY_METRICS:
+        raise ValueError(f"Unknown sensitivity metric '{metric}', expected one of {', '.join(SENSITIVITY_METRICS)}")
+    swept = [slot for slot, values in grid.items() if len(values) > 1]
+    if len(swept) != 2:
+        raise ValueError("A sensitivity table needs a grid with exactly two slots that have more than one value")
+
+    # Grid results follow the explicit scenarios; reshape to the grid's axes and keep
+    # the two swept ones (grid key order, so the first swept slot runs down the rows)
+    index = tuple(slice(None) if slot in swept else 0 for slot in grid)
+    table = results[metric][n_explicit:].reshape(tuple(len(v) for v in grid.values()))[index]
+    row_labels = [_as_float(swept[0], v) for v in grid[swept[0]]]
+    col_labels = [_as_float(swept[1], v) for v in grid[swept[1]]]
+
+    values = [[f"{metric} ({swept[0]} \\ {swept[1]})"] + col_labels]
+    values += [[label] + row for label, row in zip(row_labels, table.tolist())]
+
+    if target_cell:
+        start_col, start_row = top_left(target_cell)
+    else:
+        end_col, _ = bottom_right(selectedRangeAddress)
+        _, start_row = top_left(selectedRangeAddress)
+        start_col = end_col + 2 + PLAN_OUTPUT_COLUMNS + 1  # Clear of the plan's blocks, with a blank column between
+    return {"id": get_op_id(), "range": block_range(start_col, start_row, len(values), len(values[0])),
+            "type": "write", "values": values, "note": "Sensitivity Table"}
@@ -0,0 +1,206 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+SESSION_STORE_BACKEND = os.environ.get("SESSION_STORE", "sqlite")  # "sqlite" or "memory"
+SESSION_STORE_PATH = Path(__file__).parent / "cache" / "sessions.sqlite3"
+SESSION_MAX_IN_MEMORY = 500
+SESSION_IDLE_TIMEOUT_SECONDS = 4 * 60 * 60  # Idle sessions are dropped everywhere after this
+SESSION_HISTORY_MESSAGES = 8  # History entries kept verbatim; older ones are dropped and counted
+SESSION_SWEEP_EVERY_SAVES = 100  # Persisted idle sessions are deleted in one sweep this often, not on every save
+
+
+def compact_history(history: List[Dict[str, str]], keep: int = SESSION_HISTORY_MESSAGES):
+    """
+    Keeps the last `keep` history entries. Slot values already live in
+    session.slots, so older turns are only counted, not re-sent to the LLM.
+    Returns (kept_history, dropped_count).
+    """
+    if len(history) <= keep:
+        return history, 0
+    return history[-keep:], len(history) - keep
+
+
+class SessionStore:
+    """
+    Session manager with an LRU in-memory cap, idle-timeout eviction, history
+    compaction and optional SQLite persistence so sessions survive restarts.
+    Sessions are pydantic models; `model_cls(**data)` / `session.dict()` round trip them.
+    The SQLite file is opened on first use, not when the store is created.
+    """
+
+    def __init__(self, model_cls: Callable[..., Any], path: Optional[Path] = SESSION_STORE_PATH,
+                 max_in_memory: int = SESSION_MAX_IN_MEMORY, idle_timeout: float = SESSION_IDLE_TIMEOUT_SECONDS,
+                 history_messages: int = SESSION_HISTORY_MESSAGES, sweep_every_saves: int = SESSION_SWEEP_EVERY_SAVES):
+        self.model_cls = model_cls
+        self.path = path
+        self.max_in_memory = max_in_memory
+        self.idle_timeout = idle_timeout
+        self.history_messages = history_messages
+        self.sweep_every_saves = max(1, sweep_every_saves)
+        self._saves_since_sweep = 0
+        self.evictions = {"idle": 0, "memory_cap": 0}
+        # session_id -> (last_active, session); least recently used first
+        self._sessions: "OrderedDict[str, tuple]" = OrderedDict()
+        # session_id -> [lock, turns holding or waiting on it]. Kept apart from _sessions so
+        # evicting a session never hands a second turn a fresh lock; removed by the last turn
+        self._turn_locks: Dict[str, list] = {}
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    # --- Lookup ---
+    def get(self, session_id: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                if now - entry[0] > self.idle_timeout:
+                    self._drop(session_id, "idle")
+                    return None
+                self._sessions[session_id] = (now, entry[1])
+                self._sessions.move_to_end(session_id)
+                return entry[1]
+            session = self._load(session_id, now)
+            if session is not None:
+                self._remember(session_id, session, now)
+            return session
+
+    def add(self, session: Any) -> Any:
+        self.save(session)
+        return session
+
+    def save(self, session: Any) -> None:
+        """Compacts the session history and writes it through to memory and disk."""
+        session.history, dropped = compact_history(session.history, self.history_messages)
+        session.omitted_messages += dropped
+        now = time.time()
+        with self._lock:
+            self._remember(session.session_id, session, now)
+            conn = self._db()
+            if conn is not None:
+                conn.execute(
+                    "INSERT OR REPLACE INTO sessions (session_id, last_active, payload) VALUES (?, ?, ?)",
+                    (session.session_id, now, json.dumps(session.dict())),
+                )
+            self._evict_idle(now)
+
+    @contextmanager
+    def turn_lock(self, session_id: str) -> Iterator[None]:
+        """Holds the per-session lock so concurrent /chat turns on one session apply in order."""
+        with self._lock:
+            entry = self._turn_locks.setdefault(session_id, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._turn_locks[session_id]
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            persisted = None
+            conn = self._db()
+            if conn is not None:
+                persisted = conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            return {
+                "in_memory": len(self._sessions),
+                "persisted": persisted,
+                "max_in_memory": self.max_in_memory,
+                "idle_timeout_seconds": self.idle_timeout,
+                "history_messages": self.history_messages,
+                "evictions": dict(self.evictions),
+            }
+
+    # --- Internals (call with self._lock held) ---
+    def _db(self) -> Optional[sqlite3.Connection]:
+        """The SQLite connection, opened (and swept of idle sessions) on first use."""
+        if self._conn is None and self.path is not None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                " session_id TEXT PRIMARY KEY, last_active REAL NOT NULL, payload TEXT NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_last_active ON sessions (last_active)")
+            self._sweep_persisted(time.time())
+        return self._conn
+
+    def _remember(self, session_id: str, session: Any, now: float) -> None:
+        self._sessions[session_id] = (now, session)
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > self.max_in_memory:
+            # Over the cap only leaves memory; a persisted copy is reloaded on demand
+            self._sessions.popitem(last=False)
+            self.evictions["memory_cap"] += 1
+
+    def _load(self, session_id: str, now: float) -> Optional[Any]:
+        conn = self._db()
+        if conn is None:
+            return None
+        row = conn.execute(
+            "SELECT last_active, payload FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        if now - row[0] > self.idle_timeout:
+            self._drop(session_id, "idle")
+            return None
+        try:
+            return self.model_cls(**json.loads(row[1]))
+        except Exception as e:
+            logger.warning(f"Discarding unreadable persisted session {session_id}: {e}")
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            return None
+
+    def _drop(self, session_id: str, reason: str) -> None:
+        self._sessions.pop(session_id, None)
+        conn = self._db()
+        if conn is not None:
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        self.evictions[reason] += 1
+
+    def _evict_idle(self, now: float) -> None:
+        cutoff = now - self.idle_timeout
+        # Oldest entries come first, so stop at the first active one
+        while self._sessions:
+            session_id, (last_active, _) = next(iter(self._sessions.items()))
+            if last_active > cutoff:
+                break
+            self._drop(session_id, "idle")
+        self._saves_since_sweep += 1
+        if self._saves_since_sweep >= self.sweep_every_saves:
+            self._sweep_persisted(now)
+
+    def _sweep_persisted(self, now: float) -> None:
+        # Sessions only on disk; _load() also rejects idle rows it reads before a sweep
+        self._saves_since_sweep = 0
+        conn = self._db()
+        if conn is not None:
+            cur = conn.execute("DELETE FROM sessions WHERE last_active <= ?", (now - self.idle_timeout,))
+            self.evictions["idle"] += cur.rowcount
+
+
+def create_session_store(model_cls: Callable[..., Any], backend: str = SESSION_STORE_BACKEND) -> SessionStore:
+    if backend == "memory":
+        return SessionStore(model_cls, path=None)
+    if backend != "sqlite":
+        logger.warning(f"Unknown SESSION_STORE '{backend}', using SQLite persistence.")
+    return SessionStore(model_cls, path=SESSION_STORE_PATH)
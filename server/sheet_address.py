@@ -0,0 +1,44 @@
+from typing import Tuple
+import re
+
+# A1 references, optionally sheet-qualified: "Sheet1!A1:B4", "C7"
+_RANGE_RE = re.compile(r"([A-Z]+)(\d+)(?::([A-Z]+)(\d+))?")
+
+
+def col_to_num(col_str: str) -> int:
+    """Column letters to number (A=1)."""
+    num = 0
+    for char in col_str:
+        num = num * 26 + (ord(char.upper()) - ord('A')) + 1
+    return num
+
+
+def num_to_col(n: int) -> str:
+    """Column number to letters (1=A)."""
+    string = ""
+    while n > 0:
+        n, remainder = divmod(n - 1, 26)
+        string = chr(65 + remainder) + string
+    return string
+
+
+def top_left(range_address: str) -> Tuple[int, int]:
+    """(column number, row) of the first cell of an A1 range."""
+    match = _RANGE_RE.match(range_address.split('!')[-1])
+    if not match:
+        raise ValueError(f"Could not parse address: {range_address}")
+    return col_to_num(match.group(1)), int(match.group(2))
+
+
+def bottom_right(range_address: str) -> Tuple[int, int]:
+    """(column number, row) of the last cell of an A1 range."""
+    match = _RANGE_RE.match(range_address.split('!')[-1])
+    if not match:
+        raise ValueError(f"Could not parse address: {range_address}")
+    col, row = match.group(3) or match.group(1), match.group(4) or match.group(2)
+    return col_to_num(col), int(row)
+
+
+def block_range(col: int, row: int, n_rows: int, n_cols: int) -> str:
+    """A1 range of an n_rows x n_cols block whose top-left cell is (col, row)."""
+    return f"{num_to_col(col)}{row}:{num_to_col(col + n_cols - 1)}{row + n_rows - 1}"
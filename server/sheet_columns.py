@@ -0,0 +1,110 @@
+from typing import Any, Iterator, List, Optional, Sequence, Union
+import math
+
+import numpy as np
+
+Column = Union[np.ndarray, List[Optional[str]]]  # float64 values (NaN = empty cell) or text cells
+
+
+# --- Columnar Sheet ---
+def _number_text(value: float) -> str:
+    """Cell text for a numeric cell, as the add-in would send it in JSON (String(x) in JS)."""
+    if math.isnan(value):
+        return ""
+    if value == int(value) and abs(value) < 1e16:
+        return str(int(value))
+    return repr(value)
+
+
+class ColumnarSheet(Sequence):
+    """
+    A selection uploaded as typed columns. Numeric columns are float64 arrays
+    viewing the upload buffer; text columns are lists of strings.
+
+    Behaves like the JSON sheetData (a sequence of rows of cell text, header row
+    first) so the fingerprint, detector and prompt encoder work unchanged; rows
+    are rendered on access. extract_investor_columns() reads the typed columns
+    directly instead.
+    """
+
+    def __init__(self, columns: List[Column], header: Optional[List[str]] = None, digest: bytes = b""):
+        lengths = {len(col) for col in columns}
+        if len(lengths) > 1:
+            raise ValueError(f"Columns have different lengths: {sorted(lengths)}")
+        if header is not None and len(header) != len(columns):
+            raise ValueError(f"Header has {len(header)} cells for {len(columns)} columns")
+        self.columns = columns
+        self.header = header
+        self.n_data_rows = lengths.pop() if lengths else 0
+        self.digest = digest  # Content hash of the decoded body (dedup key)
+        self._cell_lists: Optional[List[List[Any]]] = None
+
+    @property
+    def n_cols(self) -> int:
+        return len(self.columns)
+
+    @property
+    def header_rows(self) -> int:
+        return 1 if self.header is not None else 0
+
+    def __len__(self) -> int:
+        return self.header_rows + self.n_data_rows
+
+    def _lists(self) -> List[List[Any]]:
+        # Python lists index much faster than NumPy scalars for row-by-row access
+        if self._cell_lists is None:
+            self._cell_lists = [col.tolist() if isinstance(col, np.ndarray) else col for col in self.columns]
+        return self._cell_lists
+
+    @staticmethod
+    def _cell_text(value: Any, numeric: bool) -> str:
+        if numeric:
+            return _number_text(value)
+        return "" if value is None else str(value)
+
+    def _row(self, idx: int) -> List[str]:
+        if self.header is not None:
+            if idx == 0:
+                return list(self.header)
+            idx -= 1
+        return [self._cell_text(col[idx], isinstance(src, np.ndarray)) for col, src in zip(self._lists(), self.columns)]
+
+    def column_text(self, idx: int) -> List[str]:
+        """Cell text of one column, header cell first (as the JSON rows would have it)."""
+        numeric = isinstance(self.columns[idx], np.ndarray)
+        values = self.columns[idx].tolist() if numeric else self.columns[idx]
+        head = [self.header[idx]] if self.header is not None else []
+        return head + [self._cell_text(value, numeric) for value in values]
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self._row(i) for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("sheet row index out of range")
+        return self._row(idx)
+
+    def __iter__(self) -> Iterator[List[str]]:
+        for idx in range(len(self)):
+            yield self._row(idx)
+
+    def nonempty_rows(self) -> np.ndarray:
+        """Row indices (header row first, if any) with at least one non-empty cell, from the column arrays."""
+        mask = np.zeros(self.n_data_rows, dtype=bool)
+        for col in self.columns:
+            if isinstance(col, np.ndarray):
+                mask |= ~np.isnan(col)
+            else:
+                mask |= np.fromiter((v is not None and bool(str(v).strip()) for v in col), dtype=bool, count=len(col))
+        indices = np.flatnonzero(mask) + self.header_rows
+        if self.header is not None and any(str(cell).strip() for cell in self.header):
+            indices = np.concatenate([np.zeros(1, dtype=indices.dtype), indices])
+        return indices
+
+    def to_rows(self) -> List[List[str]]:
+        """Materializes the JSON sheetData equivalent (for edits that replace rows)."""
+        return list(self)
+
+    def __repr__(self) -> str:
+        return f"ColumnarSheet({len(self)} rows x {self.n_cols} cols)"
@@ -0,0 +1,177 @@
+from typing import List, Any, Optional
+import logging
+import math
+import os
+import re
+import statistics
+
+from sheet_columns import ColumnarSheet
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# Token budget for the sheet section of the plan prompt (the rest of N_CTX holds
+# the instructions and the completion)
+SHEET_TOKEN_BUDGET = int(os.environ.get("PLAN_SHEET_TOKENS", "700"))
+PROFILE_SAMPLE_ROWS = 5000  # Rows profiled per column; larger selections are sampled evenly
+MAX_SAMPLE_ROWS = 20  # Representative rows shown verbatim
+HEAD_SAMPLE_ROWS = 5  # Always try to show the first few data rows
+MAX_CELL_CHARS = 32
+MIXED_NUMERIC_RANGE = (0.2, 0.8)  # Numeric share in between -> "mixed" column
+
+_NUMERIC_STRIP = str.maketrans("", "", "$,% ")
+_DIGIT_RE = re.compile(r"\d")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Conservative token estimate without loading the model: the llama tokenizer
+    splits numbers into single digits, other text averages ~4 chars per token.
+    """
+    digits = len(_DIGIT_RE.findall(text))
+    return digits + math.ceil((len(text) - digits) / 4)
+
+
+# --- Cell Helpers ---
+def _cell_text(value: Any) -> str:
+    return "" if value is None else str(value).strip()
+
+
+def _parse_number(text: str) -> Optional[float]:
+    try:
+        return float(text.translate(_NUMERIC_STRIP))
+    except ValueError:
+        return None
+
+
+def _short(text: str) -> str:
+    text = " ".join(text.split()).replace("|", "/")
+    return text if len(text) <= MAX_CELL_CHARS else text[:MAX_CELL_CHARS - 1] + "…"
+
+
+def _format_number(value: float) -> str:
+    if value == int(value) or abs(value) >= 1000:
+        return str(round(value))
+    return f"{value:.4g}"
+
+
+def _looks_like_header(rows: List[List[Any]]) -> bool:
+    """First row is a header when it has no numeric cells but later rows do."""
+    if len(rows) < 2:
+        return False
+    first = [_cell_text(v) for v in rows[0]]
+    if not any(first) or any(_parse_number(t) is not None for t in first if t):
+        return False
+    return any(_parse_number(_cell_text(v)) is not None for row in rows[1:6] for v in row if _cell_text(v))
+
+
+# --- Column Profiling ---
+def _describe_column(idx: int, header: Optional[str], values: List[str], sampled: bool) -> str:
+    """One line per column: index, header, inferred type and stats."""
+    name = f'"{_short(header)}"' if header else "(no header)"
+    filled = [v for v in values if v]
+    if not filled:
+        return f"c{idx} {name}: empty"
+
+    fill_pct = round(100 * len(filled) / len(values))
+    numbers = [x for x in (_parse_number(t) for t in filled) if x is not None]
+    numeric_share = len(numbers) / len(filled)
+
+    if numeric_share >= MIXED_NUMERIC_RANGE[1]:
+        if sum("%" in t for t in filled) > len(filled) / 2:
+            kind = "percent"
+        elif sum("$" in t for t in filled) > len(filled) / 2:
+            kind = "currency"
+        elif all(x == int(x) for x in numbers):
+            kind = "integer"
+        else:
+            kind = "number"
+        stats = (f"min {_format_number(min(numbers))}, median {_format_number(statistics.median(numbers))}, "
+                 f"max {_format_number(max(numbers))}")
+    else:
+        kind = "mixed" if numeric_share > MIXED_NUMERIC_RANGE[0] else "text"
+        stats = f"{'~' if sampled else ''}{len(set(filled))} distinct, e.g. {_short(filled[0])}"
+
+    approx = "~" if sampled else ""
+    return f"c{idx} {name}: {kind}, {approx}{fill_pct}% filled, {stats}"
+
+
+def _sample_order(n_rows: int) -> List[int]:
+    """Data row indices in the order they should be added: head, last row, then evenly spread."""
+    order = list(range(min(HEAD_SAMPLE_ROWS, n_rows)))
+    if n_rows > len(order):
+        order.append(n_rows - 1)
+    seen = set(order)
+    # Fill the gaps by repeated halving so any prefix of the order is spread out
+    step = n_rows
+    while len(seen) < min(n_rows, MAX_SAMPLE_ROWS) and step > 1:
+        step = max(1, step // 2)
+        for idx in range(step, n_rows, step):
+            if idx not in seen:
+                seen.add(idx)
+                order.append(idx)
+            if len(seen) >= MAX_SAMPLE_ROWS:
+                break
+    return order[:MAX_SAMPLE_ROWS]
+
+
+# --- Encoder ---
+def encode_sheet(sheet_data: List[List[Any]], token_budget: int = SHEET_TOKEN_BUDGET) -> str:
+    """
+    Summarizes a sheet selection for the LLM: shape, one line per column with its
+    0-based index, header, inferred type and stats, then representative rows as
+    pipe-separated cells. Sections are added until `token_budget` is reached, so
+    the header and column profile survive even for huge selections.
+    """
+    if isinstance(sheet_data, ColumnarSheet):
+        # Rows are rendered on access: only the header check, profiled and sampled rows are built
+        rows, n_cols = sheet_data, sheet_data.n_cols
+    else:
+        rows = [row for row in sheet_data if isinstance(row, list)]
+        n_cols = max((len(row) for row in rows), default=0)
+    if not rows:
+        return "(empty selection)"
+
+    has_header = _looks_like_header(rows)
+    header = [_cell_text(v) for v in rows[0]] if has_header else []
+    n_data = len(rows) - has_header  # Data rows are rows[has_header:], indexed without copying them
+
+    stride = max(1, math.ceil(n_data / PROFILE_SAMPLE_ROWS))
+    profiled = rows[has_header::stride]
+    sampled = stride > 1
+
+    lines = [
+        f"Rows: {len(rows)} ({'1 header row + ' if has_header else 'no header row, '}{n_data} data rows), "
+        f"Columns: {n_cols}",
+        "Columns (0-based index, header, type, stats):",
+    ]
+    used = estimate_tokens("\n".join(lines))
+    for idx in range(n_cols):
+        values = [_cell_text(row[idx]) if idx < len(row) else "" for row in profiled]
+        line = _describe_column(idx, header[idx] if idx < len(header) else None, values, sampled)
+        cost = estimate_tokens(line) + 1
+        if used + cost > token_budget:
+            lines.append(f"... {n_cols - idx} more columns omitted")
+            break
+        lines.append(line)
+        used += cost
+
+    picked = []
+    for row_idx in _sample_order(n_data):
+        row = rows[has_header + row_idx]
+        # Row numbers are 1-based positions within the selection
+        line = f"r{row_idx + 1 + has_header}: " + " | ".join(_short(_cell_text(v)) for v in row)
+        cost = estimate_tokens(line) + 1
+        if used + cost > token_budget:
+            break
+        picked.append((row_idx, line))
+        used += cost
+
+    if picked:
+        lines.append(f"Sample rows ({len(picked)} of {n_data}, cells separated by |):")
+        lines.extend(line for _, line in sorted(picked))
+
+    logger.info(f"Sheet encoded: {len(rows)} rows x {n_cols} cols, {len(picked)} sample rows, ~{used} tokens "
+                f"(budget {token_budget}).")
+    return "\n".join(lines)
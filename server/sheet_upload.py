@@ -0,0 +1,155 @@
+from typing import Any, Dict, List, Optional, Tuple
+import hashlib
+import logging
+import os
+import zlib
+
+import numpy as np
+
+from op_codec import loads
+from sheet_columns import Column, ColumnarSheet
+
+try:
+    import msgpack
+except ImportError:  # MessagePack uploads are refused with 415
+    msgpack = None
+
+try:
+    import pyarrow as pa
+except ImportError:  # Arrow IPC uploads are refused with 415
+    pa = None
+
+try:
+    import zstandard
+except ImportError:  # zstd-encoded bodies are refused with 415
+    zstandard = None
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# Decompressed body limit, so a small compressed upload can't expand without bound
+MAX_UPLOAD_BYTES = int(os.environ.get("PLAN_MAX_UPLOAD_BYTES", str(256 * 1024 * 1024)))
+
+MSGPACK_CONTENT_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+ARROW_CONTENT_TYPES = ("application/vnd.apache.arrow.stream",)
+
+
+class UnsupportedUpload(ValueError):
+    """Content type or encoding this server can't decode (missing optional package or unknown format)."""
+
+
+# --- Body Decoding ---
+def _decompress(body: bytes, content_encoding: str) -> bytes:
+    encoding = content_encoding.strip().lower()
+    if encoding in ("", "identity"):
+        data = body
+    elif encoding == "gzip":
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        data = decompressor.decompress(body, MAX_UPLOAD_BYTES + 1)
+    elif encoding == "zstd":
+        if zstandard is None:
+            raise UnsupportedUpload("zstd request bodies need the 'zstandard' package")
+        with zstandard.ZstdDecompressor().stream_reader(body) as reader:
+            data = reader.read(MAX_UPLOAD_BYTES + 1)
+    else:
+        raise UnsupportedUpload(f"Unsupported Content-Encoding '{content_encoding}' (use gzip or zstd)")
+    if len(data) > MAX_UPLOAD_BYTES:
+        raise ValueError(f"Request body exceeds {MAX_UPLOAD_BYTES} bytes once decompressed")
+    return data
+
+
+def _decode_msgpack(data: bytes) -> Tuple[Dict[str, Any], ColumnarSheet, str, Optional[str]]:
+    """
+    {"slots": {...}, "selectedRangeAddress": "...", "header": [str, ...] (optional), "outputMode": "..." (optional),
+     "columns": [{"type": "f64", "data": <bin, little-endian float64, NaN = empty>}
+                 | {"type": "str", "data": [str | nil, ...]}, ...]}
+    """
+    if msgpack is None:
+        raise UnsupportedUpload("MessagePack uploads need the 'msgpack' package")
+    try:
+        message = msgpack.unpackb(data, raw=False)
+    except Exception as e:
+        raise ValueError(f"Invalid MessagePack body: {e}")
+    if not isinstance(message, dict):
+        raise ValueError("MessagePack body must be a map")
+
+    columns: List[Column] = []
+    for idx, spec in enumerate(message.get("columns") or []):
+        kind = spec.get("type") if isinstance(spec, dict) else None
+        values = spec.get("data") if isinstance(spec, dict) else None
+        if kind == "f64" and isinstance(values, bytes):
+            if len(values) % 8:
+                raise ValueError(f"Column {idx}: f64 data is not a whole number of float64 values")
+            columns.append(np.frombuffer(values, dtype="<f8"))  # No copy: a view of the unpacked bin
+        elif kind == "str" and isinstance(values, list):
+            columns.append(values)
+        else:
+            raise ValueError(f"Column {idx}: expected {{'type': 'f64', 'data': bin}} or {{'type': 'str', 'data': [...]}}")
+    header = message.get("header")
+    sheet = ColumnarSheet(columns, header=[str(h) for h in header] if header is not None else None,
+                          digest=hashlib.blake2b(data, digest_size=16).digest())
+    return message.get("slots") or {}, sheet, message.get("selectedRangeAddress"), message.get("outputMode")
+
+
+def _arrow_column(column: "pa.ChunkedArray") -> Column:
+    if pa.types.is_floating(column.type) or pa.types.is_integer(column.type) or pa.types.is_decimal(column.type):
+        column = column.cast(pa.float64())
+        if column.num_chunks == 1 and column.null_count == 0:
+            return column.chunk(0).to_numpy(zero_copy_only=True)  # A view of the IPC buffer
+        return column.fill_null(float("nan")).to_numpy()
+    return column.cast(pa.string()).to_pylist()
+
+
+def _decode_arrow(data: bytes) -> Tuple[Dict[str, Any], ColumnarSheet, str, Optional[str]]:
+    """
+    An Arrow IPC stream with one field per selected column. Field names are the
+    header row unless the schema metadata has header=false; the metadata also
+    carries "slots" (JSON), "selectedRangeAddress" and optionally "outputMode".
+    """
+    if pa is None:
+        raise UnsupportedUpload("Arrow IPC uploads need the 'pyarrow' package")
+    try:
+        table = pa.ipc.open_stream(pa.py_buffer(data)).read_all()
+    except Exception as e:
+        raise ValueError(f"Invalid Arrow IPC stream: {e}")
+    metadata = {k.decode("utf-8"): v.decode("utf-8") for k, v in (table.schema.metadata or {}).items()}
+    slots = loads(metadata["slots"]) if "slots" in metadata else {}
+    header = None if metadata.get("header", "true").lower() == "false" else list(table.column_names)
+    sheet = ColumnarSheet([_arrow_column(col) for col in table.columns], header=header,
+                          digest=hashlib.blake2b(data, digest_size=16).digest())
+    return slots, sheet, metadata.get("selectedRangeAddress"), metadata.get("outputMode")
+
+
+def decode_sheet_upload(body: bytes, content_type: str,
+                        content_encoding: str = "") -> Tuple[Dict[str, Any], ColumnarSheet, str, Optional[str]]:
+    """
+    Decodes a columnar /plan body into (slots, sheet, selectedRangeAddress, outputMode or None).
+    Raises UnsupportedUpload for formats this server can't read, ValueError for malformed bodies.
+    """
+    media_type = content_type.split(";")[0].strip().lower()
+    data = _decompress(body, content_encoding)
+    if media_type in MSGPACK_CONTENT_TYPES:
+        slots, sheet, address, output_mode = _decode_msgpack(data)
+    elif media_type in ARROW_CONTENT_TYPES:
+        slots, sheet, address, output_mode = _decode_arrow(data)
+    else:
+        raise UnsupportedUpload(f"Unsupported Content-Type '{content_type}'")
+    if not isinstance(slots, dict) or not isinstance(address, str):
+        raise ValueError("Upload needs a 'slots' map and a 'selectedRangeAddress' string")
+    logger.debug(f"Decoded {media_type} upload: {sheet!r} from {len(body)} bytes ({content_encoding or 'identity'})")
+    return slots, sheet, address, output_mode
+
+
+def is_columnar_upload(content_type: str) -> bool:
+    media_type = content_type.split(";")[0].strip().lower()
+    return media_type in MSGPACK_CONTENT_TYPES or media_type in ARROW_CONTENT_TYPES
+
+
+def decode_json_body(body: bytes, content_encoding: str = "") -> Any:
+    """Decodes a (possibly gzip/zstd compressed) JSON body."""
+    data = _decompress(body, content_encoding)
+    try:
+        return loads(data)
+    except ValueError as e:
+        raise ValueError(f"Invalid JSON body: {e}")
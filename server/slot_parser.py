@@ -0,0 +1,268 @@
+from typing import Dict, Any, List, Optional, Tuple
+import re
+
+# --- Slot Vocabulary ---
+MONEY_SLOTS = ("amount", "preMoney")
+
+MULTIPLIERS = {
+    "k": 1e3, "thousand": 1e3, "thousands": 1e3,
+    "m": 1e6, "mm": 1e6, "mn": 1e6, "mil": 1e6, "million": 1e6, "millions": 1e6,
+    "b": 1e9, "bn": 1e9, "billion": 1e9, "billions": 1e9,
+}
+WORD_NUMBERS = {
+    "a": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8,
+    "nine": 9, "ten": 10, "eleven": 11, "twelve": 12, "thirteen": 13, "fourteen": 14, "fifteen": 15,
+    "sixteen": 16, "seventeen": 17, "eighteen": 18, "nineteen": 19, "twenty": 20, "thirty": 30,
+    "forty": 40, "fifty": 50, "sixty": 60, "seventy": 70, "eighty": 80, "ninety": 90,
+}
+# Bare numbers below this are too ambiguous to read as dollars ("5" -> $5 or $5M?, "2024" -> a year?)
+MIN_BARE_DOLLARS = 10000
+
+# Context keywords that label a money value
+PRE_MONEY_AFTER = re.compile(r"^\W*(pre(?:[-\s]?money)?|valuation)\b", re.I)
+PRE_MONEY_BEFORE = re.compile(r"\b(pre(?:[-\s]?money)?|valuation|valued|pre(?:[-\s]?money)? valuation)\b(\s+(of|at|is|=))?\W*$", re.I)
+AMOUNT_BEFORE = re.compile(r"\b(rais(?:e|ed|ing)|amount|invest(?:ing|ment)?|round size|check|tranche)\b(\s+(of|is|=))?\W*$", re.I)
+AMOUNT_AFTER = re.compile(r"^\W*(round|raise|investment|check)\b", re.I)
+POST_MONEY = re.compile(r"\bpost(?:[-\s]?money)?\b", re.I)
+POOL_WORDS = re.compile(r"\b(pool|option|options|esop)\b", re.I)
+# "pre-money pool", "post-money option pool": only the timing words, so "pool" still labels the percentage
+POOL_TIMING_RE = re.compile(r"\b(pre|post)[-\s]?money(?=\s+(?:option\s+|esop\s+)?pool\b)", re.I)
+
+# --- Grammar ---
+_ROUND_TYPE_RE = re.compile(
+    r"\b(?:(pre[-\s]?seed)|(seed)|series\s+([a-h])(?:[-\s]?(\d))?|(?-i:([A-H]))\s+round|(bridge))\b", re.I
+)
+_NUMBER_RE = re.compile(
+    r"(?P<cur>\$|usd\s*)?\s*(?P<num>\d+(?:,\d{3})*(?:\.\d+)?|\.\d+)\s*"
+    r"(?P<suf>thousands?|millions?|billions?|mil|mm|mn|bn|k|m|b)?\b"
+    r"\s*(?P<pct>%|percent\b|pct\b)?",
+    re.I,
+)
+_WORD_NUMBER_RE = re.compile(
+    r"(?P<cur>\$)?(?<!half\s)\b(?P<words>(?:(?:" + "|".join(WORD_NUMBERS) + r"|hundred|and)[\s-]+)+)"
+    r"(?P<suf>thousand|million|billion)\b(?:\s+dollars)?",
+    re.I,
+)
+# "$5M at $20M": the text between an amount and its pre-money valuation
+_AT_RE = re.compile(r"\s*(at|@|on)(\s+a)?\s*", re.I)
+
+# Convertible amounts and caps need a "$" or a magnitude: "2 notes" is a count, not a $2 note
+_MONEY_NUM = r"\d+(?:,\d{3})*(?:\.\d+)?"
+_MONEY_SUFFIX = r"(?:thousand|million|billion|mil|mm|mn|bn|k|m|b)\b"
+_MONEY = r"(?:\$\s*" + _MONEY_NUM + r"\s*(?:" + _MONEY_SUFFIX + r")?|" + _MONEY_NUM + r"\s*" + _MONEY_SUFFIX + r")(?!\w)"
+# "$500k SAFE", "$1M post-money SAFE", "$250k convertible note"
+_CONVERTIBLE_RE = re.compile(
+    r"(?P<amount>" + _MONEY + r")\s*(?:(?P<cap_type>pre|post)[-\s]?money\s+)?"
+    r"(?P<kind>safes?|convertible\s+notes?|notes?)\b",
+    re.I,
+)
+# Terms following the instrument, each optionally led by connectors: "at a $5M cap, 20% discount and 6% interest"
+_CONVERTIBLE_TERM_RE = re.compile(
+    r"(?:\s*(?:,|\b(?:and|with|at|a|an|plus|of|for|over)\b))*\s*(?:"
+    r"(?P<cap>" + _MONEY + r")\s*(?:(?P<cap_type>pre|post)[-\s]?money\s+)?(?:valuation\s+)?cap\b"
+    r"|(?P<discount>\d+(?:\.\d+)?)\s*(?:%|percent\b)\s*discount\b"
+    r"|(?P<interest>\d+(?:\.\d+)?)\s*(?:%|percent\b)\s*(?:annual\s+)?interest\b"
+    r"|(?P<term>\d+(?:\.\d+)?)\s*(?P<unit>years?|months?)\b)",
+    re.I,
+)
+
+
+def _parse_word_number(words: str) -> Optional[float]:
+    total, current = 0, 0
+    for word in re.split(r"[\s-]+", words.lower().strip()):
+        if word == "and" or not word:
+            continue
+        if word == "hundred":
+            current = max(current, 1) * 100
+        elif word in WORD_NUMBERS:
+            current += WORD_NUMBERS[word]
+        else:
+            return None
+    total += current
+    return float(total) if total else None
+
+
+def _as_number(value: float) -> Any:
+    """Returns ints for whole values so slots look like the LLM's output (e.g. 5000000)."""
+    return int(value) if float(value).is_integer() else value
+
+
+def parse_round_type(message: str) -> Optional[str]:
+    match = _ROUND_TYPE_RE.search(message)
+    if not match:
+        return None
+    pre_seed, seed, series, series_num, letter_round, bridge = match.groups()
+    if pre_seed:
+        return "Pre-Seed"
+    if seed:
+        return "Seed"
+    if bridge:
+        return "Bridge"
+    letter = (series or letter_round).upper()
+    return f"Series {letter}-{series_num}" if series_num else f"Series {letter}"
+
+
+def _money_value(text: str) -> float:
+    match = _NUMBER_RE.search(text)
+    return float(match.group("num").replace(",", "")) * MULTIPLIERS.get((match.group("suf") or "").lower(), 1)
+
+
+def parse_convertibles(message: str) -> Tuple[List[Dict[str, Any]], str]:
+    """
+    Finds SAFEs and convertible notes with their cap, discount and interest terms.
+    Returns them as financing events (see waterfall.py) plus the message with
+    those phrases blanked out, so their numbers aren't read as round slots.
+    """
+    convertibles = []
+    for match in list(_CONVERTIBLE_RE.finditer(message)):
+        kind = "safe" if match.group("kind").lower().startswith("safe") else "note"
+        event: Dict[str, Any] = {"type": kind, "amount": _as_number(_money_value(match.group("amount")))}
+        if match.group("cap_type"):
+            event["capType"] = match.group("cap_type").lower()
+        end = match.end()
+        while True:
+            term = _CONVERTIBLE_TERM_RE.match(message, end)
+            if not term:
+                break
+            if term.group("cap"):
+                event["cap"] = _as_number(_money_value(term.group("cap")))
+                if term.group("cap_type"):
+                    event["capType"] = term.group("cap_type").lower()
+            elif term.group("discount"):
+                event["discount"] = _as_number(float(term.group("discount")))
+            elif term.group("interest"):
+                event["interestPct"] = _as_number(float(term.group("interest")))
+            else:
+                months = float(term.group("term")) * (1 if term.group("unit").lower().startswith("month") else 12)
+                event["years"] = _as_number(months / 12)
+            end = term.end()
+        convertibles.append(event)
+        message = message[:match.start()] + " " * (end - match.start()) + message[end:]
+    return convertibles, message
+
+
+def _find_values(message: str) -> List[Tuple[int, int, str, float]]:
+    """
+    Finds numeric values in the message.
+    Returns (start, end, kind, value) where kind is 'money', 'pct' or 'bare'.
+    """
+    # Blank out round types first so "Series A-1" is not read as the number 1
+    masked = _ROUND_TYPE_RE.sub(lambda m: " " * len(m.group(0)), message)
+    found = []
+    for m in _WORD_NUMBER_RE.finditer(masked):
+        base = _parse_word_number(m.group("words"))
+        if base is not None:
+            found.append((m.start(), m.end(), "money", base * MULTIPLIERS[m.group("suf").lower()]))
+        masked = masked[:m.start()] + " " * (m.end() - m.start()) + masked[m.end():]
+    for m in _NUMBER_RE.finditer(masked):
+        num = float(m.group("num").replace(",", ""))
+        suffix = (m.group("suf") or "").lower()
+        if m.group("pct"):
+            found.append((m.start(), m.end(), "pct", num))
+        elif suffix or m.group("cur"):
+            found.append((m.start(), m.end(), "money", num * MULTIPLIERS.get(suffix, 1)))
+        else:
+            found.append((m.start(), m.end(), "bare", num))
+    return sorted(found)
+
+
+def _label_money(message: str, start: int, end: int, prev_end: int, next_start: int) -> Optional[str]:
+    before = message[max(prev_end, start - 30):start]
+    after = message[end:min(next_start, end + 20)]
+    if POST_MONEY.search(before) or POST_MONEY.match(after.strip()):
+        return "postMoney"
+    if PRE_MONEY_AFTER.match(after) or PRE_MONEY_BEFORE.search(before):
+        return "preMoney"
+    if AMOUNT_BEFORE.search(before) or AMOUNT_AFTER.match(after):
+        return "amount"
+    return None
+
+
+# --- Parser ---
+def parse_slot_message(message: str, last_prompted_slot: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    Deterministically extracts slots from a chat message.
+    Returns a dict of slot values, or None when the message can't be resolved
+    with confidence and the caller should fall back to the LLM.
+    """
+    if not message or not message.strip():
+        return None
+
+    slots: Dict[str, Any] = {}
+    convertibles, message = parse_convertibles(message)
+    if convertibles:
+        slots["convertibles"] = convertibles
+    timing = POOL_TIMING_RE.search(message)
+    if timing:
+        slots["poolTiming"] = timing.group(1).lower()
+        message = POOL_TIMING_RE.sub(lambda m: " " * len(m.group(0)), message)
+
+    round_type = parse_round_type(message)
+    if round_type:
+        slots["roundType"] = round_type
+
+    values = _find_values(message)
+    unlabeled_money = []
+    labeled_money: Dict[str, int] = {}  # Slot -> start of the value this message labeled for it
+    for i, (start, end, kind, value) in enumerate(values):
+        prev_end = values[i - 1][1] if i > 0 else 0
+        next_start = values[i + 1][0] if i + 1 < len(values) else len(message)
+
+        if kind == "pct":
+            if not 0 <= value < 100 or "poolPct" in slots:
+                return None
+            slots["poolPct"] = _as_number(value)
+            continue
+
+        if kind == "bare":
+            context = message[max(prev_end, start - 20):min(next_start, end + 20)]
+            if POOL_WORDS.search(context) or last_prompted_slot == "poolPct" and len(values) == 1:
+                if not 0 <= value < 100 or "poolPct" in slots:
+                    return None
+                slots["poolPct"] = _as_number(value)
+                continue
+            if value < MIN_BARE_DOLLARS:
+                return None  # "5" for an amount: dollars or millions? Let the LLM decide
+            kind = "money"
+
+        label = _label_money(message, start, end, prev_end, next_start)
+        if label == "postMoney":
+            return None  # Needs arithmetic against the amount; leave to the LLM
+        if label is None:
+            unlabeled_money.append((start, end, value))
+        elif label in slots:
+            return None
+        else:
+            slots[label] = _as_number(value)
+            labeled_money[label] = start
+
+    # Resolve unlabeled money values from conversation context
+    free_slots = [s for s in MONEY_SLOTS if s not in slots]
+    if len(unlabeled_money) == 1 and labeled_money:
+        # "raised 5m last year, now raising 10m": the message labels its own values, so an unlabeled
+        # one is likely about something else. Only "$5M at $20M pre-money" still reads as the amount.
+        start, end, value = unlabeled_money[0]
+        pre_start = labeled_money.get("preMoney")
+        if "amount" in free_slots and pre_start is not None and pre_start > end and _AT_RE.fullmatch(message[end:pre_start]):
+            slots["amount"] = _as_number(value)
+        else:
+            return None
+    elif len(unlabeled_money) == 1:
+        if last_prompted_slot in free_slots:
+            slots[last_prompted_slot] = _as_number(unlabeled_money[0][2])
+        elif len(free_slots) == 1:
+            slots[free_slots[0]] = _as_number(unlabeled_money[0][2])
+        else:
+            return None
+    elif len(unlabeled_money) == 2 and len(free_slots) == 2:
+        # "$5M at $20M" -> amount at pre-money
+        first, second = unlabeled_money
+        if _AT_RE.fullmatch(message[first[1]:second[0]]):
+            slots["amount"] = _as_number(first[2])
+            slots["preMoney"] = _as_number(second[2])
+        else:
+            return None
+    elif unlabeled_money:
+        return None
+
+    return slots or None
@@ -0,0 +1,16 @@
+import os
+import sys
+
+# The server modules import each other as top-level modules (run from server/)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from cap_table import InvestorColumns
+
+
+def investor_columns(shares, name="Founder"):
+    """InvestorColumns for holders "<name> 0", "<name> 1", ... with the given pre-round shares."""
+    shares = np.asarray(shares, dtype=np.float64)
+    return InvestorColumns(names=[f"{name} {i}" for i in range(len(shares))], pre_shares=shares,
+                           investment=np.zeros(len(shares)), row_nums=list(range(len(shares))))
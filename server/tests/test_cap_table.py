@@ -0,0 +1,39 @@
+from fractions import Fraction
+
+import numpy as np
+import pytest
+
+from cap_table import compute_round
+from conftest import investor_columns
+
+SLOTS = {"roundType": "Series A", "amount": 3333333, "preMoney": 17000001, "poolPct": 12.5}
+
+
+@pytest.mark.parametrize("shares", [
+    [1000000, 333333, 777777],
+    [1000.5, 2000.25, 3000.25, 1.0],  # Fractional cells
+    np.random.default_rng(0).integers(1, 10 ** 7, 5000),
+])
+def test_exact_ownership_sums_to_one(shares):
+    calcs = compute_round(SLOTS, investor_columns(shares), precision="exact")
+    assert calcs["precision"] == "exact"
+    # Every percentage is a multiple of 2**-40, so the float total is exact too
+    assert sum(Fraction(pct) for pct in calcs["final_ownership_pct"].values()) == 1
+    assert sum(calcs["final_ownership_pct"].values()) == 1.0
+
+
+def test_exact_shares_are_whole_and_add_up():
+    calcs = compute_round(SLOTS, investor_columns([1000.5, 2000.25, 3000.25, 1.0]), precision="exact")
+    counts = calcs["final_share_counts"]
+    assert all(isinstance(count, int) for count in counts.values())
+    assert sum(counts.values()) == calcs["total_post_money_shares"]
+
+
+def test_exact_matches_float_within_a_share():
+    columns = investor_columns([1000000, 333333, 777777])
+    exact = compute_round(SLOTS, columns, precision="exact")
+    approx = compute_round(SLOTS, columns, precision="float")
+    assert approx["precision"] == "float"
+    for key in ("total_new_shares_for_round", "option_pool_shares", "total_post_money_shares"):
+        assert exact[key] == pytest.approx(approx[key], abs=1)
+    assert exact["price_per_share"] == pytest.approx(approx["price_per_share"])
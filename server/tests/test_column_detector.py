@@ -0,0 +1,53 @@
+import numpy as np
+
+from column_detector import HEURISTIC_CONFIDENCE_THRESHOLD, detect_column_mapping
+from sheet_columns import ColumnarSheet
+
+
+def _cap_table(n=20):
+    return [[f"Investor {i}", str(1000 * (i + 1)), str(50000 * (i + 1))] for i in range(n)]
+
+
+def test_detects_labelled_columns():
+    sheet = [["Shareholder", "Investment ($)", "Shares Held"]] + _cap_table()
+    mapping, confidence = detect_column_mapping(sheet)
+    assert mapping == {"shareholder_name_col_idx": 0, "pre_round_shares_col_idx": 2, "pre_round_investment_col_idx": 1}
+    assert confidence >= HEURISTIC_CONFIDENCE_THRESHOLD
+
+
+def test_detects_reordered_columns():
+    sheet = [["Common Shares", "Investor Name"]] + [[shares, name] for name, _, shares in _cap_table()]
+    mapping, confidence = detect_column_mapping(sheet)
+    assert mapping["shareholder_name_col_idx"] == 1
+    assert mapping["pre_round_shares_col_idx"] == 0
+    assert mapping["pre_round_investment_col_idx"] is None
+    assert confidence >= HEURISTIC_CONFIDENCE_THRESHOLD
+
+
+def test_skips_blank_rows():
+    sheet = [["Name", "Investment", "Shares"], ["", "", ""]] + _cap_table() + [[None, None, None]]
+    mapping, _ = detect_column_mapping(sheet)
+    assert mapping == {"shareholder_name_col_idx": 0, "pre_round_shares_col_idx": 2, "pre_round_investment_col_idx": 1}
+
+
+def test_opaque_headers_fall_back_to_llm():
+    sheet = [["Col A", "Col B", "Col C"]] + [[name, shares, shares] for name, _, shares in _cap_table()]
+    _, confidence = detect_column_mapping(sheet)
+    assert confidence < HEURISTIC_CONFIDENCE_THRESHOLD
+
+
+def test_empty_sheet():
+    mapping, confidence = detect_column_mapping([[], ["", ""]])
+    assert set(mapping.values()) == {None}
+    assert confidence == 0.0
+
+
+def test_columnar_sheet_matches_rows():
+    rows = _cap_table(500)
+    names = [name for name, _, _ in rows]
+    names[7] = ""
+    investment = np.array([float(inv) for _, inv, _ in rows])
+    shares = np.array([float(s) for _, _, s in rows])
+    shares[7] = np.nan
+    sheet = ColumnarSheet([names, investment, shares], header=["Name", "Investment", "Shares"])
+    assert detect_column_mapping(sheet) == detect_column_mapping(sheet.to_rows())
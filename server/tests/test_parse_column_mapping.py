@@ -0,0 +1,31 @@
+import pytest
+
+import model
+from model import parse_column_mapping
+
+MAPPING = {"shareholder_name_col_idx": 0, "pre_round_shares_col_idx": 2, "pre_round_investment_col_idx": None}
+FREE_FORM = ('Here is the mapping:\n{\n  "column_mapping": {\n    "shareholder_name_col_idx": 0,\n'
+             '    "pre_round_shares_col_idx": 2,\n    "pre_round_investment_col_idx": null,\n  }\n}\nDone.')
+
+
+def test_grammar_output_parses_directly():
+    raw = '{"column_mapping": {"shareholder_name_col_idx": 0, "pre_round_shares_col_idx": 2, "pre_round_investment_col_idx": null}}'
+    assert parse_column_mapping(raw, free_form=False) == MAPPING
+
+
+def test_invalid_grammar_output_is_an_error_not_repaired():
+    with pytest.raises(ValueError, match="Grammar-constrained"):
+        parse_column_mapping(FREE_FORM, free_form=False)
+
+
+def test_free_form_output_goes_through_the_repair_paths():
+    assert parse_column_mapping(FREE_FORM, free_form=True) == MAPPING
+
+
+def test_repair_only_runs_with_llm_grammar_off(monkeypatch):
+    monkeypatch.setattr(model, "GRAMMAR_ENABLED", False)
+    assert parse_column_mapping(FREE_FORM) == MAPPING
+    monkeypatch.setattr(model, "GRAMMAR_ENABLED", True)
+    monkeypatch.setattr(model, "LlamaGrammar", object)
+    with pytest.raises(ValueError):
+        parse_column_mapping(FREE_FORM)
@@ -0,0 +1,198 @@
+import asyncio
+import threading
+
+import httpx
+import pytest
+
+import plan_dedup as plan_dedup_module
+from op_codec import dumps
+from plan_dedup import PlanDeduplicator, plan_request_key
+from result_store import InMemoryResultStore
+
+SLOTS = {"roundType": "Series A", "amount": 5000000, "preMoney": 20000000, "poolPct": 10}
+SHEET = [["Investor 0", "50000", "1000"], ["Investor 1", "100000", "2000"]]
+MAPPING = {"shareholder_name_col_idx": 0, "pre_round_shares_col_idx": 2, "pre_round_investment_col_idx": 1}
+PLAN_BODY = {"slots": SLOTS, "sheetData": SHEET, "selectedRangeAddress": "A1:C2"}
+COMPLETED = {"status": "completed", "result": {"ops": []}}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(plan_dedup_module.time, "monotonic", fake)
+    return fake
+
+
+def test_request_key_covers_every_field():
+    key = plan_request_key(SLOTS, SHEET, "A1:C2", "values")
+    assert key == plan_request_key(dict(SLOTS), [list(row) for row in SHEET], "A1:C2", "values")
+    assert key != plan_request_key(dict(SLOTS, poolPct=12), SHEET, "A1:C2", "values")
+    assert key != plan_request_key(SLOTS, SHEET[:1], "A1:C2", "values")
+    assert key != plan_request_key(SLOTS, SHEET, "A1:C3", "values")
+    assert key != plan_request_key(SLOTS, SHEET, "A1:C2", "formulas")
+
+
+def _dedup(**kwargs):
+    """A deduplicator over its own result store, as main wires it to task_results."""
+    store = InMemoryResultStore()
+    return PlanDeduplicator(store, **kwargs), store
+
+
+def _finish(dedup, store, key, task_id, value=COMPLETED):
+    store[task_id] = value
+    dedup.complete(key, task_id)
+
+
+def test_identical_requests_attach_to_the_inflight_task(clock):
+    dedup, _ = _dedup()
+    assert dedup.acquire("k", "task-1") == ("new", "task-1")
+    assert dedup.acquire("k", "task-2") == ("inflight", "task-1")
+    assert dedup.acquire("other", "task-3") == ("new", "task-3")
+    stats = dedup.stats()
+    assert (stats["inflight"], stats["inflight_hits"], stats["misses"]) == (2, 1, 2)
+
+
+def test_completed_result_is_served_from_the_store_until_it_expires(clock):
+    dedup, store = _dedup(ttl_seconds=60)
+    dedup.acquire("k", "task-1")
+    _finish(dedup, store, "k", "task-1")
+    assert dedup.acquire("k", "task-2") == ("cached", ("task-1", dumps(COMPLETED)))
+    clock.now += 59
+    assert dedup.acquire("k", "task-3")[0] == "cached"
+    clock.now += 2
+    assert dedup.acquire("k", "task-4") == ("new", "task-4")
+    assert dedup.stats()["evictions"] == 1
+
+
+def test_cache_hits_leave_the_result_to_its_own_poller(clock):
+    dedup, store = _dedup()
+    dedup.acquire("k", "task-1")
+    _finish(dedup, store, "k", "task-1")
+    dedup.acquire("k", "task-2")
+    clock.now += store.fetched_grace_seconds + 1
+    assert store.fetch("task-1") == COMPLETED
+
+
+def test_result_gone_from_the_store_is_a_miss(clock):
+    dedup, store = _dedup()
+    dedup.acquire("k", "task-1")
+    _finish(dedup, store, "k", "task-1")
+    store.fetch("task-1")
+    clock.now += store.fetched_grace_seconds + 1
+    assert dedup.acquire("k", "task-2") == ("new", "task-2")
+
+
+def test_release_frees_the_key_without_caching(clock):
+    dedup, _ = _dedup()
+    dedup.acquire("k", "task-1")
+    dedup.release("k", "task-1")
+    assert dedup.acquire("k", "task-2") == ("new", "task-2")
+    assert dedup.stats()["cached_results"] == 0
+
+
+def test_only_the_owning_task_ends_the_inflight_entry(clock):
+    dedup, store = _dedup()
+    dedup.acquire("k", "task-1")
+    dedup.release("k", "task-2")
+    _finish(dedup, store, "k", "task-2")
+    assert dedup.acquire("k", "task-3") == ("inflight", "task-1")
+
+
+def test_result_index_is_bounded(clock):
+    dedup, store = _dedup(max_entries=2)
+    for i in range(3):
+        dedup.acquire(f"k{i}", f"task-{i}")
+        _finish(dedup, store, f"k{i}", f"task-{i}")
+    assert dedup.stats()["cached_results"] == 2
+    assert dedup.acquire("k0", "task-9") == ("new", "task-9")
+    assert dedup.acquire("k2", "task-10")[0] == "cached"
+
+
+# --- /plan endpoint ---
+
+@pytest.fixture
+def app(monkeypatch):
+    import main
+    main.plan_dedup.clear()
+    monkeypatch.setattr(main, "PLAN_DEDUP_ENABLED", True)
+    return main
+
+
+def _paused_lookup(monkeypatch, main, mapping_lookup):
+    """Holds the first request inside its mapping lookup until `release` is set."""
+    entered, release = threading.Event(), threading.Event()
+
+    def lookup(task_id, sheet_data):
+        entered.set()
+        assert release.wait(5)
+        return main.TaskTimings(), mapping_lookup
+
+    monkeypatch.setattr(main, "timed_mapping_lookup", lookup)
+    return entered, release
+
+
+def _double_submit(main, entered, release):
+    """Sends an identical /plan while the first one is still resolving its mapping."""
+    async def scenario():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            first = asyncio.ensure_future(client.post("/plan", json=PLAN_BODY))
+            assert await asyncio.to_thread(entered.wait, 5)
+            second = await client.post("/plan", json=PLAN_BODY)
+            attached_poll = await client.get(f"/plan/result/{second.json()['task_id']}")
+            release.set()
+            first = await first
+            final_poll = await client.get(f"/plan/result/{second.json()['task_id']}")
+            return first, second, attached_poll, final_poll
+
+    return asyncio.run(scenario())
+
+
+def test_identical_plan_during_mapping_lookup_polls_the_owning_task(monkeypatch, app):
+    entered, release = _paused_lookup(monkeypatch, app, (MAPPING, "cache", "fingerprint"))
+    first, second, attached_poll, final_poll = _double_submit(app, entered, release)
+
+    assert first.status_code == 202
+    assert second.json()["deduplicated"] == "inflight"
+    assert second.json()["task_id"] == first.json()["task_id"]
+    assert attached_poll.status_code == 200
+    assert attached_poll.json()["status"] == "processing"
+    assert final_poll.json()["status"] == "completed"
+
+
+def test_busy_plan_fails_attached_requests_with_retry_after(monkeypatch, app):
+    monkeypatch.setattr(app.inference_pool, "is_saturated", lambda: True)
+    monkeypatch.setattr(app.inference_pool, "retry_after", lambda: 7)
+    entered, release = _paused_lookup(monkeypatch, app, (None, "llm", "fingerprint"))
+    first, second, attached_poll, final_poll = _double_submit(app, entered, release)
+
+    assert first.status_code == 429
+    assert second.json()["deduplicated"] == "inflight"
+    assert final_poll.status_code == 200
+    assert final_poll.json()["status"] == "failed"
+    assert final_poll.json()["retry_after"] == 7
+    # The key was released: the next identical request starts over
+    assert app.plan_dedup.stats()["inflight"] == 0
+
+
+def test_failed_mapping_lookup_releases_the_key(monkeypatch, app):
+    def lookup(task_id, sheet_data):
+        raise RuntimeError("lookup failed")
+
+    monkeypatch.setattr(app, "timed_mapping_lookup", lookup)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/plan", json=PLAN_BODY)
+
+    assert asyncio.run(scenario()).status_code == 500
+    assert app.plan_dedup.stats()["inflight"] == 0
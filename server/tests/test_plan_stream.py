@@ -0,0 +1,57 @@
+import asyncio
+
+import httpx
+import pytest
+
+SLOTS = {"roundType": "Series A", "amount": 5000000, "preMoney": 20000000, "poolPct": 10}
+SHEET = [["Investor 0", "50000", "1000"], ["Investor 1", "100000", "2000"]]
+MAPPING = {"shareholder_name_col_idx": 0, "pre_round_shares_col_idx": 2, "pre_round_investment_col_idx": 1}
+PLAN_BODY = {"slots": SLOTS, "sheetData": SHEET, "selectedRangeAddress": "A1:C2"}
+
+
+@pytest.fixture
+def app(monkeypatch):
+    import main
+    main.plan_dedup.clear()
+    monkeypatch.setattr(main, "PLAN_DEDUP_ENABLED", True)
+    return main
+
+
+def _events(body: str):
+    return [block.split("\n", 1)[0][len("event: "):] for block in body.strip().split("\n\n")]
+
+
+def _post_all(main, *paths):
+    async def scenario():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return [await client.post(path, json=PLAN_BODY) for path in paths]
+
+    return asyncio.run(scenario())
+
+
+def test_disconnected_stream_marks_the_task_failed(app):
+    task_id = "stream-task"
+    app.task_results[task_id] = {"status": "processing"}
+    events = app.stream_plan_events(task_id, SLOTS, SHEET, "A1:C2", "values", app.TaskTimings(),
+                                    (MAPPING, "cache", "fingerprint"))
+    assert next(events).startswith("event: accepted")
+    events.close()  # What Starlette does when the client goes away
+    assert app.task_results.get(task_id)["status"] == "failed"
+
+
+def test_stream_shares_plan_dedup(monkeypatch, app):
+    lookups = []
+
+    def lookup(task_id, sheet_data):
+        lookups.append(task_id)
+        return app.TaskTimings(), (MAPPING, "cache", "fingerprint")
+
+    monkeypatch.setattr(app, "timed_mapping_lookup", lookup)
+    planned, streamed = _post_all(app, "/plan", "/plan/stream")
+
+    assert planned.status_code == 202
+    assert len(lookups) == 1  # The stream replayed the /plan result
+    events = _events(streamed.text)
+    assert events[0] == "accepted" and events[-1] == "done"
+    assert "ops" in events and "llm_delta" not in events
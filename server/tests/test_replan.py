@@ -0,0 +1,87 @@
+import itertools
+
+import pytest
+
+from plan_ops import build_structured_ops, perform_cap_table_calculations
+from replan import diff_ops
+from sheet_address import top_left
+
+SLOTS = {"roundType": "Series A", "amount": 5000000, "preMoney": 20000000, "poolPct": 10}
+MAPPING = {"shareholder_name_col_idx": 0, "pre_round_shares_col_idx": 2, "pre_round_investment_col_idx": 1}
+
+
+def _plan(n_investors, slots=SLOTS):
+    sheet = [[f"Investor {i}", str(1000 * (i + 1)), str(50000 * (i + 1))] for i in range(n_investors)]
+    calcs = perform_cap_table_calculations(slots, sheet, MAPPING)
+    return build_structured_ops(slots, sheet, f"A1:C{len(sheet)}", MAPPING, calcs)
+
+
+def _render(ops, cells=None):
+    """Applies ops the way the add-in does: None cells are skipped, "" blanks a cell."""
+    cells = dict(cells or {})
+    for op in ops:
+        col, row = top_left(op["range"])
+        if op["type"] == "formula":
+            cells[(row, col)] = op["formula"]
+            continue
+        for r, values in enumerate(op.get("values") or []):
+            for c, value in enumerate(values):
+                if value is not None:
+                    cells[(row + r, col + c)] = value
+    return {cell: value for cell, value in cells.items() if value != ""}
+
+
+def _diff(old_ops, new_ops):
+    counter = itertools.count(1)
+    return diff_ops(old_ops, new_ops, lambda: f"op-{next(counter)}")
+
+
+def test_unchanged_plan_has_no_ops():
+    assert _diff(_plan(5), _plan(5)) == []
+
+
+def test_slot_change_rewrites_only_changed_rows():
+    old_ops, new_ops = _plan(5), _plan(5, dict(SLOTS, poolPct=12))
+    changed = _diff(old_ops, new_ops)
+    assert changed
+    assert all(op["note"] != "Clear" for op in changed)
+    assert _render(changed, _render(old_ops)) == _render(new_ops)
+
+
+def test_grown_table_writes_new_rows_without_clears():
+    old_ops, new_ops = _plan(5), _plan(8)
+    changed = _diff(old_ops, new_ops)
+    assert all(op["note"] != "Clear" for op in changed)
+    assert _render(changed, _render(old_ops)) == _render(new_ops)
+
+
+def test_shrunk_table_clears_stale_cells_as_blocks():
+    old_ops, new_ops = _plan(40), _plan(10)
+    changed = _diff(old_ops, new_ops)
+    assert _render(changed, _render(old_ops)) == _render(new_ops)
+    clears = [op for op in changed if op["note"] == "Clear"]
+    assert clears
+    # The stale investor rows (less the new totals) clear as one rectangle, not a write per cell or row
+    heights = sorted(len(op["values"]) for op in clears)
+    assert heights[-1] >= 25
+    assert len(clears) <= 5
+    assert all(all(value == "" for row in op["values"] for value in row) for op in clears)
+    assert [op["id"] for op in changed] == [f"op-{i}" for i in range(1, len(changed) + 1)]
+
+
+def test_rejected_replan_leaves_the_state_unchanged():
+    from main import run_replan
+    from replan import PlanState
+
+    sheet = [[f"Investor {i}", str(1000 * (i + 1)), str(50000 * (i + 1))] for i in range(5)]
+    state = PlanState(slots=dict(SLOTS), sheet_data=[list(row) for row in sheet], selected_range_address="A1:C5",
+                      column_mapping=MAPPING, mapping_source="cache", ops=_plan(5))
+    run_replan(state, {"poolPct": 12}, {0: ["Investor 0", "1500", "50000"]})  # Parses the columns once
+    before = (dict(state.slots), [list(row) for row in state.sheet_data], state.columns.pre_shares.tolist(),
+              list(state.columns.names), state.ops)
+
+    with pytest.raises(ValueError):
+        # The pre-money pool needs the waterfall, which rejects a pool of 100% or more
+        run_replan(state, {"poolPct": 150, "poolTiming": "pre"}, {1: ["Renamed", "9999", "1"]})
+    after = (state.slots, state.sheet_data, state.columns.pre_shares.tolist(), state.columns.names, state.ops)
+    assert after == before
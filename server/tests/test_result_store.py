@@ -0,0 +1,78 @@
+import pytest
+
+import result_store
+from result_store import InMemoryResultStore, SQLiteResultStore
+
+PROCESSING = {"status": "processing"}
+COMPLETED = {"status": "completed", "result": {"ops": []}}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(result_store.time, "monotonic", fake)
+    monkeypatch.setattr(result_store.time, "time", fake)
+    return fake
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_store(request, tmp_path):
+    def make(**kwargs):
+        if request.param == "sqlite":
+            return SQLiteResultStore(path=tmp_path / "results.sqlite3", **kwargs)
+        return InMemoryResultStore(**kwargs)
+    return make
+
+
+def test_size_cap_never_evicts_processing_tasks(clock, make_store):
+    store = make_store(max_entries=2)
+    store["running"] = PROCESSING
+    for i in range(4):
+        clock.now += 1
+        store[f"done-{i}"] = COMPLETED
+    assert store.get("running") == PROCESSING
+    assert store.get("done-0") is None and store.get("done-1") is None
+    assert store.get("done-3") == COMPLETED
+    assert store.stats()["evictions"]["size"] == 2
+
+
+def test_finished_result_expires_after_its_fetch_grace(clock, make_store):
+    store = make_store(ttl_seconds=100, fetched_grace_seconds=5)
+    store["task"] = COMPLETED
+    assert store.fetch("task") == COMPLETED
+    clock.now += 4
+    assert store.fetch("task") == COMPLETED  # A re-poll within the grace still succeeds
+    clock.now += 2
+    store["other"] = PROCESSING  # Writes sweep what is due
+    assert store.get("task") is None
+    assert store.stats()["evictions"]["fetched"] == 1
+
+
+def test_unfetched_results_expire_by_ttl(clock, make_store):
+    store = make_store(ttl_seconds=10)
+    store["old"] = PROCESSING
+    clock.now += 5
+    store["new"] = PROCESSING
+    clock.now += 6
+    store["newest"] = PROCESSING
+    assert store.get("old") is None
+    assert store.get("new") == PROCESSING
+    assert store.stats()["evictions"]["ttl"] == 1
+
+
+def test_re_put_keeps_the_latest_expiry():
+    store = InMemoryResultStore(ttl_seconds=10)
+    store["task"] = PROCESSING
+    for _ in range(200):
+        store["task"] = PROCESSING
+    # Stale heap items are compacted, not kept per write
+    assert len(store._expiry_heap) <= 2 * len(store) + 64
+    assert store.get("task") == PROCESSING
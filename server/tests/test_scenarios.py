@@ -0,0 +1,101 @@
+import time
+
+import numpy as np
+import pytest
+
+import scenarios
+from cap_table import compute_round
+from conftest import investor_columns
+from plan_ops import compute_plan
+from scenarios import build_scenario_arrays, sensitivity_table_op, summarize_scenarios
+
+METRICS = ("post_money_valuation", "price_per_share", "total_new_shares_for_round",
+           "option_pool_shares", "total_post_money_shares")
+
+
+def _sweep(slots, grid, columns, include_holder_ownership=True):
+    arrays = build_scenario_arrays(slots, [], grid)
+    return summarize_scenarios(columns, arrays, slots, include_holder_ownership)
+
+
+@pytest.mark.parametrize("slots", [
+    {"roundType": "Series A", "amount": 5000000, "preMoney": 20000000, "poolPct": 10},
+    {"roundType": "Series A", "amount": 5000000, "preMoney": 20000000, "poolPct": 10,
+     "convertibles": [{"amount": 1000000, "cap": 10000000}]},
+    {"roundType": "Series A", "amount": 5000000, "preMoney": 20000000, "poolPct": 10, "poolTiming": "pre"},
+])
+def test_sweep_cell_matches_the_single_plan(slots):
+    columns = investor_columns([6000000, 3000000, 1000000])
+    grid = {"amount": [4000000, 5000000], "preMoney": [20000000, 30000000]}
+    body, results = _sweep(slots, grid, columns)
+
+    # Grid order: amount varies slowest, so (5M, 20M) is the third scenario
+    scenario = body["scenarios"][2]
+    assert (scenario["amount"], scenario["preMoney"]) == (5000000, 20000000)
+    plan = compute_plan(slots, columns)
+    for metric in METRICS:
+        assert scenario[metric] == pytest.approx(plan[metric])
+    for name, pct in zip(columns.names, body["holder_ownership"][2]):
+        assert pct == pytest.approx(plan["final_ownership_pct"][name])
+
+
+def test_sensitivity_table_uses_the_waterfall_for_safes():
+    slots = {"roundType": "Series A", "amount": 5000000, "preMoney": 20000000, "poolPct": 10,
+             "convertibles": [{"amount": 1000000, "cap": 10000000}]}
+    columns = investor_columns([9000000])
+    grid = {"amount": [4000000, 5000000], "preMoney": [20000000, 30000000]}
+    _, results = _sweep(slots, grid, columns)
+    op = sensitivity_table_op(grid, results, 0, "price_per_share", "A1:C1", lambda: "op-1")
+    assert op["values"][2][1] == pytest.approx(compute_plan(slots, columns)["price_per_share"])
+
+
+@pytest.mark.parametrize("pool_timing", ["post", "pre"])
+def test_every_waterfall_cell_matches_its_plan_across_conversion_branches(pool_timing):
+    # The cap wins at high pre-money and the discount at low: the grid crosses the switch
+    slots = {"roundType": "Series A", "amount": 5000000, "preMoney": 20000000, "poolPct": 10, "poolTiming": pool_timing,
+             "convertibles": [{"amount": 1000000, "cap": 12000000, "discount": 20},
+                              {"type": "note", "amount": 500000, "cap": 8000000, "interestPct": 6, "years": 2}]}
+    columns = investor_columns([6000000, 3000000, 1000000])
+    grid = {"preMoney": np.linspace(4e6, 40e6, 10).tolist(), "poolPct": [0, 8, 15]}
+    body, _ = _sweep(slots, grid, columns)
+    for scenario, ownership in zip(body["scenarios"], body["holder_ownership"]):
+        plan = compute_plan({**slots, "preMoney": scenario["preMoney"], "poolPct": scenario["poolPct"]}, columns)
+        for metric in METRICS:
+            assert scenario[metric] == pytest.approx(plan[metric])
+        for name, pct in zip(columns.names, ownership):
+            assert pct == pytest.approx(plan["final_ownership_pct"][name])
+
+
+def test_exact_sweep_cell_matches_the_exact_plan(monkeypatch):
+    monkeypatch.setattr(scenarios, "CAP_TABLE_PRECISION", "exact")
+    slots = {"roundType": "Series A", "amount": 5000000, "preMoney": 20000000, "poolPct": 10}
+    columns = investor_columns([6000000.5, 3000000.25, 1000000.25])
+    body, _ = _sweep(slots, {"amount": [4000000, 5000000], "preMoney": [20000000, 30000000]}, columns)
+    plan = compute_round(slots, columns, precision="exact")
+    scenario = body["scenarios"][2]
+    for metric in METRICS:
+        assert scenario[metric] == plan[metric]  # Whole shares, same rounding
+    for name, pct in zip(columns.names, body["holder_ownership"][2]):
+        assert pct == pytest.approx(plan["final_ownership_pct"][name], abs=2 ** -40)
+
+
+@pytest.mark.parametrize("precision, extra_slots", [
+    ("float", {"convertibles": [{"amount": 1000000, "cap": 10000000, "discount": 20},
+                                {"type": "note", "amount": 500000, "discount": 15}]}),
+    ("float", {"poolTiming": "pre"}),
+    ("exact", {}),
+])
+def test_thousands_of_scenarios_finish_well_under_a_second(monkeypatch, precision, extra_slots):
+    monkeypatch.setattr(scenarios, "CAP_TABLE_PRECISION", precision)
+    slots = {"roundType": "Series A", "amount": 5000000, "preMoney": 20000000, "poolPct": 10, **extra_slots}
+    columns = investor_columns(np.random.default_rng(0).uniform(1e3, 1e6, 1000))
+    grid = {"amount": np.linspace(1e6, 1e7, 50).tolist(), "preMoney": np.linspace(1e7, 5e7, 50).tolist(), "poolPct": [5, 10]}
+    start = time.perf_counter()
+    body, _ = _sweep(slots, grid, columns, include_holder_ownership=False)
+    assert body["scenario_count"] == 5000
+    assert time.perf_counter() - start < 1.0
+
+
+def test_explicit_rounds_cannot_be_swept():
+    with pytest.raises(ValueError):
+        build_scenario_arrays({"rounds": [{"type": "priced", "amount": 1, "preMoney": 4}]}, [], {"amount": [1, 2]})
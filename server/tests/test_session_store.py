@@ -0,0 +1,53 @@
+import threading
+
+from session_store import SessionStore
+
+
+class FakeSession:
+    def __init__(self, session_id, history=None, omitted_messages=0):
+        self.session_id = session_id
+        self.history = history or []
+        self.omitted_messages = omitted_messages
+
+    def dict(self):
+        return {"session_id": self.session_id, "history": self.history, "omitted_messages": self.omitted_messages}
+
+
+def test_memory_cap_eviction_keeps_the_held_turn_lock():
+    store = SessionStore(FakeSession, path=None, max_in_memory=1)
+    store.save(FakeSession("a"))
+    entered, release = threading.Event(), threading.Event()
+    second_entered = threading.Event()
+
+    def first_turn():
+        with store.turn_lock("a"):
+            entered.set()
+            assert release.wait(5)
+
+    def second_turn():
+        with store.turn_lock("a"):
+            second_entered.set()
+
+    first = threading.Thread(target=first_turn)
+    first.start()
+    assert entered.wait(5)
+    store.save(FakeSession("b"))  # Evicts "a" from memory while its turn runs
+    assert store.stats()["evictions"]["memory_cap"] == 1
+    second = threading.Thread(target=second_turn)
+    second.start()
+    assert not second_entered.wait(0.2)
+    release.set()
+    first.join(5)
+    second.join(5)
+    assert second_entered.is_set()
+    assert store._turn_locks == {}
+
+
+def test_sqlite_file_is_created_on_first_use(tmp_path):
+    path = tmp_path / "cache" / "sessions.sqlite3"
+    store = SessionStore(FakeSession, path=path)
+    assert not path.parent.exists()
+    store.save(FakeSession("a"))
+    assert path.exists()
+    reopened = SessionStore(FakeSession, path=path)
+    assert reopened.get("a").session_id == "a"
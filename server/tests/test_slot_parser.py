@@ -0,0 +1,43 @@
+import pytest
+
+from slot_parser import parse_slot_message
+
+
+@pytest.mark.parametrize("message, last_prompted_slot, expected", [
+    ("Series A, raising $5M at $20M pre-money with a 10% pool", None,
+     {"roundType": "Series A", "amount": 5000000, "preMoney": 20000000, "poolPct": 10}),
+    ("$5M at $20M", None, {"amount": 5000000, "preMoney": 20000000}),
+    ("$5M at a $20M pre-money valuation", None, {"amount": 5000000, "preMoney": 20000000}),
+    ("five million", "amount", {"amount": 5000000}),
+    ("20M", "preMoney", {"preMoney": 20000000}),
+    ("12", "poolPct", {"poolPct": 12}),
+    ("we raised $3M", None, {"amount": 3000000}),
+    ("25000", "amount", {"amount": 25000}),
+    ("$2024", "amount", {"amount": 2024}),
+    ("B round, $5M at $20M", None, {"roundType": "Series B", "amount": 5000000, "preMoney": 20000000}),
+    # "a round" is the article, not Series A
+    ("We want to do a round at $20M pre", None, {"preMoney": 20000000}),
+    ("Seed with a $500k SAFE at a $5M cap", None,
+     {"roundType": "Seed", "convertibles": [{"type": "safe", "amount": 500000, "cap": 5000000}]}),
+])
+def test_parses_slots(message, last_prompted_slot, expected):
+    assert parse_slot_message(message, last_prompted_slot) == expected
+
+
+@pytest.mark.parametrize("message, last_prompted_slot", [
+    # The past raise must not land in the free pre-money slot
+    ("we raised 5m last year, now raising 10m", "amount"),
+    ("10m, pre-money 40m", "amount"),
+    # A year, not $2,024
+    ("2024", "amount"),
+    # $5 or $5M?
+    ("5", "amount"),
+    # Post-money needs arithmetic against the amount
+    ("$25M post-money", None),
+    # No round letter, just the article
+    ("raising a round", None),
+    ("a round", None),
+    ("", None),
+])
+def test_defers_to_llm(message, last_prompted_slot):
+    assert parse_slot_message(message, last_prompted_slot) is None
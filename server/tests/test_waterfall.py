@@ -0,0 +1,72 @@
+import logging
+
+import pytest
+
+import plan_ops
+from cap_table import compute_round
+from conftest import investor_columns
+from waterfall import compute_waterfall, events_from_slots, uses_waterfall
+
+
+def test_single_post_money_round_matches_compute_round():
+    slots = {"roundType": "Series A", "amount": 5000000, "preMoney": 20000000, "poolPct": 10}
+    columns = investor_columns([6000000, 3000000, 1000000])
+    assert not uses_waterfall(slots)
+    expected = compute_round(slots, columns, precision="float")
+    calcs = compute_waterfall(events_from_slots(slots), columns)
+    for key in ("post_money_valuation", "price_per_share", "total_new_shares_for_round",
+                "option_pool_shares", "total_post_money_shares"):
+        assert calcs[key] == pytest.approx(expected[key])
+    # The waterfall names the new holders after their round
+    for key in ("final_share_counts", "final_ownership_pct"):
+        holders = {"New Investors" if name == "Series A Investors" else name: value for name, value in calcs[key].items()}
+        assert holders == pytest.approx(expected[key])
+
+
+def test_pre_money_pool_dilutes_only_existing_holders():
+    slots = {"roundType": "Series A", "amount": 5000000, "preMoney": 20000000, "poolPct": 10, "poolTiming": "pre"}
+    assert uses_waterfall(slots)
+    calcs = compute_waterfall(events_from_slots(slots), investor_columns([10000000]))
+    # Pool X = 10% of the post-money total, carved out before the price: X = S0 / 7
+    assert calcs["option_pool_shares"] == pytest.approx(10000000 / 7)
+    assert calcs["price_per_share"] == pytest.approx(1.75)
+    ownership = calcs["final_ownership_pct"]
+    assert ownership["Option Pool"] == pytest.approx(0.10)
+    assert ownership["Series A Investors"] == pytest.approx(0.20)  # The investors get their full amount / post-money
+    assert ownership["Founder 0"] == pytest.approx(0.70)
+
+
+def test_post_money_safe_converts_at_its_cap():
+    slots = {"roundType": "Series A", "amount": 5000000, "preMoney": 20000000,
+             "convertibles": [{"amount": 1000000, "cap": 10000000}]}
+    calcs = compute_waterfall(events_from_slots(slots), investor_columns([9000000]))
+    conversion = calcs["rounds"][0]["conversions"][0]
+    # A $1M SAFE on a $10M post-money cap owns 10% of the pre-round company: C = S0 / 9
+    assert conversion["shares"] == pytest.approx(1000000)
+    assert conversion["conversion_price"] == pytest.approx(1.0)
+    assert calcs["price_per_share"] == pytest.approx(2.0)
+    assert calcs["final_ownership_pct"]["SAFE 1"] == pytest.approx(0.08)
+    assert sum(calcs["final_ownership_pct"].values()) == pytest.approx(1.0)
+
+
+def test_uncapped_safe_converts_at_its_discount():
+    events = [{"type": "safe", "amount": 1000000, "discount": 20},
+              {"type": "priced", "amount": 5000000, "preMoney": 20000000}]
+    calcs = compute_waterfall(events, investor_columns([9000000]))
+    conversion = calcs["rounds"][0]["conversions"][0]
+    assert conversion["conversion_price"] == pytest.approx(calcs["price_per_share"] * 0.8)
+    assert conversion["shares"] == pytest.approx(600000)
+
+
+def test_exact_mode_waterfall_plan_reports_float_precision(monkeypatch, caplog):
+    monkeypatch.setattr(plan_ops, "CAP_TABLE_PRECISION", "exact")
+    slots = {"roundType": "Series A", "amount": 5000000, "preMoney": 20000000, "poolPct": 10, "poolTiming": "pre"}
+    with caplog.at_level(logging.WARNING, logger="plan_ops"):
+        calcs = plan_ops.compute_plan(slots, investor_columns([10000000]))
+    assert calcs["precision"] == "float"
+    assert "float precision" in caplog.text
+
+
+def test_rejects_events_without_a_priced_round():
+    with pytest.raises(ValueError):
+        compute_waterfall([{"type": "safe", "amount": 1000000, "cap": 10000000}], investor_columns([1000000]))
@@ -0,0 +1,356 @@
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+import math
+
+import numpy as np
+
+from cap_table import InvestorColumns, add_holder_results
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+EVENT_TYPES = ("priced", "safe", "note")
+POOL_TIMINGS = ("pre", "post")
+# Default cap basis: post-money SAFEs are the common form today, notes are priced pre-money
+DEFAULT_CAP_TYPES = {"safe": "post", "note": "pre"}
+NOTE_DEFAULT_YEARS = 1.0  # Simple interest accrues for this long when a note gives no "years"
+MAX_REGIME_PASSES = 32  # See _solve_priced_round; two passes are typical
+
+
+# --- Financing Events ---
+def _number(event: Dict[str, Any], key: str, idx: int, default: Optional[float] = None) -> Optional[float]:
+    value = event.get(key)
+    if value is None or value == "":
+        return default
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Event {idx}: '{key}' must be a number, got {value!r}")
+    if not math.isfinite(number) or number < 0:
+        raise ValueError(f"Event {idx}: '{key}' must be a non-negative number, got {value!r}")
+    return number
+
+
+def normalize_events(events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Validates an ordered list of financing events and fills in defaults:
+
+      {"type": "priced", "roundType", "amount", "preMoney", "poolPct", "poolTiming": "post" | "pre"}
+      {"type": "safe", "name", "amount", "cap", "discount", "capType": "post" | "pre"}
+      {"type": "note", "name", "amount", "cap", "discount", "interestPct", "years", "capType"}
+
+    Money is in dollars, poolPct/discount/interestPct in percent. A SAFE or note
+    without cap and discount converts at the round price.
+    """
+    normalized = []
+    counts = {kind: 0 for kind in EVENT_TYPES}
+    for idx, event in enumerate(events):
+        if not isinstance(event, dict):
+            raise ValueError(f"Event {idx}: expected an object, got {type(event).__name__}")
+        kind = str(event.get("type", "priced")).lower()
+        if kind not in EVENT_TYPES:
+            raise ValueError(f"Event {idx}: unknown type '{kind}' (expected one of {', '.join(EVENT_TYPES)})")
+        counts[kind] += 1
+        amount = _number(event, "amount", idx, 0.0)
+
+        if kind == "priced":
+            timing = str(event.get("poolTiming") or "post").lower()
+            if timing not in POOL_TIMINGS:
+                raise ValueError(f"Event {idx}: poolTiming must be 'pre' or 'post', got {timing!r}")
+            pool_pct = _number(event, "poolPct", idx, 0.0)
+            if pool_pct >= 100:
+                raise ValueError(f"Event {idx}: poolPct must be below 100")
+            pre_money = _number(event, "preMoney", idx)
+            if not pre_money:
+                raise ValueError(f"Event {idx}: a priced round needs a positive preMoney")
+            round_type = event.get("roundType") or f"Round {counts['priced']}"
+            normalized.append({"type": kind, "roundType": str(round_type), "amount": amount, "preMoney": pre_money,
+                               "poolPct": pool_pct, "poolTiming": timing})
+            continue
+
+        discount = _number(event, "discount", idx, 0.0)
+        if discount >= 100:
+            raise ValueError(f"Event {idx}: discount must be below 100")
+        cap_type = str(event.get("capType") or DEFAULT_CAP_TYPES[kind]).lower()
+        if cap_type not in POOL_TIMINGS:
+            raise ValueError(f"Event {idx}: capType must be 'pre' or 'post', got {cap_type!r}")
+        interest_pct = _number(event, "interestPct", idx, 0.0) if kind == "note" else 0.0
+        years = _number(event, "years", idx, NOTE_DEFAULT_YEARS) if kind == "note" else 0.0
+        normalized.append({
+            "type": kind,
+            "name": str(event.get("name") or f"{'SAFE' if kind == 'safe' else 'Note'} {counts[kind]}"),
+            "amount": amount,
+            "cap": _number(event, "cap", idx) or None,  # 0 reads as uncapped
+            "discount": discount,
+            "capType": cap_type,
+            "interestPct": interest_pct,
+            "years": years,
+        })
+    return normalized
+
+
+def uses_waterfall(slots: Dict[str, Any]) -> bool:
+    """True when the slots need the event pipeline rather than compute_round's single post-money round."""
+    return bool(slots.get("rounds")) or bool(slots.get("convertibles")) or slots.get("poolTiming") == "pre"
+
+
+def events_from_slots(slots: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    The financing events the slots describe: slots["rounds"] as given, else the
+    chat's convertibles followed by one priced round from the round slots.
+    """
+    if slots.get("rounds"):
+        return list(slots["rounds"])
+    events = [{"type": "safe", **c} for c in slots.get("convertibles") or []]
+    events.append({
+        "type": "priced",
+        "roundType": slots.get("roundType"),
+        "amount": slots.get("amount"),
+        "preMoney": slots.get("preMoney"),
+        "poolPct": slots.get("poolPct"),
+        "poolTiming": slots.get("poolTiming"),
+    })
+    return events
+
+
+# --- Priced Round Solver ---
+def _solve_priced_rounds(round_type: str, amounts: np.ndarray, pre_moneys: np.ndarray, pool_pcts: np.ndarray,
+                         pre_pool: bool, base_shares: float, pool_shares: float, conv_amounts: np.ndarray,
+                         conv_discounts: np.ndarray, conv_caps: np.ndarray,
+                         conv_post_cap: np.ndarray) -> Tuple[Dict[str, np.ndarray], np.ndarray]:
+    """
+    Solves one priced round with its converting SAFEs/notes, for S variants of the
+    round (length-S `amounts`, `pre_moneys`, `pool_pcts`) at once. The unknowns are
+    circular: the price depends on the pre-money share count, which includes the
+    conversion shares (and the pool top-up for a pre-money pool), and those
+    depend on the price.
+
+      price           = preMoney / (S0 + C [+ X for a pre-money pool])
+      new shares      = amount / price
+      pool top-up X   = poolPct * total - existing pool, at least 0
+      conversion c_i  = amount_i / min(price * (1 - discount_i), cap_i / cap shares_i)
+      cap shares_i    = S0 + C for a post-money cap, S0 [+ X] for a pre-money cap
+
+    where S0 is the fully diluted count before the round and C the sum of c_i.
+    Once each security's price branch (discount or cap) and whether the pool
+    needs a top-up are fixed, every quantity is affine in C, so C solves in
+    closed form: C = sum(alpha) / (1 - sum(beta)), over arrays of securities.
+    The branches are then re-checked at that C, and a second pass settles them
+    in practice. Returns length-S arrays of the round summary values and the
+    S x K conversion shares of the K securities.
+    """
+    pool = pool_pcts / 100.0
+    if base_shares <= 0:
+        raise ValueError(f"{round_type}: no shares outstanding to price the round")
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Pool top-up as an affine function of C (pool_a + pool_b * C), from
+        # X = pool * (S0 + C + X + N) - E with N = amount * (pre-money shares) / preMoney
+        growth = pool * (pre_moneys + amounts) / pre_moneys
+        if pre_pool and np.any(growth >= 1):
+            pool_pct = pool_pcts[np.argmax(growth >= 1)].item()
+            raise ValueError(f"{round_type}: a {pool_pct:g}% pre-money pool can't fit in the "
+                             f"pre-money share of the post-money company")
+        pool_denominator = 1.0 - growth if pre_pool else 1.0 - pool
+        pool_a = (growth * base_shares - pool_shares) / pool_denominator
+        pool_b = growth / pool_denominator
+        pool_valid = (pool > 0) & (pool < 1)
+
+        # Scenarios down the rows, securities across the columns
+        discount_factor = (1.0 - conv_discounts / 100.0)[None, :]
+        conv_amounts, conv_caps = conv_amounts[None, :], conv_caps[None, :]
+        conv_post_cap, uncapped = conv_post_cap[None, :], np.isnan(conv_caps)
+        pre_money_col = pre_moneys[:, None]
+        n_scenarios = len(amounts)
+        total_conv = np.zeros(n_scenarios, dtype=np.float64)
+        conversions = np.zeros((n_scenarios, conv_amounts.shape[1]), dtype=np.float64)
+        regime = None
+        for _ in range(MAX_REGIME_PASSES):
+            pool_on = pool_valid & (pool_a + pool_b * total_conv > 0)
+            # Pre-money share count S0 + C (+ X) and pre-money cap base S0 (+ X), as const + slope * C
+            x_a = np.where(pool_on, pool_a, 0.0) if pre_pool else np.zeros(n_scenarios)
+            x_b = np.where(pool_on, pool_b, 0.0) if pre_pool else np.zeros(n_scenarios)
+            pre_a, pre_b = (base_shares + x_a)[:, None], (1.0 + x_b)[:, None]
+            cap_pre_a, cap_pre_b = (base_shares + x_a)[:, None], x_b[:, None]
+
+            # Pick each security's cheaper conversion price at the current estimate
+            conv_col = total_conv[:, None]
+            discount_price = pre_money_col * discount_factor / (pre_a + pre_b * conv_col)
+            cap_base_a = np.where(conv_post_cap, base_shares, cap_pre_a)
+            cap_base_b = np.where(conv_post_cap, 1.0, cap_pre_b)
+            cap_price = np.where(uncapped, np.inf, conv_caps / (cap_base_a + cap_base_b * conv_col))
+            use_cap = cap_price < discount_price
+            if regime is not None and np.array_equal(use_cap, regime[0]) and np.array_equal(pool_on, regime[1]):
+                break
+            regime = (use_cap, pool_on)
+
+            # c_i = alpha_i + beta_i * C in the chosen branches
+            alpha = np.where(use_cap, conv_amounts * cap_base_a / conv_caps,
+                             conv_amounts * pre_a / (pre_money_col * discount_factor))
+            beta = np.where(use_cap, conv_amounts * cap_base_b / conv_caps,
+                            conv_amounts * pre_b / (pre_money_col * discount_factor))
+            beta_sum = beta.sum(axis=1)
+            if np.any(beta_sum >= 1):
+                raise ValueError(f"{round_type}: the converting securities' caps would give them the whole company")
+            total_conv = alpha.sum(axis=1) / (1.0 - beta_sum)
+            conversions = alpha + beta * total_conv[:, None]
+        else:
+            logger.warning(f"{round_type}: conversion branches did not settle after {MAX_REGIME_PASSES} passes.")
+
+        pool_on = pool_valid & (pool_a + pool_b * total_conv > 0)
+        pre_round_shares = base_shares + total_conv
+        if pre_pool:
+            pool_increase = np.where(pool_on, pool_a + pool_b * total_conv, 0.0)
+            pre_round_shares = pre_round_shares + pool_increase
+            price_per_share = pre_moneys / pre_round_shares
+            new_shares = amounts / price_per_share
+        else:
+            price_per_share = pre_moneys / pre_round_shares
+            new_shares = amounts / price_per_share
+            before_pool = pre_round_shares + new_shares
+            pool_increase = np.where(pool_valid, np.maximum(0.0, (pool * before_pool - pool_shares) / (1.0 - pool)), 0.0)
+
+    summary = {
+        "post_money_valuation": pre_moneys + amounts,
+        "price_per_share": price_per_share,
+        "new_shares": new_shares,
+        "pool_increase": pool_increase,
+        "conversion_shares": total_conv,
+        "total_shares": base_shares + total_conv + pool_increase + new_shares,
+    }
+    return summary, conversions
+
+
+def _solve_priced_round(round_event: Dict[str, Any], base_shares: float, pool_shares: float,
+                        conv_amounts: np.ndarray, conv_discounts: np.ndarray, conv_caps: np.ndarray,
+                        conv_post_cap: np.ndarray) -> Tuple[Dict[str, float], np.ndarray]:
+    """_solve_priced_rounds for one normalized priced event. Returns its summary and the per-security shares."""
+    amount, pre_money = round_event["amount"], round_event["preMoney"]
+    solved, conversions = _solve_priced_rounds(
+        round_event["roundType"], np.array([amount]), np.array([pre_money]), np.array([round_event["poolPct"]]),
+        round_event["poolTiming"] == "pre", base_shares, pool_shares, conv_amounts, conv_discounts, conv_caps,
+        conv_post_cap)
+    summary = {
+        "roundType": round_event["roundType"],
+        "amount": amount,
+        "pre_money_valuation": pre_money,
+        "pool_timing": round_event["poolTiming"],
+        **{key: values[0].item() for key, values in solved.items()},
+    }
+    return summary, conversions[0]
+
+
+def _conversion_vectors(pending: List[Dict[str, Any]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Amount with accrued interest, discount, cap (NaN if uncapped) and post-money cap flag of each security."""
+    return (np.array([c["amount"] * (1 + c["interestPct"] / 100.0 * c["years"]) for c in pending], dtype=np.float64),
+            np.array([c["discount"] for c in pending], dtype=np.float64),
+            np.array([c["cap"] if c["cap"] else np.nan for c in pending], dtype=np.float64),
+            np.array([c["capType"] == "post" for c in pending], dtype=bool))
+
+
+# --- Waterfall ---
+def compute_waterfall(events: List[Dict[str, Any]], columns: InvestorColumns) -> Dict[str, Any]:
+    """
+    Runs the ordered financing events over the sheet's investors. SAFEs and notes
+    wait for the next priced round and convert in it; each priced round adds its
+    investors and tops the option pool up to its poolPct. Returns the compute_round
+    `calcs` shape (top-level values are those of the last priced round) plus
+    "rounds" (per priced round), "added_holders" and "outstanding_convertibles".
+    """
+    events = normalize_events(events)
+    if not any(event["type"] == "priced" for event in events):
+        raise ValueError("The events need at least one priced round")
+
+    base_shares = float(columns.pre_shares.sum())
+    pool_shares = 0.0
+    holders: List[Tuple[str, float, float]] = []  # (name, investment, shares) added by the events, in order
+    pending: List[Dict[str, Any]] = []
+    rounds = []
+    for event in events:
+        if event["type"] != "priced":
+            pending.append(event)
+            continue
+
+        # Vectors over the securities converting in this round
+        conv_amounts, conv_discounts, conv_caps, conv_post_cap = _conversion_vectors(pending)
+        summary, conversions = _solve_priced_round(event, base_shares, pool_shares, conv_amounts, conv_discounts,
+                                                   conv_caps, conv_post_cap)
+
+        summary["conversions"] = []
+        for security, converted, shares in zip(pending, conv_amounts.tolist(), conversions.tolist()):
+            holders.append((security["name"], security["amount"], shares))
+            summary["conversions"].append({"name": security["name"], "type": security["type"], "amount_converted": converted,
+                                           "shares": shares, "conversion_price": converted / shares if shares else None})
+        holders.append((f"{event['roundType']} Investors", event["amount"], summary["new_shares"]))
+        pool_shares += summary["pool_increase"]
+        base_shares = summary["total_shares"]
+        pending = []
+        rounds.append(summary)
+
+    if pending:
+        logger.warning(f"{len(pending)} SAFE/note(s) after the last priced round stay unconverted.")
+
+    last = rounds[-1]
+    calcs: Dict[str, Any] = {
+        "post_money_valuation": last["post_money_valuation"],
+        "price_per_share": last["price_per_share"],
+        "total_new_shares_for_round": last["new_shares"],
+        "option_pool_shares": pool_shares,
+        "total_post_money_shares": base_shares,
+        "precision": "float",
+        "rounds": rounds,
+        "outstanding_convertibles": pending,
+    }
+
+    # Ownership of every holder in one division over the concatenated share vector
+    added_names = [name for name, _, _ in holders] + ["Option Pool"]
+    added_shares = np.array([shares for _, _, shares in holders] + [pool_shares], dtype=np.float64)
+    ownership = np.concatenate([columns.pre_shares, added_shares]) / base_shares
+    n_investors = len(columns)
+    added_ownership = ownership[n_investors:].tolist()
+    calcs["added_holders"] = [
+        {"name": name, "investment": investment, "shares": shares, "ownership": pct}
+        for (name, investment, shares), pct in zip(holders + [("Option Pool", None, pool_shares)], added_ownership)
+    ]
+    return add_holder_results(calcs, columns, columns.pre_shares.tolist(), ownership[:n_investors].tolist(),
+                              list(zip(added_names, added_shares.tolist(), added_ownership)))
+
+
+# --- Scenario Sweeps ---
+def compute_waterfall_scenarios(slots: Dict[str, Any], columns: InvestorColumns, amounts: np.ndarray,
+                                pre_moneys: np.ndarray, pool_pcts: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    compute_scenarios for the chat slots' waterfall (convertibles, then one priced
+    round with a pre- or post-money pool): S variants of the priced round are solved
+    in one broadcast pass. Returns compute_scenarios' arrays; a scenario matches
+    compute_waterfall for the same slots.
+    """
+    if slots.get("rounds"):
+        raise ValueError("Scenario sweeps vary the chat round slots, not an explicit 'rounds' list")
+    # Validates the securities and round settings, with the first scenario's values
+    first = {"amount": amounts[0].item(), "preMoney": pre_moneys[0].item(), "poolPct": pool_pcts[0].item()}
+    *pending, round_event = normalize_events(events_from_slots({**slots, **first}))
+    for name, values in (("amount", amounts), ("preMoney", pre_moneys), ("poolPct", pool_pcts)):
+        if not np.all(np.isfinite(values)) or np.any(values < 0):
+            raise ValueError(f"Scenario '{name}' values must be non-negative numbers")
+    if np.any(pre_moneys <= 0):
+        raise ValueError("Scenario preMoney values must be positive for a priced round")
+    if np.any(pool_pcts >= 100):
+        raise ValueError("Scenario poolPct values must be below 100")
+
+    solved, _ = _solve_priced_rounds(round_event["roundType"], amounts, pre_moneys, pool_pcts,
+                                     round_event["poolTiming"] == "pre", float(columns.pre_shares.sum()), 0.0,
+                                     *_conversion_vectors(pending))
+    total = solved["total_shares"]
+    inv_total = 1.0 / total
+    return {
+        "post_money_valuation": solved["post_money_valuation"],
+        "price_per_share": solved["price_per_share"],
+        "total_new_shares_for_round": solved["new_shares"],
+        "option_pool_shares": solved["pool_increase"],
+        "total_post_money_shares": total,
+        "new_investors_pct": solved["new_shares"] * inv_total,
+        "option_pool_pct": solved["pool_increase"] * inv_total,
+        "ownership": inv_total[:, None] * columns.pre_shares[None, :],
+    }